@@ -11,6 +11,9 @@ bl_info = {
     "support": "COMMUNITY",
     "category": "Import-Export"}
 
+import time
+addon_load_start = time.perf_counter()
+
 import bpy
 
 from bpy.path import display_name_from_filepath
@@ -19,8 +22,26 @@ from bpy.props import StringProperty, BoolProperty, IntProperty, CollectionPrope
 from bpy_extras.io_utils import ImportHelper, ExportHelper
 
 import os
-import subprocess
-import re
+
+# Only the operator and panel shells live here. The import pipeline, converters and caches are in
+# submodules that are imported when first used, so the addon costs next to nothing at startup.
+
+class DOS2DEImporterRenamePattern(PropertyGroup):
+    """A find/replace rule applied to the names of renamed objects"""
+    enabled = BoolProperty(
+        name="Enabled",
+        default=True
+    )
+
+    find = StringProperty(
+        name="Find",
+        description="Text to replace in the name. Matched literally"
+    )
+
+    replace = StringProperty(
+        name="Replace",
+        description="The text to replace it with"
+    )
 
 class DivinityImporterAddonPreferences(AddonPreferences):
     bl_idname = "dos2de_collada_importer"
@@ -37,6 +58,82 @@ class DivinityImporterAddonPreferences(AddonPreferences):
         subtype="DIR_PATH"
     )
 
+    divine_timeout = IntProperty(
+        name="Conversion Timeout (s)",
+        description="How long divine may take to convert a gr2 before it's stopped, on top of the time per MB. 0 disables the timeout",
+        min=0,
+        default=120
+    )
+
+    divine_timeout_per_mb = FloatProperty(
+        name="Seconds per MB",
+        description="Extra time divine may take for each MB of the gr2 being converted",
+        min=0.0,
+        default=30.0
+    )
+
+    divine_retries = IntProperty(
+        name="Conversion Retries",
+        description="How many more times a failed or stopped conversion is tried before the file is quarantined and skipped in later imports",
+        min=0,
+        max=10,
+        default=1
+    )
+
+    proxy_cache_limit = IntProperty(
+        name="Proxy Cache Limit (MB)",
+        description="The disk space reduced resolution texture copies may use before the least recently used are deleted. 0 disables the limit",
+        min=0,
+        default=2048
+    )
+
+    prefetch_limit = IntProperty(
+        name="Prefetch Limit (MB)",
+        description="How much texture data may be read ahead in the background per import batch. 0 disables the limit",
+        min=0,
+        default=1024
+    )
+
+    library_cache_limit = IntProperty(
+        name="Library Cache Limit (MB)",
+        description="The disk space cached asset libraries may use before the least recently used are deleted. 0 disables the limit",
+        min=0,
+        default=4096
+    )
+
+    divine_service_enabled = BoolProperty(
+        name="Use Conversion Service",
+        description="Send gr2 conversions to the local conversion service shared by all Blender sessions on this machine, when it's running",
+        default=False
+    )
+
+    divine_service_port = IntProperty(
+        name="Service Port",
+        description="The local port the conversion service listens on",
+        min=1024,
+        max=65535,
+        default=47823 # divine_service.default_port
+    )
+
+    divine_service_workers = IntProperty(
+        name="Service Workers",
+        description="How many divine processes a service started from here may run at once",
+        min=1,
+        default=2
+    )
+
+    divine_service_cache_limit = IntProperty(
+        name="Service Cache Limit (MB)",
+        description="The disk space converted files in a service started from here may use before the least recently used are deleted. 0 disables the limit",
+        min=0,
+        default=4096
+    )
+
+    rename_user_patterns = CollectionProperty(
+        type=DOS2DEImporterRenamePattern,
+        name="Rename Patterns"
+    )
+
     def draw(self, context):
         layout = self.layout
         box = layout.box()
@@ -46,325 +143,76 @@ class DivinityImporterAddonPreferences(AddonPreferences):
         row.prop(self, "divine_path")
         row = box.row()
         row.prop(self, "extracted_assets_dir")
+        row = box.row()
+        row.prop(self, "divine_timeout")
+        row.prop(self, "divine_timeout_per_mb")
+        row = box.row()
+        row.prop(self, "divine_retries")
+        row.operator(DOS2DEImporter_OT_ClearQuarantine.bl_idname, icon="CANCEL")
+        row = box.row()
+        row.prop(self, "proxy_cache_limit")
+        row = box.row()
+        row.prop(self, "prefetch_limit")
+        row = box.row()
+        row.prop(self, "library_cache_limit")
+        box = layout.box()
+        row = box.row()
+        row.label(text="Conversion Service:", icon="LINKED")
+        row = box.row()
+        row.prop(self, "divine_service_enabled")
+        if self.divine_service_enabled:
+            row = box.row()
+            row.prop(self, "divine_service_port")
+            row = box.row()
+            row.prop(self, "divine_service_workers")
+            row.prop(self, "divine_service_cache_limit")
+            row.operator(DOS2DEImporter_OT_StartDivineService.bl_idname, icon="PLAY")
+        box = layout.box()
+        row = box.row()
+        row.label(text="Rename Patterns:", icon="SORTALPHA")
+        row.operator(DOS2DEImporter_OT_AddRenamePattern.bl_idname, icon="ZOOMIN")
+        for index,pattern in enumerate(self.rename_user_patterns):
+            row = box.row(align=True)
+            row.prop(pattern, "enabled", text="")
+            row.prop(pattern, "find", text="")
+            row.prop(pattern, "replace", text="")
+            op = row.operator(DOS2DEImporter_OT_RemoveRenamePattern.bl_idname, text="", icon="X")
+            op.index = index
+
+class DOS2DEImporter_OT_AddRenamePattern(Operator):
+    """Add a find/replace rule, applied to every renamed object along with the built-in patterns"""
+    bl_idname = "dos2deimporter.op_add_rename_pattern"
+    bl_label = "Add Pattern"
 
+    def execute(self, context):
+        preferences = context.user_preferences.addons["dos2de_collada_importer"].preferences
+        preferences.rename_user_patterns.add()
+        return {'FINISHED'}
 
-base_skeleton_directories = ["Dwarves", "Elves", "Humans", "Lizards"]
-base_skeleton_dict = {}
+class DOS2DEImporter_OT_RemoveRenamePattern(Operator):
+    """Remove this rename pattern"""
+    bl_idname = "dos2deimporter.op_remove_rename_pattern"
+    bl_label = "Remove Pattern"
 
-def get_base_skeletons(scene, context):
-    assets_dir = ""
-    if "dos2de_collada_importer" in context.user_preferences.addons:
+    index = IntProperty(options={"HIDDEN"})
+
+    def execute(self, context):
         preferences = context.user_preferences.addons["dos2de_collada_importer"].preferences
-        if preferences is not None:
-            if "extracted_assets_dir" in preferences:
-                assets_dir = preferences.extracted_assets_dir
-    
-    skeletons = [("DISABLED", "Disabled", "")]
-    skeletons.append(("AUTO", "Auto", "Auto-select a base skeleton to conform to, based on the file name.\nThis happens when importing, to support multiple imports"))
-
-    if assets_dir != "" and os.path.isdir(assets_dir):
-        characters_dir = os.path.join(assets_dir, "Characters")
-        if os.path.isdir(characters_dir):
-            for race in base_skeleton_directories:
-                race_dir = os.path.join(characters_dir, race)
-                if os.path.isdir(race_dir):
-                    base_skeleton_f = os.path.join(race_dir, race + "_Female_Base.gr2")
-                    base_skeleton_m = os.path.join(race_dir, race + "_Male_Base.gr2")
-
-                    global base_skeleton_dict
-
-                    if os.path.isfile(base_skeleton_f):
-                        key = race + "_Female"
-                        display = race + " Female"
-                        skeletons.append((key, display, base_skeleton_f))
-                        base_skeleton_dict[key] = (base_skeleton_f, race, "Female")
-
-                    if os.path.isfile(base_skeleton_m):
-                        key = race + "_Male"
-                        display = race + " Male"
-                        skeletons.append((key, display, base_skeleton_m))
-                        base_skeleton_dict[key] = (base_skeleton_m, race, "Male")
-
-    return skeletons
-
-rename_race_patterns = [
-    ("Dwarves_Female", "DF"), 
-    ("Dwarves_Male", "DM"),
-    ("Elves_Female", "EF"),
-    ("Elves_Male", "EM"),
-    ("Humans_Female", "HF"),
-    ("Humans_Male", "HM"),
-    ("Lizards_Female", "LF"),
-    ("Lizards_Male", "LM")
-]
-
-rename_patterns = [
-    ("_MeshShape", "")
-]
-
-hero_pattern = re.compile(r'.*(Dwarves|Elves|Humans|Lizards)_(Male|Female)')
-
-texture_pattern_basecolor = "{}.*?_(BM|BMA).dds"
-texture_pattern_mskcloth = "{}.*?_(MSKcloth).dds"
-texture_pattern_mskskin = "{}.*?_(MSKskin).dds"
-texture_pattern_normalmap = "{}.*?_(NM).dds"
-texture_pattern_physical = "{}.*?_(PM).dds"
-
-class DOS2_Material_Textures():
-    def __init__(self, bm=None, nm=None, pm=None):
-        self.basecolor = bm
-        self.normalmap = nm
-        self.physicalmap = pm
-        self.textures = [bm,nm,pm]
-
-def get_textures(obj, filename, context, assets_dir):
-    textures = None
-    m = hero_pattern.match(filename)
-    if m != None:
-        race = m.group(1)
-        gender = m.group(2)
-        racegender = "{}_{}".format(race, gender)
-        textures_dir = os.path.join(assets_dir, "Textures/Characters/{}/{}".format(race, racegender))
-        if os.path.isdir(textures_dir):
-            bm_pattern = re.compile(texture_pattern_basecolor.format(filename))
-            nm_pattern = re.compile(texture_pattern_normalmap.format(filename))
-            pm_pattern = re.compile(texture_pattern_physical.format(filename))
-            files = list([f for f in os.listdir(textures_dir) if f.endswith(".dds")])
-            basemap_texture = next(iter([f for f in files if bm_pattern.match(f)]), None)
-            normalmap_texture = next(iter([f for f in files if nm_pattern.match(f)]), None)
-            physicalmap_texture = next(iter([f for f in files if pm_pattern.match(f)]), None)
-            if basemap_texture != None:
-                basemap_texture = os.path.join(textures_dir, basemap_texture)
-            if normalmap_texture != None:
-                normalmap_texture = os.path.join(textures_dir, normalmap_texture)
-            if physicalmap_texture != None:
-                physicalmap_texture = os.path.join(textures_dir, physicalmap_texture)
-            textures = DOS2_Material_Textures(
-                bm=basemap_texture, 
-                nm=normalmap_texture, 
-                pm=physicalmap_texture
-            )
-    else:
-        textures = DOS2_Material_Textures()
-    return textures
-
-def float_lerp(a, b, t):
-    return (1.0 - t) * a + t * b
-
-def sum_heights(nodes_array):
-    result = 0
-    for node in nodes_array:
-        result = result + node.height
-    return result
-
-def sum_widths(depth_nodes):
-    result = 0
-    for depth in depth_nodes:
-        max_width = 0
-        for node in depth_nodes[depth]:
-            if max_width < node.width:
-                max_width = node.width
-        result = result + max_width
-    return result
-
-def calc_priority_by_socket(node):
-    if len(node.inputs) is 0:
-        return -9999
-    if len(node.outputs) is 0:
-        return 9999
-
-    result = 0
-    for in_socket in node.inputs:
-        if in_socket.is_linked:
-            for link in in_socket.links:
-                if link.is_valid:
-                    if len(link.from_node.inputs) is 0:
-                        result -= 1
-                    else:
-                        result += 2
-
-    for out_socket in node.outputs:
-        if out_socket.is_linked:
-            for link in out_socket.links:
-                if link.is_valid:
-                    if len(link.to_node.outputs) is 0:
-                        result += 10
-                    else:
-                        result -= 1
-
-    return result
-
-def arrange_nodes(node_array, calc_priority, horiz_padding=0.125, vert_padding=0.125):
-
-    # Create a dictionary where the key is the
-    # depth and the value is an array of nodes.
-    depth_nodes = {}
-    for node in node_array:
-
-        depth = calc_priority(node)
-        if depth in depth_nodes:
-
-            # Add the node to the node array at that depth.
-            depth_nodes[depth].append(node)
-        else:
+        if self.index < len(preferences.rename_user_patterns):
+            preferences.rename_user_patterns.remove(self.index)
+        return {'FINISHED'}
+
+
+def get_base_skeletons(scene, context):
+    from . import divine
+    return divine.get_base_skeletons(scene, context)
 
-            # Begin a new array.
-            depth_nodes[depth] = [node]
-
-    # Add padding to half the width.
-    extents_w = (0.5 + horiz_padding) * sum_widths(depth_nodes)
-    t_w_max = 0.5
-    sz0 = len(depth_nodes)
-    if sz0 > 1:
-        t_w_max = 1.0 / (sz0 - 1)
-
-    # List of dictionary KVPs.
-    depths = sorted(depth_nodes.items())
-    depths_range = range(0, sz0, 1)
-    for i in depths_range:
-        nodes_array = depths[i][1]
-        t_w = i * t_w_max
-        x = float_lerp(-extents_w, extents_w, t_w)
-
-        extents_h = (0.5 + vert_padding) * sum_heights(nodes_array)
-        t_h_max = 0.5
-        sz1 = len(nodes_array)
-        if sz1 > 1:
-            t_h_max = 1.0 / (sz1 - 1)
-
-        nodes_range = range(0, sz1, 1)
-        for j in nodes_range:
-            node = nodes_array[j]
-            t_h = j * t_h_max
-            y = float_lerp(-extents_h, extents_h, t_h)
-            half_w = 0.5 * node.width
-            half_h = 0.5 * node.height
-            node.location.xy = (x - half_w, y - half_h)
-
-def get_image(file, context):
-    if file != "" and file != None:
-        for img in bpy.data.images:
-            if img.filepath != "" and img.filepath != None:
-                if img.filepath == file:
-                    return img
-                elif bpy.path.basename(img.filepath) == bpy.path.basename(file):
-                    img.filepath = file
-                    return img
-        print("Loading image: " + file)
-        img = bpy.data.images.load(file, check_existing=True)
-        return img
-    return None
-
-def get_node_type(nodes, name):
-    for x in nodes:
-        print("{} ? {}".format(x.bl_idname, name))
-        if name in x.bl_idname:
-            return x
-    return None
-
-def offset_node_x(node, bynode, padding=50):
-    node.location[0] = (bynode.location[0] + bynode.width) + padding
-    node.location[1] = bynode.location[1]
-
-def offset_node_y(node, bynode, padding=200):
-    node.location[1] = (bynode.location[1] - bynode.height) - padding
-    node.location[0] = bynode.location[0]
-
-def create_dos2de_nodes(mat, context, textures=None):
-    nodes = mat.node_tree.nodes
-    links = mat.node_tree.links
-
-    diffuse = get_node_type(nodes, "ShaderNodeBsdfDiffuse")
-    if diffuse is not None:
-        #diffuse = nodes.new("ShaderNodeBsdfDiffuse")
-        nodes.remove(diffuse)
-    shader = nodes.new("ShaderNodeBsdfPrincipled")
-    #diffuse.location = (50,0)
-
-    bm_input = 0
-    nm_input = 17
-    metal_input = 4
-    roughness_input = 7
-
-    index = 0
-    for inputnode in shader.inputs:
-        if inputnode.name == "Normal":
-            nm_input = index
-        elif inputnode.name == "Roughness":
-            roughness_input = index
-        elif inputnode.name == "Metalness":
-            metal_input = index
-        elif inputnode.name == "Base Color":
-            bm_input = index
-        index = index + 1
-
-    bm_node = nodes.new("ShaderNodeTexImage")
-    bm_node.location = (10,0)
-    bm_node.label = "BaseColor"
-    if textures != None:
-        bm_tex = get_image(textures.basecolor, context)
-        bm_node.image = bm_tex
-    links.new(bm_node.outputs[0], shader.inputs[bm_input])
-
-    pm_node = nodes.new("ShaderNodeTexImage")
-    offset_node_y(pm_node, bm_node)
-    pm_node.label = "PhysicalMap"
-    if textures != None:
-        pm_tex = get_image(textures.physicalmap, context)
-        pm_node.image = pm_tex
-    pm_node.color_space = "NONE"
-    pmsep_node = nodes.new("ShaderNodeSeparateXYZ")
-    offset_node_x(pmsep_node, pm_node)
-    links.new(pm_node.outputs[0], pmsep_node.inputs[0])
-    links.new(pmsep_node.outputs[0], shader.inputs[metal_input])
-    links.new(pmsep_node.outputs[1], shader.inputs[roughness_input])
-
-    nm_node = nodes.new("ShaderNodeTexImage")
-    offset_node_y(nm_node, pm_node)
-    nm_node.label = "NormalMap"
-    if textures != None:
-        nm_tex = get_image(textures.normalmap, context)
-        nm_node.image = nm_tex
-    nm_node.color_space = "NONE"
-
-    sep_node = nodes.new("ShaderNodeSeparateXYZ")
-    offset_node_x(sep_node, nm_node)
-    invert_node = nodes.new("ShaderNodeInvert")
-    offset_node_x(invert_node, sep_node)
-    combine_node = nodes.new("ShaderNodeCombineXYZ")
-    offset_node_x(combine_node, invert_node)
-    vector_node = nodes.new("ShaderNodeNormalMap")
-    offset_node_x(vector_node, combine_node)
-    links.new(nm_node.outputs[0], sep_node.inputs[0])
-    links.new(nm_node.outputs[1], combine_node.inputs[0]) # Alpha to Red Channel
-    links.new(sep_node.outputs[1], invert_node.inputs[1]) # Invert Green for OpenGL
-    links.new(sep_node.outputs[2], combine_node.inputs[2]) # Blue to Blue Channel
-    links.new(invert_node.outputs[0], combine_node.inputs[1]) # Inverted Green to Green Channel
-    links.new(combine_node.outputs[0], vector_node.inputs[0]) # Combined XYZ to Normal Map
-    links.new(vector_node.outputs[0], shader.inputs[nm_input])
-
-    offset_node_x(shader, vector_node)
-    shader.location[1] = bm_node.location[1]
-
-    output = get_node_type(nodes, "ShaderNodeOutputMaterial")
-    if output is None:
-        output = nodes.new("ShaderNodeOutputMaterial")
-    offset_node_x(output, shader)
-    links.new(shader.outputs[0], output.inputs[0])
-
-def create_material(mat_name, obj, file, context, assets_dir):
-    textures = get_textures(obj, file, context, assets_dir)
-    if textures != None:
-        mat = bpy.data.materials.new(mat_name)
-        obj.data.materials.append(mat)
-        mat.use_nodes = True
-        create_dos2de_nodes(mat, context, textures)
-
-            #arrange_nodes(nodes, calc_priority_by_socket)
-        return True
-    #except Exception as e:
-    #    print("[DOS2DE-Importer:create_material] Error creating material for '{}':\n    {}".format(obj.name, e))
-    #    return False
+texture_proxy_levels = (
+    ("FULL", "Full", "Use the full resolution textures"),
+    ("HALF", "1/2", "Use textures at half resolution"),
+    ("QUARTER", "1/4", "Use textures at a quarter of their resolution"),
+    ("EIGHTH", "1/8", "Use textures at an eighth of their resolution")
+)
 
 class DOS2DE_IMPORTER_OT_nodes_create_material(Operator):
     """Insert a basic PBR node setup for DOS2DE textures"""
@@ -377,6 +225,7 @@ class DOS2DE_IMPORTER_OT_nodes_create_material(Operator):
         return context.active_object is not None and context.active_object.active_material is not None
 
     def execute(self, context):
+        from .materials import create_dos2de_nodes
         mat = context.active_object.active_material
         create_dos2de_nodes(mat, context)
         return {'FINISHED'}
@@ -387,6 +236,89 @@ class DOS2DE_IMPORTER_OT_nodes_create_material(Operator):
     def invoke(self, context, _event):
         return self.execute(context)
 
+class DOS2DE_IMPORTER_OT_rebuild_materials(Operator):
+    """Build DOS2DE PBR materials for the selected meshes, finding their textures from their names. Meshes with the same textures share a material"""
+    bl_label = "Rebuild Materials"
+    bl_idname = "dos2deimporter.rebuild_materials"
+    bl_options = {"REGISTER", "UNDO"}
+
+    all_objects = BoolProperty(
+        name="All Objects",
+        description="Rebuild materials for every mesh in the scene, instead of the selected objects",
+        default=False)
+
+    def execute(self, context):
+        from .materials import rebuild_materials
+        assets_dir = ""
+        if "dos2de_collada_importer" in context.user_preferences.addons:
+            preferences = context.user_preferences.addons["dos2de_collada_importer"].preferences
+            if preferences is not None and "extracted_assets_dir" in preferences:
+                assets_dir = preferences.extracted_assets_dir
+        if assets_dir == "":
+            self.report({"ERROR"}, "[DOS2DE-Importer] Set the Shared Assets path in the addon preferences to find textures.")
+            return {'CANCELLED'}
+
+        convert_normalmap = False
+        proxy_level = "FULL"
+        settings = getattr(context.scene, "dos2de_importer_settings", None)
+        if settings is not None:
+            convert_normalmap = settings.use_converted_normalmaps
+            proxy_level = settings.texture_proxy_level
+
+        objects = context.scene.objects if self.all_objects else context.selected_objects
+        meshes = [obj for obj in objects if obj.type == "MESH"]
+        assigned,built = rebuild_materials(context, meshes, assets_dir, convert_normalmap, proxy_level)
+        self.report({"INFO"}, "[DOS2DE-Importer] Assigned materials to '{}' of '{}' meshes, building '{}' new materials.".format(
+            assigned, len(meshes), built))
+        return {'FINISHED'}
+
+class DOS2DE_IMPORTER_OT_set_texture_proxy(Operator):
+    """Swap imported textures in the selected objects' materials to the chosen resolution"""
+    bl_label = "Set Texture Size"
+    bl_idname = "dos2deimporter.set_texture_proxy"
+    bl_options = {"REGISTER", "UNDO"}
+
+    proxy_level = EnumProperty(
+        name="Texture Size",
+        items=texture_proxy_levels,
+        default="FULL")
+
+    all_objects = BoolProperty(
+        name="All Objects",
+        description="Swap textures for every object in the scene, instead of the selected objects",
+        default=False)
+
+    def execute(self, context):
+        from .materials import get_texture_image
+        objects = context.scene.objects if self.all_objects else context.selected_objects
+        materials = set()
+        for obj in objects:
+            for slot in obj.material_slots:
+                if slot.material is not None and slot.material.node_tree is not None:
+                    materials.add(slot.material)
+
+        swapped = 0
+        replaced = set()
+        for mat in materials:
+            for node in mat.node_tree.nodes:
+                if node.type == "TEX_IMAGE" and node.image is not None:
+                    source = node.image.get("dos2de_source")
+                    if source is not None and node.image.get("dos2de_proxy") != self.proxy_level and os.path.isfile(source):
+                        replaced.add(node.image)
+                        node.image = get_texture_image(source, context, self.proxy_level)
+                        swapped += 1
+
+        # Unused images keep their pixels loaded until the file is reloaded, so remove them to free the memory
+        freed = 0
+        for image in replaced:
+            if image.users == 0 and not image.use_fake_user:
+                bpy.data.images.remove(image)
+                freed += 1
+
+        self.report({"INFO"}, "[DOS2DE-Importer] Swapped '{}' textures in '{}' materials, freeing '{}' unused images.".format(
+            swapped, len(materials), freed))
+        return {'FINISHED'}
+
 class NODE_PT_dos2de_material_helpers(Panel):
     bl_space_type = 'NODE_EDITOR'
     bl_region_type = 'UI'
@@ -407,6 +339,49 @@ class NODE_PT_dos2de_material_helpers(Panel):
         row = layout.row()
         col = row.column(align=True)
         col.operator(DOS2DE_IMPORTER_OT_nodes_create_material.bl_idname)
+        col.operator(DOS2DE_IMPORTER_OT_rebuild_materials.bl_idname)
+        col.operator_menu_enum(DOS2DE_IMPORTER_OT_set_texture_proxy.bl_idname, "proxy_level", text="Texture Size")
+        col.operator(DOS2DE_IMPORTER_OT_set_texture_proxy.bl_idname, text="Full Resolution Textures").proxy_level = "FULL"
+
+manifest_data_types = (
+    ("OBJECT", "Object", ""),
+    ("MESH", "Mesh", ""),
+    ("ARMATURE", "Armature", ""),
+    ("ACTION", "Action", ""),
+    ("MATERIAL", "Material", "")
+)
+
+class DOS2DEImporterManifestItem(PropertyGroup):
+    """A datablock created by importing a manifest entry's source file. The name is the datablock name"""
+    data_type = EnumProperty(
+        name="Type",
+        items=manifest_data_types,
+        default="OBJECT"
+    )
+
+class DOS2DEImporterManifestEntry(PropertyGroup):
+    """A source file imported into this scene. The name is the normalized source path"""
+    filepath = StringProperty(
+        name="Source",
+        description="The file this entry was imported from",
+        subtype="FILE_PATH",
+        default=""
+    )
+
+    content_hash = StringProperty(
+        name="Hash",
+        description="SHA-1 of the source file contents when it was last synced. Empty if it was last imported without Sync Mode",
+        default=""
+    )
+
+    stat_key = StringProperty(
+        name="Stat",
+        description="Size and modification time of the source file when it was last imported",
+        options={"HIDDEN"},
+        default=""
+    )
+
+    items = CollectionProperty(type=DOS2DEImporterManifestItem)
 
 class DOS2DEImporterSettings(PropertyGroup):
     bl_label = "Divinity Collada Importer"
@@ -489,11 +464,57 @@ class DOS2DEImporterSettings(PropertyGroup):
 		description="Rename fluff in imported object names, such as 'MeshShape' for meshes",
 		default=True)
 
+    rename_dry_run = BoolProperty(
+		name="Preview Renames",
+		description="Only print the names objects would be renamed to, without renaming them",
+		default=False)
+
     use_build_material = BoolProperty(
 		name="Create Materials",
 		description="Automatically find associated textures and build materials. Only guaranteed to work if names match and the Shared assets directory is set",
 		default=False)
 
+    use_converted_normalmaps = BoolProperty(
+        name="Convert Normal Maps",
+        description="Convert normal maps to the standard OpenGL layout once (cached on disk), instead of building a conversion node chain in every material",
+        default=False)
+
+    texture_proxy_level = EnumProperty(
+        name="Texture Size",
+        description="Build materials with reduced resolution copies of the textures, cached on disk, to save memory while posing and previewing",
+        items=texture_proxy_levels,
+        default="FULL")
+
+    texture_prefetch = BoolProperty(
+        name="Prefetch Textures",
+        description="Read the textures materials will use in the background while files are converted and imported, so loading them doesn't wait on the disk",
+        default=True)
+
+    weights_clean_enabled = BoolProperty(
+        name="Clean Weights",
+        description="Limit influences per vertex, prune tiny weights, normalize, and remove empty vertex groups on imported meshes",
+        default=False)
+
+    weights_max_influences = IntProperty(
+        name="Max Influences",
+        description="The most bones a vertex may be weighted to. The engine supports 4",
+        min=1,
+        max=8,
+        default=4)
+
+    weights_prune_threshold = FloatProperty(
+        name="Prune Below",
+        description="Remove weights smaller than this",
+        min=0.0,
+        max=1.0,
+        precision=4,
+        default=0.001)
+
+    use_dedup_meshes = BoolProperty(
+        name="Share Identical Meshes",
+        description="Point imported objects at an existing mesh when their geometry, UVs, vertex groups and materials are identical, and free the duplicate",
+        default=False)
+
     auto_connect = BoolProperty(
 		name="Auto Connect",
 		description="Set use_connect for parent bones which have exactly one child bone",
@@ -524,6 +545,24 @@ class DOS2DEImporterSettings(PropertyGroup):
 		description="Store Bindpose information in custom bone properties for later use during Collada export",
 		default=True)
 
+    import_animations = BoolProperty(
+		name="Import Animations",
+		description="Import the animations in the file as actions. When disabled, animations are stripped from the file before Blender reads it",
+		default=True)
+
+    dae_prefilter = BoolProperty(
+		name="Strip Deleted Meshes",
+		description="When meshes will be deleted after importing, strip their geometry, skinning and materials from the file before Blender reads it. Bones are then built from the node hierarchy alone, without the skin's bind poses",
+		default=False)
+
+    library_cache_mode = EnumProperty(
+        name="Library Cache",
+        description="Save each imported file to a cached .blend library, and load it from there the next time the unchanged file is imported with the same settings",
+        items=(("DISABLED", "Disabled", ""),
+               ("APPEND", "Append", "Append a local copy of the cached data"),
+               ("LINK", "Link", "Link the cached data, keeping it read-only and shared with the library")),
+        default="DISABLED")
+
     # Animation Options
     action_autorename = BoolProperty(
 		name="Rename Imported Actions",
@@ -540,6 +579,28 @@ class DOS2DEImporterSettings(PropertyGroup):
 		description="Offset animation start frames to begin at frame 1 (Blender's default)",
 		default=True)
 
+    action_resample_mode = EnumProperty(
+        name="Resample",
+        description="Resample imported actions to fewer, evenly spaced keyframes",
+        items=(("DISABLED", "Disabled", ""),
+               ("FPS", "Frame Rate", "Resample to a frame rate, relative to the scene's frame rate"),
+               ("STEP", "Frame Step", "Resample to a key every few frames")),
+        default="DISABLED")
+
+    action_resample_fps = IntProperty(
+        name="Frame Rate",
+        description="The frame rate to resample actions to",
+        min=1,
+        max=240,
+        default=24)
+
+    action_resample_step = FloatProperty(
+        name="Frame Step",
+        description="The number of frames between resampled keyframes",
+        min=0.01,
+        max=100.0,
+        default=2.0)
+
     action_clean_enabled = BoolProperty(
 		name="Clean",
 		description="Simplify F-Curves by removing closely spaced keyframes",
@@ -556,17 +617,46 @@ class DOS2DEImporterSettings(PropertyGroup):
 		description="Clean channels along with keyframes",
 		default=False)
 
+    action_library_mode = EnumProperty(
+        name="Action Library",
+        description="Import animations directly onto one target armature, instead of building an armature for every file",
+        items=(
+            ("DISABLED", "Disabled", "Import animations normally"),
+            ("ACTION", "Actions", "Create an action for each file and make it the target's active action"),
+            ("NLA", "NLA Strips", "Create an action for each file and add it as a strip on the target's action library NLA track")
+        ),
+        default="DISABLED")
+
+    action_library_armature = StringProperty(
+        name="Target",
+        description="The armature receiving imported animations. If empty, the conform skeleton is imported once and used instead",
+        default="")
+
     # GR2 Options
     gr2_delete_dae = BoolProperty(
 		name="Delete DAE",
 		description="When importing from gr2, delete the temporary .dae file that gets created",
 		default=True)
 
+    gr2_batch_convert = BoolProperty(
+		name="Batch Conversion",
+		description="Convert all selected gr2 files with one divine process before importing, instead of starting divine for every file. Files the batch fails on are converted one at a time",
+		default=True)
+
     gr2_conform_enabled = BoolProperty(
 		name="Conform",
-		description="When importing from gr2, conform the file to a specific skeleton",
+		description="Conform the imported armature to a specific skeleton",
 		default=False)
 
+    gr2_conform_mode = EnumProperty(
+        name="Conform With",
+        description="How to conform imported armatures to the skeleton",
+        items=(
+            ("DIVINE", "Divine", "Conform while converting with divine. Only works for gr2 files"),
+            ("BLENDER", "Blender", "Conform after importing, using the skeleton's rest pose read once and cached. Works for dae and gr2 files")
+        ),
+        default="DIVINE")
+
     gr2_set_skeleton = BoolProperty(
         name="Skeleton:",
         description="Set the skeleton to conform to",
@@ -587,35 +677,51 @@ class DOS2DEImporterSettings(PropertyGroup):
 		options={"HIDDEN"},
 		default=False)
 
-    def as_keywords(self):
-        keywords = {}
-        keywords["filter_search"] = self.filter_search
-        keywords["apply_transformation"] = self.apply_transformation
-        keywords["delete_objects"] = self.delete_objects
-        keywords["rename_armatures"] = self.rename_armatures
-        keywords["rename_meshes"] = self.rename_meshes
-        keywords["use_rename_junk"] = self.use_rename_junk
-        keywords["use_build_material"] = self.use_build_material
-        keywords["auto_connect"] = self.auto_connect
-        keywords["find_chains"] = self.find_chains
-        keywords["min_chain_length"] = self.min_chain_length
-        keywords["fix_orientation"] = self.fix_orientation
-        keywords["import_units"] = self.import_units
-        keywords["keep_bind_info"] = self.keep_bind_info
-        keywords["action_autorename"] = self.action_autorename
-        keywords["action_set_fake_user"] = self.action_set_fake_user
-        keywords["action_offset_zero"] = self.action_offset_zero
-        keywords["gr2_delete_dae"] = self.gr2_delete_dae
-        keywords["gr2_conform_enabled"] = self.gr2_conform_enabled
-        keywords["gr2_set_skeleton"] = self.gr2_set_skeleton
-        keywords["gr2_base_skeleton"] = self.gr2_base_skeleton
-        keywords["gr2_conform_skeleton_path"] = self.gr2_conform_skeleton_path
-        keywords["conform_path_changed"] = self.conform_path_changed
-        keywords["action_clean_enabled"] = self.action_clean_enabled
-        keywords["action_clean_threshold"] = self.action_clean_threshold
-        keywords["action_clean_channels"] = self.action_clean_channels
-        #keywords["conform_path_changed"] = "conform_path_changed" in self
-        return keywords
+    # Sync Options
+    sync_enabled = BoolProperty(
+        name="Sync Mode",
+        description="Only import new or changed files. Files imported before are updated in place, keeping existing links to their objects, meshes, actions and materials",
+        default=False)
+
+    manifest_entries = CollectionProperty(
+        type=DOS2DEImporterManifestEntry,
+        options={"HIDDEN"})
+
+    # Batch Options
+    bulk_enabled = BoolProperty(
+        name="Bulk Mode",
+        description="For large batches. Disables undo while importing, and periodically purges orphan data to keep memory in check",
+        default=False)
+
+    bulk_purge_interval = IntProperty(
+        name="Purge Every",
+        description="Purge orphan data and collect garbage after this many files",
+        min=1,
+        default=25)
+
+    bulk_memory_limit = IntProperty(
+        name="Memory Limit (MB)",
+        description="Stop the batch when Blender's memory use exceeds this, after trying a purge first. Re-run with Sync Mode to resume. 0 disables the limit",
+        min=0,
+        default=0)
+
+    memory_audit_enabled = BoolProperty(
+        name="Memory Audit",
+        description="Record memory use and datablock counts before and after every file, flag files that leave orphan data or duplicate materials behind, and write a per-file table for the batch. Slows imports down",
+        default=False)
+
+    profile_enabled = BoolProperty(
+        name="Profile Import",
+        description="Profile the batch with cProfile. The profile is saved with the batch reports, and the slowest calls are listed in the Info log",
+        default=False)
+
+    profile_hotspots = IntProperty(
+        name="Hotspots",
+        description="How many of the calls with the most cumulative time to list",
+        min=1,
+        max=100,
+        default=20)
+
 
     def draw(self, layout, context, filepath="", settings_panel=True):
         box = layout.box()
@@ -629,6 +735,26 @@ class DOS2DEImporterSettings(PropertyGroup):
         row.prop(self, "delete_objects")
         row = box.row()
         row.prop(self, "use_build_material")
+        if self.use_build_material:
+            row = box.row()
+            row.prop(self, "use_converted_normalmaps")
+            row = box.row()
+            row.prop(self, "texture_proxy_level")
+            row = box.row()
+            row.prop(self, "texture_prefetch")
+        if settings_panel == True:
+            row = box.row()
+            row.operator(DOS2DE_IMPORTER_OT_rebuild_materials.bl_idname, icon="MATERIAL")
+            row.operator(DOS2DE_IMPORTER_OT_rebuild_materials.bl_idname, text="All Objects").all_objects = True
+        row = box.row()
+        row.prop(self, "use_dedup_meshes")
+        row = box.row()
+        row.prop(self, "weights_clean_enabled")
+        if self.weights_clean_enabled:
+            row = box.row()
+            row.prop(self, "weights_max_influences")
+            row = box.row()
+            row.prop(self, "weights_prune_threshold")
 
         box = layout.box()
         row = box.row(align=False)
@@ -639,12 +765,16 @@ class DOS2DEImporterSettings(PropertyGroup):
         row.prop(self, "rename_meshes")
         row = box.row()
         row.prop(self, "use_rename_junk")
+        row = box.row()
+        row.prop(self, "rename_dry_run")
 
         box = layout.box()
         row = box.row(align=False)
         row.label(text="GR2 Import Options:", icon="MESH_DATA")
         row = box.row()
         row.prop(self, "gr2_delete_dae")
+        row = box.row()
+        row.prop(self, "gr2_batch_convert")
 
         row = box.row()
         row.prop(self, "gr2_conform_enabled", text="Enable Conforming", toggle=True)
@@ -654,6 +784,8 @@ class DOS2DEImporterSettings(PropertyGroup):
             row = box.row()
             row.label("Conform Options: ", icon="MOD_ARMATURE")
             row = box.row()
+            row.prop(self, "gr2_conform_mode", expand=True)
+            row = box.row()
             row.prop(self, "gr2_set_skeleton", toggle=True)
             if self.gr2_set_skeleton:
                 skeleton_box = box.row().box()
@@ -680,6 +812,14 @@ class DOS2DEImporterSettings(PropertyGroup):
         row = box.row()
         row.prop(self, "action_offset_zero")
         row = box.row()
+        row.prop(self, "action_resample_mode")
+        if self.action_resample_mode == "FPS":
+            row = box.row()
+            row.prop(self, "action_resample_fps")
+        elif self.action_resample_mode == "STEP":
+            row = box.row()
+            row.prop(self, "action_resample_step")
+        row = box.row()
         row.prop(self, "action_set_fake_user")
         row = box.row()
         row.prop(self, "action_clean_enabled")
@@ -688,6 +828,11 @@ class DOS2DEImporterSettings(PropertyGroup):
             row.prop(self, "action_clean_threshold")
             row = box.row()
             row.prop(self, "action_clean_channels")
+        row = box.row()
+        row.prop(self, "action_library_mode")
+        if self.action_library_mode != "DISABLED":
+            row = box.row()
+            row.prop_search(self, "action_library_armature", context.scene, "objects")
 
         box = layout.box()
         row = box.row(align=False)
@@ -704,6 +849,38 @@ class DOS2DEImporterSettings(PropertyGroup):
         box = layout.box()
         row = box.row(align=False)
         row.prop(self, "keep_bind_info")
+        row = box.row(align=False)
+        row.prop(self, "import_animations")
+        row = box.row(align=False)
+        row.prop(self, "dae_prefilter")
+
+        box = layout.box()
+        row = box.row(align=False)
+        row.label(text="Batch Options:", icon="SORTTIME")
+        row = box.row()
+        row.prop(self, "bulk_enabled")
+        if self.bulk_enabled:
+            row = box.row()
+            row.prop(self, "bulk_purge_interval")
+            row = box.row()
+            row.prop(self, "bulk_memory_limit")
+        row = box.row()
+        row.prop(self, "memory_audit_enabled")
+        row = box.row()
+        row.prop(self, "profile_enabled")
+        if self.profile_enabled:
+            row.prop(self, "profile_hotspots")
+        row = box.row()
+        row.prop(self, "library_cache_mode")
+
+        box = layout.box()
+        row = box.row(align=False)
+        row.label(text="Sync Options:", icon="FILE_REFRESH")
+        row = box.row()
+        row.prop(self, "sync_enabled")
+        row = box.row()
+        row.label(text="Tracked Files: {}".format(len(self.manifest_entries)))
+        row.operator(DOS2DEImporter_OT_SyncManifest.bl_idname, icon="FILE_REFRESH")
 
         if settings_panel == True:
             box = layout.box()
@@ -717,322 +894,42 @@ class DOS2DEImporterSettings(PropertyGroup):
             row.prop(self, "directory")
 
 
-def transform_apply(self, context, obj, location=False, rotation=False, scale=False, children=False):
-    last_active = getattr(bpy.context.scene.objects, "active", None)
-    recurse_targets = []
-    try:
-        bpy.ops.object.mode_set(mode="OBJECT")
-        bpy.ops.object.select_all(action='DESELECT')
-        bpy.context.scene.objects.active = obj
-        obj.select = True
-        bpy.ops.object.transform_apply(location=location, rotation=rotation, scale=scale)
-
-        if children:
-            for childobj in obj.children:
-                childobj.select = True
-                if childobj.children is not None:
-                    recurse_targets.append(childobj)
-            bpy.ops.object.mode_set(mode="OBJECT")
-            bpy.ops.object.transform_apply(location=location, rotation=rotation, scale=scale)
-            bpy.ops.object.select_all(action='DESELECT')
-        obj.select = False
-    except:
-        pass
-
-    if last_active is not None:
-        bpy.context.scene.objects.active = last_active
-    if len(recurse_targets) > 0:
-        for recobj in recurse_targets:
-            transform_apply(self, context, recobj, location, rotation, scale, children)
-
-def can_delete(objtype, delete_objects):
-    return (delete_objects == "ALL" or (delete_objects == "ARMATURE" and objtype == "ARMATURE") 
-                or (delete_objects == "MESH" and objtype == "MESH"))
-
-lastNum = re.compile(r'(?:[^\d]*(\d+)[^\d]*)+')
-
-def increment_string(s):
-    m = lastNum.search(s)
-    if m:
-        next = str(int(m.group(1))+1)
-        start, end = m.span(1)
-        s = s[:max(end-len(next), start)] + next + s[end:]
-    else:
-        s = s + "_1"
-    return s
-
-def safe_rename(obj, context, next_name):
-    if obj.type == "ARMATURE":
-        for check in bpy.data.armatures:
-            if check != obj.data and check.name == next_name:
-                next_name = increment_string(next_name)
-    elif obj.type == "MESH":
-        for check in bpy.data.meshes:
-            if check != obj.data and check.name == next_name:
-                next_name = increment_string(next_name)
-    obj.name = next_name
-    obj.data.name = next_name
-
-def import_collada(operator, context, load_filepath, rename_temp=False, **args):
-    rename_actions = args["action_autorename"]
-    use_build_material = args["use_build_material"]
-
-    action_set_fake_user = args["action_set_fake_user"]
-    action_offset_zero = args["action_offset_zero"]
-    action_clean_enabled = args["action_clean_enabled"]
-    action_clean_threshold = args["action_clean_threshold"]
-    action_clean_channels = args["action_clean_channels"]
-
-    gr2_conform_enabled = args["gr2_conform_enabled"]
-    delete_objects_options = args["delete_objects"]
-    rename_armatures = args["rename_armatures"]
-    rename_meshes = args["rename_meshes"]
-    use_rename_junk = args["use_rename_junk"]
-
-    fix_orientation = args["fix_orientation"]
-    auto_connect = args["auto_connect"]
-    find_chains = args["find_chains"]
-    min_chain_length = args["min_chain_length"]
-    import_units = args["import_units"]
-    apply_transformation = args["apply_transformation"]
-    keep_bind_info = args["keep_bind_info"]
-
-    #ignored_objects = list(filter(lambda obj: obj.type == "ARMATURE", context.scene.objects.values()))
-    ignored_objects = context.scene.objects.values()
-
-    print("[DOS2DE-Importer] Importing collada file: '{}'".format(load_filepath))
-
-    bpy.ops.wm.collada_import(filepath=load_filepath, fix_orientation=fix_orientation, import_units=import_units, 
-        find_chains=find_chains, auto_connect=auto_connect, min_chain_length=min_chain_length, keep_bind_info=keep_bind_info)
-
-    parse_actions = action_offset_zero or rename_actions or action_set_fake_user
-    if parse_actions:
-        new_armatures = list(filter(lambda obj: obj.type == "ARMATURE" and obj.animation_data != None and not obj in ignored_objects, context.scene.objects.values()))
-        if len(new_armatures) > 0:
-            print("[DOS2DE-Importer] New Armature Objects: ({}). Parsing actions".format(len(new_armatures)))
-            for ob in new_armatures:
-                action = (ob.animation_data.action
-                    if ob.animation_data is not None and
-                    ob.animation_data.action is not None
-                    else None)
-
-                if action is not None:
-                    action_name = action.name
-
-                    if rename_actions:
-                        new_name = bpy.path.display_name_from_filepath(load_filepath)
-                        if rename_temp:
-                            new_name = str.replace(new_name, "-temp", "")
-                        operator.report({'INFO'}, "[DOS2DE-Importer] Renamed action '{}' to '{}'.".format(action_name, new_name))
-                        ob.animation_data.action.name = new_name
-                        action_name = new_name
-
-                    if action_set_fake_user:
-                        action.use_fake_user = True
-                        print("[DOS2DE-Importer] Enabled fake user for action '{}'.".format(action_name))
-
-                    if action_offset_zero:
-                        fcurves = ob.animation_data.action.fcurves
-                        for fc in fcurves:
-                            for keyframe in fc.keyframe_points:
-                                keyframe.co.x += 1
-
-                    # if action_clean_enabled:
-                    #     print("[DOS2DE-Importer] Cleaning action. Threshold '{}' Channels '{}'.".format(action_clean_threshold, action_clean_channels))
-                    #     bpy.ops.object.select_all(action='DESELECT')
-                    #     last = bpy.context.scene.objects.active
-                    #     bpy.context.scene.objects.active = ob
-                    #     ob.select = True
-                    #     bpy.ops.object.mode_set(mode="POSE")
-                    #     bpy.ops.action.clean(threshold=action_clean_threshold, channels=action_clean_channels)
-                    #     #bpy.ops.action.clean(0.001, True)
-                    #     bpy.ops.object.mode_set(mode="OBJECT")
-                    #     ob.select = False
-                    #     bpy.context.scene.objects.active = last
-
-        else:
-            #operator.report({'INFO'}, "[DOS2DE-Importer] No new actions to rename.")
-            pass
-
-    if apply_transformation:
-        new_armatures = list(filter(lambda obj: not obj in ignored_objects, context.scene.objects.values()))
-        for obj in new_armatures:
-            print("[DOS2DE-Importer] Applying transformation for object '{}:{}' and children.".format(obj.name, obj.type))
-            transform_apply(operator, context, obj, location=True, rotation=True, scale=True, children=True)
-
-    if delete_objects_options != "DISABLED":
-        delete_objects = list(filter(lambda obj: not obj in ignored_objects and can_delete(obj.type, delete_objects_options), context.scene.objects.values()))
-        print("[DOS2DE-Importer] Deleting '{}' new objects after import.".format(len(delete_objects)))
-        for obj in delete_objects:
-            index = bpy.data.objects.find(obj.name)
-            if index > -1:
-                obj_data = bpy.data.objects[index]
-                print("[DOS2DE-Importer] Deleting object '{}:{}'.".format(obj.name, obj.type))
-                bpy.data.objects.remove(obj_data)
-    
-    rename_objects = (rename_armatures != "DISABLED" or rename_meshes != "DISABLED")
-
-    if rename_objects == True:
-        new_objects = list(filter(lambda obj: not obj in ignored_objects, context.scene.objects.values()))
-        filename = os.path.basename(load_filepath).replace("-temp", "")
-        index_of_dot = filename.index('.')
-        if index_of_dot >= 0:
-            filename = filename[:index_of_dot]
-
-        for obj in new_objects:
-            name_prefix = ""
-            next_name = ""
-            rename_option = "DISABLED"
-            if obj.type == "ARMATURE":
-                rename_option = rename_armatures
-            if obj.type == "MESH":
-                rename_option = rename_meshes
-
-            if rename_option != "DISABLED":
-                if obj.type == "ARMATURE":
-                    name_prefix = "Arm_"
-                elif obj.type == "MESH":
-                    pass
-                if rename_option == "FILE" or rename_option == "FILE_SHORTHAND":
-                    next_name = "{}{}".format(name_prefix, filename)
-                elif rename_option == "SHORTHAND":
-                    next_name = "{}{}".format(name_prefix, obj.name)
-                if rename_option == "SHORTHAND" or rename_option == "FILE_SHORTHAND":
-                    for pattern in rename_race_patterns:
-                        next_name = next_name.replace(pattern[0], pattern[1])
-                if next_name != "":
-                    if use_rename_junk:
-                        for pattern in rename_patterns:
-                            next_name = next_name.replace(pattern[0], pattern[1])
-                    print("[DOS2DE-Importer] Renaming object '{} => {}'.".format(obj.name, next_name))
-                    safe_rename(obj, context, next_name)
-
-    if use_build_material:
-        assets_dir = ""
-        if "dos2de_collada_importer" in context.user_preferences.addons:
-            preferences = context.user_preferences.addons["dos2de_collada_importer"].preferences
-            if preferences is not None:
-                if "extracted_assets_dir" in preferences:
-                    assets_dir = preferences.extracted_assets_dir
-        if assets_dir != "":
-            check_findname = os.path.basename(load_filepath).replace("-temp.dae", "")
-            new_meshes = list(filter(lambda obj: not obj in ignored_objects and obj.type == "MESH", context.scene.objects.values()))
-            for mesh in new_meshes:
-                mat_name="{}_DOS2DE_PBR".format(obj.name)
-                mat = bpy.data.materials.get(mat_name)
-                if mat is None:
-                    if create_material(mat_name, mesh, check_findname, context, assets_dir):
-                        print("[DOS2DE-Importer] Created material for '{}'".format(mesh.name))
-                else:
-                    mesh.data.materials.append(mat)
-    return True
-
-def import_granny(operator, context, load_filepath, divine_path, **args):
-    gr2_conform_enabled = args["gr2_conform_enabled"]
-    if gr2_conform_enabled == True:
-        conform_skeleton_path = args["gr2_conform_skeleton_path"]
-
-        base_skeleton = args["gr2_base_skeleton"]
-        autoselect = base_skeleton != None and base_skeleton == "AUTO"
-
-        if base_skeleton is not None and base_skeleton != "DISABLED":
-            if autoselect == True:
-                filename = os.path.basename(load_filepath)
-                print("  [DOS2DE-Importer] Auto-select base skeleton set. Looking for match in name {}".format(load_filepath))
-
-                auto_skeleton = None
-                for key,entry in base_skeleton_dict.items():
-                    base_file = entry[0]
-                    if filename.count(key) > 0:
-                        auto_skeleton = base_file
-                        break
-                    else:
-                        race = entry[1]
-                        gender = entry[2]
-                        if filename.count(race + "_Hero_"+gender) > 0:
-                            auto_skeleton = base_file
-                            break
-
-                if auto_skeleton is not None and os.path.isfile(auto_skeleton):
-                    conform_skeleton_path = auto_skeleton
-                    print("    [DOS2DE-Importer] Auto-selected skeleton {}".format(auto_skeleton))
-                else:
-                    print("    [DOS2DE-Importer] No auto base skeleton found.")
-
-            else:
-                print("[DOS2DE-Importer] Looking for '{}'.".format(base_skeleton))
-                if base_skeleton in base_skeleton_dict.keys():
-                    check_path = base_skeleton_dict[base_skeleton][0]
-                    if os.path.isfile(check_path):
-                        conform_skeleton_path = check_path
-                        print("[DOS2DE-Importer] Using base skeleton '{}'.".format(conform_skeleton_path))
-        else:
-            print("[DOS2DE-Importer] No base skeleton set. Using conform path.")
-    else:
-        conform_skeleton_path = ""
-    delete_dae = args["gr2_delete_dae"]
-
-    divine_exe = '"{}"'.format(divine_path)
-    
-    from pathlib import Path
-    path_start = Path(load_filepath)
-    dae_temp_path = str(Path(str(path_start.with_suffix("")) + "-temp.dae"))
-
-    if gr2_conform_enabled and conform_skeleton_path is not None and os.path.isfile(conform_skeleton_path):
-        gr2_options_str = "-e conform -e conform-copy --conform-path \"{}\"".format(conform_skeleton_path)
-    else:
-        gr2_options_str = ""
-
-    proccess_args = "{} --loglevel all -g dos2de -s \"{}\" -d \"{}\" -i gr2 -o dae -a convert-model {}".format(
-        divine_exe, load_filepath, dae_temp_path, gr2_options_str)
-
-    print("Starting GR2->DAE conversion using divine.exe.")
-    print("Sending command: {}".format(proccess_args))
-
-    process = subprocess.run(proccess_args, 
-        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-
-    print(process.stdout)
-    
-    if process.returncode != 0:
-        #raise Exception("Error converting DAE to GR2: \"{}\"{}".format(process.stderr, process.stdout))
-        error_message = "[DOS2DE-Importer] [ERROR:{}] Error converting GR2 to DAE. {}".format(process.returncode, '\n'.join(process.stdout.splitlines()[-1:]))
-        operator.report({"ERROR"}, error_message)
-        print(error_message)
-    else:
-        #Deleta .dae
-        print("[DOS2DE-Importer] Importing temp dae file: '{}'.".format(dae_temp_path))
-        if import_collada(operator, context, load_filepath=dae_temp_path, rename_temp=True, **args):
-            if delete_dae:
-                print("[DOS2DE-Importer] Deleting temp file: '{}'.".format(dae_temp_path))
-                if os.path.isfile(dae_temp_path):
-                    os.remove(dae_temp_path)
-            return True
-        else:
-            print("Failed?")
-    return False
-
-def import_start(operator, context, load_filepath, divine_path, **args):
-    name = os.path.split(load_filepath)[-1].split(".")[0]
-    parts = os.path.splitext(load_filepath)
-    ext = parts[1].lower()
-
-    print("[DOS2DE-Importer] Importing file: '{}'.".format(load_filepath))
-
-    # Ignore current armatures when renaming actions
-    ignored_objects = list(filter(lambda obj: obj.type == "ARMATURE", context.scene.objects.values()))
-    #print("[DOS2DE-Importer] Ignored Objects {}".format(len(ignored_objects)))
-    if ext == ".dae":
-        return import_collada(operator, context, load_filepath, **args)
-    elif ext == ".gr2":
-        if divine_path != "" and os.path.isfile(divine_path):
-            return import_granny(operator, context, load_filepath, divine_path, **args)
-        else:
-            operator.report({"ERROR"}, "[DOS2DE-Importer] Failed to find divine.exe at path: '{}'. Canceling GR2 import.".format(divine_path))
-    else:
-        raise RuntimeError("[DOS2DE-Importer] Unknown extension: %s" % ext)
-        return False
-    return True
+file_info_kinds = {
+    "UNKNOWN": ("Unknown", "QUESTION"),
+    "MESH": ("Mesh", "MESH_DATA"),
+    "SKINNED_MESH": ("Skinned Mesh", "MOD_ARMATURE"),
+    "RIG": ("Rig", "ARMATURE_DATA"),
+    "ANIMATION": ("Animation", "ANIM_DATA")
+}
+
+def draw_file_info(layout, context, filepath):
+    ext = os.path.splitext(filepath)[1].lower()
+    if not ext in (".dae", ".gr2") or not os.path.isfile(filepath):
+        return
+    from .collada import get_file_info
+    from .utils import bytes_to_mb
+    box = layout.box()
+    row = box.row(align=False)
+    row.label(text="File Info:", icon="INFO")
+    info = get_file_info(filepath)
+    if info is None:
+        row = box.row()
+        op = row.operator(DOS2DEImporter_OT_ScanFile.bl_idname, icon="VIEWZOOM")
+        op.filepath = filepath
+        return
+    kind_name,kind_icon = file_info_kinds[info.kind]
+    row = box.row()
+    row.label(text="{} ({:.2f} MB)".format(kind_name, bytes_to_mb(info.size)), icon=kind_icon)
+    if info.vertices > 0:
+        row = box.row()
+        row.label(text="Vertices: {}  Triangles: {}".format(info.vertices, info.triangles))
+    if info.bones > 0:
+        row = box.row()
+        row.label(text="Bones: {}".format(info.bones))
+    if info.has_animation and info.time_start is not None:
+        fps = context.scene.render.fps / context.scene.render.fps_base
+        row = box.row()
+        row.label(text="Frames: {:.0f} - {:.0f}".format(info.time_start * fps, info.time_end * fps))
 
 class DOS2DEImporter_FileSelectorOperator(bpy.types.Operator):
     bl_idname = "dos2deimporter.op_fileselector"
@@ -1072,6 +969,114 @@ class DOS2DEImporter_GR2_AddConformPath(Operator):
     def invoke(self, context, event):
         return self.execute(context)
 
+class DOS2DEImporter_OT_ScanFile(Operator):
+    """Convert the gr2 file with divine to read its mesh, bone and animation info. Results are cached"""
+    bl_idname = "dos2deimporter.op_scan_file"
+    bl_label = "Scan File"
+
+    filepath = StringProperty(default="", subtype="FILE_PATH")
+
+    def execute(self, context):
+        from .collada import get_file_info
+        from .divine import get_conversion_timeout
+        divine_path = ""
+        timeout = None
+        if "dos2de_collada_importer" in context.user_preferences.addons:
+            preferences = context.user_preferences.addons["dos2de_collada_importer"].preferences
+            if preferences is not None:
+                if "divine_path" in preferences:
+                    divine_path = preferences.divine_path
+                timeout = get_conversion_timeout(self.filepath, preferences)
+        if get_file_info(self.filepath, divine_path, allow_convert=True, timeout=timeout) is None:
+            self.report({"WARNING"}, "[DOS2DE-Importer] Failed to scan '{}'. Check the divine path in the addon preferences.".format(self.filepath))
+        return {'FINISHED'}
+
+class DOS2DEImporter_OT_StartDivineService(Operator):
+    """Start the local conversion service in the background, to be shared by Blender sessions on this machine"""
+    bl_idname = "dos2deimporter.op_start_divine_service"
+    bl_label = "Start Service"
+
+    def execute(self, context):
+        import subprocess
+        from .utils import get_cache_dir
+        preferences = context.user_preferences.addons["dos2de_collada_importer"].preferences
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "divine_service.py")
+        if preferences.divine_path == "" or not os.path.isfile(preferences.divine_path):
+            self.report({"ERROR"}, "[DOS2DE-Importer] Set the divine path in the addon preferences to start the conversion service.")
+            return {'CANCELLED'}
+        args = [bpy.app.binary_path_python, script,
+            "--divine", preferences.divine_path,
+            "--timeout", str(preferences.divine_timeout),
+            "--timeout-per-mb", str(preferences.divine_timeout_per_mb),
+            "--cache-limit", str(preferences.divine_service_cache_limit),
+            "--port", str(preferences.divine_service_port),
+            "--workers", str(preferences.divine_service_workers),
+            "--cache", get_cache_dir("divine")]
+        creationflags = 0
+        if os.name == "nt":
+            # DETACHED_PROCESS | CREATE_NEW_PROCESS_GROUP, so the service outlives this session
+            creationflags = 0x00000008 | 0x00000200
+        subprocess.Popen(args, creationflags=creationflags, start_new_session=(os.name != "nt"), close_fds=True)
+        self.report({"INFO"}, "[DOS2DE-Importer] Started the conversion service on port {}.".format(preferences.divine_service_port))
+        return {'FINISHED'}
+
+class DOS2DEImporter_OT_ClearQuarantine(Operator):
+    """Forget the files quarantined after failing to convert, so the next import tries them again"""
+    bl_idname = "dos2deimporter.op_clear_quarantine"
+    bl_label = "Clear Quarantine"
+
+    def execute(self, context):
+        from .divine import clear_quarantine
+        self.report({"INFO"}, "[DOS2DE-Importer] Cleared '{}' quarantined files.".format(clear_quarantine()))
+        return {'FINISHED'}
+
+def report_sync_results(operator, results):
+    operator.report({'INFO'}, "[DOS2DE-Importer] Sync finished. Imported '{}', updated '{}', skipped '{}' unchanged, failed '{}'.".format(
+        results.get("IMPORTED", 0), results.get("UPDATED", 0), results.get("SKIPPED", 0), results.get("FAILED", 0)))
+
+class DOS2DEImporter_OT_SyncManifest(Operator):
+    """Re-import every tracked file that changed since it was last imported, updating its data in place"""
+    bl_idname = "dos2deimporter.op_sync_manifest"
+    bl_label = "Sync Tracked Files"
+    bl_options = {"REGISTER", "UNDO"}
+
+    @classmethod
+    def poll(cls, context):
+        settings = getattr(context.scene, "dos2de_importer_settings", None)
+        return settings is not None and len(settings.manifest_entries) > 0
+
+    def execute(self, context):
+        from . import importer
+        from .importer import manifest_import
+        from .animation import resolve_action_library_config
+        from .config import resolve_import_config
+        settings = context.scene.dos2de_importer_settings
+        config = resolve_import_config(context, settings)
+
+        filepaths = [entry.filepath for entry in settings.manifest_entries]
+        importer.begin_batch()
+        prefetcher = importer.start_texture_prefetch(filepaths, config)
+        importer.prepare_granny_batch(self, settings, filepaths, config, sync=True)
+
+        results = {}
+        try:
+            config = resolve_action_library_config(self, context, filepaths, config)
+            for filepath in filepaths:
+                if not os.path.isfile(filepath):
+                    print("[DOS2DE-Importer] Tracked file '{}' no longer exists. Skipping.".format(filepath))
+                    results["MISSING"] = results.get("MISSING", 0) + 1
+                    continue
+                status = manifest_import(self, context, settings, filepath, config, sync=True)
+                results[status] = results.get(status, 0) + 1
+        finally:
+            importer.end_batch(config)
+            if prefetcher is not None:
+                prefetcher.stop()
+
+        importer.report_quarantined(self)
+        report_sync_results(self, results)
+        return {'FINISHED'}
+
 class ImportDivinityCollada(bpy.types.Operator, ImportHelper):
     """Load a Divinity .dae file"""
     bl_idname = "import_scene.divinitycollada"
@@ -1123,12 +1128,18 @@ class ImportDivinityCollada(bpy.types.Operator, ImportHelper):
     def execute(self, context):
         settings = self.settings
         if settings is not None:
+            from . import importer
+            from .importer import manifest_import
+            from .animation import resolve_action_library_config
+            from .config import resolve_import_config
+            from .utils import bytes_to_mb, get_process_memory, purge_orphan_data
+
             if settings.conform_path_changed:
                 self.gr2_conform_skeleton_path = settings.gr2_conform_skeleton_path
                 settings.conform_path_changed = False
             print("[DOS2DE-Importer] Saved importer settings to scene.")
 
-            keywords = settings.as_keywords()
+            config = resolve_import_config(context, settings)
 
             selection = bpy.context.selected_objects
             last_active = getattr(bpy.context.scene.objects, "active", None)
@@ -1136,17 +1147,88 @@ class ImportDivinityCollada(bpy.types.Operator, ImportHelper):
             directory = self.directory
             settings.directory = directory
 
-            divine_path = ""
+            bulk_enabled = settings.bulk_enabled
+            memory_limit = settings.bulk_memory_limit * 1048576
+            use_global_undo = context.user_preferences.edit.use_global_undo
+            if bulk_enabled:
+                context.user_preferences.edit.use_global_undo = False
+                print("[DOS2DE-Importer] Bulk mode enabled. Undo is disabled until the batch finishes.")
 
-            if "dos2de_collada_importer" in context.user_preferences.addons:
-                preferences = context.user_preferences.addons["dos2de_collada_importer"].preferences
-                if preferences is not None and "divine_path" in preferences:
-                    divine_path = preferences.divine_path
+            dedup_stats = importer.begin_batch()
+
+            auditor = None
+            if settings.memory_audit_enabled:
+                from .audit import DOS2_Memory_Auditor
+                auditor = DOS2_Memory_Auditor()
+                auditor.begin_batch()
+
+            profiler = None
+            if settings.profile_enabled:
+                from .profiling import DOS2_Import_Profiler
+                profiler = DOS2_Import_Profiler()
+                profiler.start()
 
-            for file_elem in self.files:
-                filepath = os.path.join(directory, file_elem.name)
-                #print("Selected file: {}".format(filepath))
-                import_start(self, context, filepath, divine_path, **keywords)
+            filepaths = [os.path.join(directory, file_elem.name) for file_elem in self.files]
+            prefetcher = importer.start_texture_prefetch(filepaths, config)
+            importer.prepare_granny_batch(self, settings, filepaths, config, sync=settings.sync_enabled)
+
+            results = {}
+            try:
+                config = resolve_action_library_config(self, context, filepaths, config)
+                for index,filepath in enumerate(filepaths):
+                    #print("Selected file: {}".format(filepath))
+                    if auditor is not None:
+                        auditor.begin(filepath)
+                    status = manifest_import(self, context, settings, filepath, config, sync=settings.sync_enabled)
+                    results[status] = results.get(status, 0) + 1
+                    if auditor is not None:
+                        auditor.end(filepath, status)
+
+                    if bulk_enabled:
+                        if (index + 1) % settings.bulk_purge_interval == 0:
+                            print("[DOS2DE-Importer] Purged '{}' orphaned datablocks.".format(purge_orphan_data()))
+                        if memory_limit > 0 and get_process_memory()[0] > memory_limit:
+                            purge_orphan_data()
+                            current = get_process_memory()[0]
+                            remaining = len(filepaths) - (index + 1)
+                            if current > memory_limit and remaining > 0:
+                                self.report({"WARNING"}, "[DOS2DE-Importer] Memory use ({:.0f} MB) is over the limit. Stopped with '{}' files remaining. Import them again with Sync Mode enabled to resume.".format(
+                                    bytes_to_mb(current), remaining))
+                                break
+            finally:
+                importer.end_batch(config)
+                if prefetcher is not None:
+                    prefetcher.stop()
+                if profiler is not None:
+                    profiler.stop()
+                if bulk_enabled:
+                    context.user_preferences.edit.use_global_undo = use_global_undo
+
+            if bulk_enabled:
+                removed = purge_orphan_data()
+                current,peak = get_process_memory()
+                self.report({"INFO"}, "[DOS2DE-Importer] Bulk import finished. Purged '{}' orphaned datablocks. Memory: {:.0f} MB (peak {:.0f} MB).".format(
+                    removed, bytes_to_mb(current), bytes_to_mb(peak)))
+
+            if auditor is not None:
+                total = auditor.end_batch()
+                report_path = auditor.write_report(total)
+                self.report({"INFO"}, "[DOS2DE-Importer] Memory audit: '{}' of '{}' files left growth behind. Wrote the table to '{}'.".format(
+                    len(auditor.get_flagged()), len(auditor.entries), report_path))
+
+            importer.report_quarantined(self)
+
+            if profiler is not None:
+                profiler.report_hotspots(self, settings.profile_hotspots)
+                profile_path = profiler.write_stats(importer.get_batch_report_path("prof"))
+                self.report({"INFO"}, "[DOS2DE-Importer] Saved the import profile to '{}'.".format(profile_path))
+
+            if dedup_stats["meshes"] > 0:
+                self.report({"INFO"}, "[DOS2DE-Importer] Shared '{}' duplicate meshes in total, saving about {:.2f} MB.".format(
+                    dedup_stats["meshes"], bytes_to_mb(dedup_stats["bytes"])))
+
+            if settings.sync_enabled:
+                report_sync_results(self, results)
 
             if(len(selection) > 0):
                 for obj in selection:
@@ -1160,6 +1242,8 @@ class ImportDivinityCollada(bpy.types.Operator, ImportHelper):
     def draw(self, context):
         layout = self.layout
         #settings = getattr(context.scene, "settings", None)
+        if self.filepath != "":
+            draw_file_info(layout, context, self.filepath)
         if self.settings is not None:
             self.settings.draw(layout, context, self.filepath, settings_panel=False)
         else:
@@ -1199,6 +1283,7 @@ def register():
         )
         bpy.app.handlers.scene_update_post.append(leaderhelpers_register_opsettings)
 
+        print("[DOS2DE-Importer] Registered in {:.1f} ms.".format((time.perf_counter() - addon_load_start) * 1000))
     except: traceback.print_exc()
 
 def unregister():
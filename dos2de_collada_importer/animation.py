@@ -0,0 +1,507 @@
+import bpy
+
+import os
+
+import numpy as np
+from mathutils import Matrix
+
+from .utils import get_stat_key
+from .collada import read_collada_animation
+from .divine import get_conform_skeleton_path, read_granny_scratch
+
+def matrices_to_quaternions(m):
+    """Convert an (N,3,3) array of rotation matrices to an (N,4) array of continuous (w,x,y,z) quaternions."""
+    count = len(m)
+    quats = np.empty((count, 4))
+    trace = m[:,0,0] + m[:,1,1] + m[:,2,2]
+
+    case_w = trace > 0
+    case_x = ~case_w & (m[:,0,0] > m[:,1,1]) & (m[:,0,0] > m[:,2,2])
+    case_y = ~case_w & ~case_x & (m[:,1,1] > m[:,2,2])
+    case_z = ~case_w & ~case_x & ~case_y
+
+    c = m[case_w]
+    s = np.sqrt(trace[case_w] + 1.0) * 2.0
+    quats[case_w] = np.stack([0.25 * s, (c[:,2,1] - c[:,1,2]) / s, (c[:,0,2] - c[:,2,0]) / s, (c[:,1,0] - c[:,0,1]) / s], axis=1)
+
+    c = m[case_x]
+    s = np.sqrt(1.0 + c[:,0,0] - c[:,1,1] - c[:,2,2]) * 2.0
+    quats[case_x] = np.stack([(c[:,2,1] - c[:,1,2]) / s, 0.25 * s, (c[:,0,1] + c[:,1,0]) / s, (c[:,0,2] + c[:,2,0]) / s], axis=1)
+
+    c = m[case_y]
+    s = np.sqrt(1.0 + c[:,1,1] - c[:,0,0] - c[:,2,2]) * 2.0
+    quats[case_y] = np.stack([(c[:,0,2] - c[:,2,0]) / s, (c[:,0,1] + c[:,1,0]) / s, 0.25 * s, (c[:,1,2] + c[:,2,1]) / s], axis=1)
+
+    c = m[case_z]
+    s = np.sqrt(1.0 + c[:,2,2] - c[:,0,0] - c[:,1,1]) * 2.0
+    quats[case_z] = np.stack([(c[:,1,0] - c[:,0,1]) / s, (c[:,0,2] + c[:,2,0]) / s, (c[:,1,2] + c[:,2,1]) / s, 0.25 * s], axis=1)
+
+    quats /= np.linalg.norm(quats, axis=1)[:,None]
+    return make_quaternions_continuous(quats)
+
+def make_quaternions_continuous(quats):
+    """Flip the signs of an (N,4) array of quaternion keys in place, keeping neighbouring keys in the same
+    hemisphere so interpolation takes the short path."""
+    if len(quats) > 1:
+        dots = np.einsum("ij,ij->i", quats[1:], quats[:-1])
+        signs = np.concatenate([[1.0], np.cumprod(np.where(dots < 0, -1.0, 1.0))])
+        quats *= signs[:,None]
+    return quats
+
+def decompose_matrices(matrices):
+    """Split an (N,4,4) array of matrices into location, quaternion and scale arrays."""
+    location = matrices[:,:3,3]
+    rotation_scale = matrices[:,:3,:3]
+    scale = np.linalg.norm(rotation_scale, axis=1)
+    scale[scale == 0] = 1.0
+    rotation = rotation_scale / scale[:,None,:]
+    return (location, matrices_to_quaternions(rotation), scale)
+
+def set_fcurve_points(action, data_path, index, group, frames, values):
+    fcurve = action.fcurves.new(data_path, index=index, action_group=group)
+    fcurve.keyframe_points.add(len(frames))
+    co = np.empty(len(frames) * 2, dtype=np.float32)
+    co[0::2] = frames
+    co[1::2] = values
+    fcurve.keyframe_points.foreach_set("co", co)
+    fcurve.update()
+    return fcurve
+
+def normalize_bone_name(name):
+    return name.lower().replace(" ", "_")
+
+class DOS2_Action_Library_Target():
+    """Bone lookup and rest data for the armature that receives imported animations, built once per armature."""
+    def __init__(self, obj):
+        self.obj = obj
+        self.bones = {}
+        self.rest_inverse = {}
+        self.lookups = {}
+        for bone in obj.data.bones:
+            self.bones[normalize_bone_name(bone.name)] = bone.name
+            if bone.parent is not None:
+                rest = np.array(bone.parent.matrix_local.inverted() * bone.matrix_local)
+                self.rest_inverse[bone.name] = np.linalg.inv(rest)
+
+    def find_bone(self, names):
+        key = names[0]
+        if key in self.lookups:
+            return self.lookups[key]
+        bone_name = None
+        for name in names:
+            bone_name = self.bones.get(normalize_bone_name(name))
+            if bone_name is not None:
+                break
+        self.lookups[key] = bone_name
+        return bone_name
+
+action_library_track_name = "DOS2DE Action Library"
+action_library_targets = {}
+action_library_skeletons = {}
+# Pointers of the datablocks imported for base skeletons, which belong to no file's manifest entry
+action_library_skeleton_blocks = set()
+
+def import_action_library_skeleton(operator, context, load_filepath, config):
+    """Import the conform skeleton once, to be used as the target armature for the rest of the batch."""
+    from .importer import get_new_datablocks, import_start, snapshot_datablocks
+    from .config import replace_import_config
+    skeleton_path = get_conform_skeleton_path(load_filepath, config)
+    if skeleton_path == "" or not os.path.isfile(skeleton_path):
+        return None
+
+    skeleton_name = action_library_skeletons.get(skeleton_path)
+    if skeleton_name is not None and skeleton_name in bpy.data.objects:
+        return bpy.data.objects[skeleton_name]
+
+    skeleton_config = replace_import_config(config, action_library_mode="DISABLED", delete_objects="DISABLED",
+        gr2_conform_enabled=False, use_build_material=False)
+
+    print("[DOS2DE-Importer] Importing base skeleton '{}' as the action library target.".format(skeleton_path))
+    snapshot = snapshot_datablocks()
+    import_start(operator, context, skeleton_path, skeleton_config)
+    created = get_new_datablocks(snapshot)
+    action_library_skeleton_blocks.update(block.as_pointer() for blocks in created.values() for block in blocks)
+    obj = next(iter([x for x in created["OBJECT"] if x.type == "ARMATURE"]), None)
+    if obj is not None:
+        action_library_skeletons[skeleton_path] = obj.name
+    return obj
+
+def resolve_action_library_config(operator, context, filepaths, config):
+    """Import the batch's base skeleton before the batch when every file shares it, and return the config with it
+    as the action library armature. Auto-selected skeletons depend on the file, and are imported as needed."""
+    if config.action_library_mode == "DISABLED" or len(filepaths) == 0:
+        return config
+    obj = bpy.data.objects.get(config.action_library_armature)
+    if (obj is not None and obj.type == "ARMATURE") or config.gr2_base_skeleton == "AUTO":
+        return config
+    obj = import_action_library_skeleton(operator, context, filepaths[0], config)
+    if obj is None:
+        return config
+    from .config import replace_import_config
+    return replace_import_config(config, action_library_armature=obj.name)
+
+def get_action_library_target(operator, context, load_filepath, config):
+    obj = bpy.data.objects.get(config.action_library_armature)
+    if obj is None or obj.type != "ARMATURE":
+        obj = import_action_library_skeleton(operator, context, load_filepath, config)
+    if obj is None:
+        operator.report({"ERROR"}, "[DOS2DE-Importer] No target armature for the action library. Choose an armature, or enable conforming with a base skeleton.")
+        return None
+
+    target = action_library_targets.get(obj.name)
+    if target is None or target.obj != obj:
+        target = DOS2_Action_Library_Target(obj)
+        action_library_targets[obj.name] = target
+    return target
+
+def import_action_library(operator, context, load_filepath, config, rename_temp=False):
+    """Import a dae's animation straight onto the target armature as an action, without building an armature for the file."""
+    target = get_action_library_target(operator, context, load_filepath, config)
+    if target is None:
+        return False
+
+    print("[DOS2DE-Importer] Importing animation from '{}' to armature '{}'.".format(load_filepath, target.obj.name))
+    animation = read_collada_animation(load_filepath)
+    if len(animation.channels) == 0:
+        operator.report({"WARNING"}, "[DOS2DE-Importer] No animation found in '{}'.".format(load_filepath))
+        return True
+
+    action_name = "Action"
+    if config.action_autorename:
+        action_name = bpy.path.display_name_from_filepath(load_filepath)
+        if rename_temp:
+            action_name = str.replace(action_name, "-temp", "")
+    action = bpy.data.actions.new(action_name)
+    action.use_fake_user = config.action_set_fake_user
+
+    render = context.scene.render
+    fps = render.fps / render.fps_base
+    frame_offset = 1 if config.action_offset_zero else 0
+
+    unmapped = []
+    for node_id,times,matrices in animation.channels:
+        node = animation.nodes.get(node_id)
+        names = [node[0], node_id] if node is not None else [node_id]
+        bone_name = target.find_bone(names)
+        if bone_name is None:
+            unmapped.append(names[0])
+            continue
+
+        rest_inverse = target.rest_inverse.get(bone_name)
+        if rest_inverse is None:
+            rest_inverse = np.linalg.inv(node[2]) if node is not None else np.identity(4)
+        location,rotation,scale = decompose_matrices(np.matmul(rest_inverse, matrices))
+
+        frames = times * fps + frame_offset
+        bone_path = 'pose.bones["{}"]'.format(bone_name)
+        for i in range(3):
+            set_fcurve_points(action, bone_path + ".location", i, bone_name, frames, location[:,i])
+        for i in range(4):
+            set_fcurve_points(action, bone_path + ".rotation_quaternion", i, bone_name, frames, rotation[:,i])
+        for i in range(3):
+            set_fcurve_points(action, bone_path + ".scale", i, bone_name, frames, scale[:,i])
+
+    if len(unmapped) > 0:
+        print("[DOS2DE-Importer] Animated nodes with no matching bone in '{}': {}".format(target.obj.name, ", ".join(unmapped)))
+
+    resample_interval = get_resample_interval(context, config)
+    if resample_interval is not None:
+        keys_before,keys_after = resample_action(action, resample_interval)
+        operator.report({'INFO'}, "[DOS2DE-Importer] Resampled action '{}' from '{}' to '{}' keys.".format(action.name, keys_before, keys_after))
+
+    obj = target.obj
+    if obj.animation_data is None:
+        obj.animation_data_create()
+
+    if config.action_library_mode == "NLA":
+        track = obj.animation_data.nla_tracks.get(action_library_track_name)
+        if track is None:
+            track = obj.animation_data.nla_tracks.new()
+            track.name = action_library_track_name
+        start = 1
+        if len(track.strips) > 0:
+            start = int(max([strip.frame_end for strip in track.strips])) + 1
+        track.strips.new(action.name, start, action)
+    else:
+        obj.animation_data.action = action
+
+    operator.report({'INFO'}, "[DOS2DE-Importer] Imported action '{}' with '{}' animated bones.".format(
+        action.name, len(animation.channels) - len(unmapped)))
+    return True
+
+def quaternions_to_matrices(q):
+    """Convert an (N,4) array of (w,x,y,z) quaternions to an (N,3,3) array of rotation matrices."""
+    q = q / np.linalg.norm(q, axis=1)[:,None]
+    w,x,y,z = q[:,0], q[:,1], q[:,2], q[:,3]
+    m = np.empty((len(q), 3, 3))
+    m[:,0,0] = 1.0 - 2.0 * (y * y + z * z)
+    m[:,0,1] = 2.0 * (x * y - w * z)
+    m[:,0,2] = 2.0 * (x * z + w * y)
+    m[:,1,0] = 2.0 * (x * y + w * z)
+    m[:,1,1] = 1.0 - 2.0 * (x * x + z * z)
+    m[:,1,2] = 2.0 * (y * z - w * x)
+    m[:,2,0] = 2.0 * (x * z - w * y)
+    m[:,2,1] = 2.0 * (y * z + w * x)
+    m[:,2,2] = 1.0 - 2.0 * (x * x + y * y)
+    return m
+
+def compose_matrices(location, rotation, scale):
+    """The inverse of decompose_matrices: build (N,4,4) matrices from location, quaternion and scale arrays."""
+    matrices = np.zeros((len(location), 4, 4))
+    matrices[:,:3,:3] = quaternions_to_matrices(rotation) * scale[:,None,:]
+    matrices[:,:3,3] = location
+    matrices[:,3,3] = 1.0
+    return matrices
+
+class DOS2_Base_Skeleton():
+    """Rest matrices of a base skeleton's bones relative to their parents, keyed by normalized bone name."""
+    def __init__(self, nodes):
+        self.locals = {}
+        for node_id,node in nodes.items():
+            name,parent_id,matrix = node
+            local = np.array(matrix)
+            # Blender bones can't hold scale
+            norms = np.linalg.norm(local[:3,:3], axis=0)
+            norms[norms == 0] = 1.0
+            local[:3,:3] /= norms
+            self.locals[normalize_bone_name(name)] = local
+            self.locals.setdefault(normalize_bone_name(node_id), local)
+
+    def get_local(self, bone_name):
+        return self.locals.get(normalize_bone_name(bone_name))
+
+base_skeleton_cache = {}
+
+def load_base_skeleton(skeleton_path, divine_path, timeout=None):
+    """Returns the DOS2_Base_Skeleton for a dae/gr2 file, reading it only the first time (or when the file changes).
+    Divine is stopped if converting a gr2 takes longer than timeout seconds."""
+    if skeleton_path == "" or not os.path.isfile(skeleton_path):
+        return None
+    stat_key = get_stat_key(skeleton_path)
+    cached = base_skeleton_cache.get(skeleton_path)
+    if cached is not None and cached[0] == stat_key:
+        return cached[1]
+
+    print("[DOS2DE-Importer] Loading base skeleton '{}'.".format(skeleton_path))
+    if os.path.splitext(skeleton_path)[1].lower() == ".gr2":
+        if divine_path == "" or not os.path.isfile(divine_path):
+            print("[DOS2DE-Importer] Can't read gr2 base skeleton '{}' without divine.".format(skeleton_path))
+            return None
+        nodes = read_granny_scratch(skeleton_path, divine_path, lambda dae_path: read_collada_animation(dae_path).nodes, timeout)
+    else:
+        nodes = read_collada_animation(skeleton_path).nodes
+    if nodes is None:
+        return None
+
+    skeleton = DOS2_Base_Skeleton(nodes)
+    base_skeleton_cache[skeleton_path] = (stat_key, skeleton)
+    return skeleton
+
+def retarget_action(action, corrections):
+    """Pre-multiply each bone's keyed pose by a correction matrix, reading and writing keys in bulk.
+    corrections maps bone names to 4x4 arrays."""
+    fcurves = {}
+    for fc in action.fcurves:
+        fcurves[(fc.data_path, fc.array_index)] = fc
+
+    channels = [("location", 3, 0.0), ("rotation_quaternion", 4, None), ("scale", 3, 1.0)]
+    for bone_name,correction in corrections.items():
+        bone_path = 'pose.bones["{}"]'.format(bone_name)
+        curves = [(prop, i, fcurves.get((bone_path + "." + prop, i))) for prop,count,_ in channels for i in range(count)]
+        keyed = [fc for prop,i,fc in curves if fc is not None]
+        if len(keyed) == 0:
+            continue
+
+        frames = np.empty(len(keyed[0].keyframe_points) * 2, dtype=np.float32)
+        keyed[0].keyframe_points.foreach_get("co", frames)
+        frames = frames[0::2]
+        count = len(frames)
+
+        values = np.empty((10, count))
+        aligned = []
+        for index,(prop,i,fc) in enumerate(curves):
+            if fc is None:
+                values[index] = 1.0 if prop == "scale" or (prop == "rotation_quaternion" and i == 0) else 0.0
+                aligned.append(False)
+                continue
+            co = np.empty(len(fc.keyframe_points) * 2, dtype=np.float32)
+            fc.keyframe_points.foreach_get("co", co)
+            if len(co) == count * 2 and np.array_equal(co[0::2], frames):
+                values[index] = co[1::2]
+                aligned.append(True)
+            else:
+                values[index] = [fc.evaluate(frame) for frame in frames]
+                aligned.append(False)
+
+        matrices = compose_matrices(values[0:3].T, values[3:7].T, values[7:10].T)
+        location,rotation,scale = decompose_matrices(np.matmul(correction, matrices))
+        corrected = np.concatenate([location.T, rotation.T, scale.T])
+
+        for index,(prop,i,fc) in enumerate(curves):
+            if aligned[index]:
+                co = np.empty(count * 2, dtype=np.float32)
+                co[0::2] = frames
+                co[1::2] = corrected[index]
+                fc.keyframe_points.foreach_set("co", co)
+                fc.update()
+            else:
+                if fc is not None:
+                    action.fcurves.remove(fc)
+                set_fcurve_points(action, bone_path + "." + prop, i, bone_name, frames, corrected[index])
+
+def read_fcurve_points(fcurve):
+    co = np.empty(len(fcurve.keyframe_points) * 2, dtype=np.float32)
+    fcurve.keyframe_points.foreach_get("co", co)
+    return (co[0::2].astype(np.float64), co[1::2].astype(np.float64))
+
+def replace_fcurve_points(action, fcurve, frames, values):
+    """Swap an F-curve for one keyed at the new frames. Rebuilding is much faster than removing keys one by one.
+    The samples are linear, so the new keys interpolate linearly, and the curve keeps its extrapolation."""
+    data_path = fcurve.data_path
+    index = fcurve.array_index
+    group = fcurve.group.name if fcurve.group is not None else ""
+    extrapolation = fcurve.extrapolation
+    action.fcurves.remove(fcurve)
+    fcurve = set_fcurve_points(action, data_path, index, group, frames, values)
+    fcurve.extrapolation = extrapolation
+    for point in fcurve.keyframe_points:
+        point.interpolation = "LINEAR"
+    fcurve.update()
+    return fcurve
+
+def interpolate_keys(frames, values, samples):
+    """Linearly interpolate (N,K) values keyed at frames onto the sample frames, for all K columns at once."""
+    index = np.clip(np.searchsorted(frames, samples, side="right"), 1, len(frames) - 1)
+    start = frames[index - 1]
+    span = frames[index] - start
+    t = np.clip((samples - start) / np.where(span > 0, span, 1.0), 0.0, 1.0)[:,None]
+    return values[index - 1] * (1.0 - t) + values[index] * t
+
+def get_resample_frames(frames, interval):
+    """Evenly spaced frames from the first key to the last, or None if that wouldn't reduce the keys."""
+    if len(frames) < 3 or interval <= 0:
+        return None
+    samples = np.arange(frames[0], frames[-1], interval)
+    samples = np.append(samples[samples < frames[-1] - 0.001], frames[-1])
+    if len(samples) >= len(frames):
+        return None
+    return samples
+
+def get_resample_interval(context, config):
+    """The frame spacing actions are resampled to, or None if resampling is disabled."""
+    if config.action_resample_mode == "FPS":
+        render = context.scene.render
+        return (render.fps / render.fps_base) / config.action_resample_fps
+    elif config.action_resample_mode == "STEP":
+        return config.action_resample_step
+    return None
+
+def resample_action(action, interval):
+    """Resample every F-curve of an action to keys spaced interval frames apart, working on whole curves in NumPy.
+
+    Curves sharing the same key frames are interpolated together. Each quaternion's four channels are
+    interpolated together and normalized, so rotations stay valid between the original keys.
+    Curves with modifiers are left as they are.
+    Returns the key count (before, after).
+    """
+    plain = {}
+    quaternions = {}
+    before = 0
+    for fcurve in list(action.fcurves):
+        before += len(fcurve.keyframe_points)
+        # Rebuilding a curve would drop its modifiers
+        if len(fcurve.modifiers) > 0:
+            continue
+        if fcurve.data_path.endswith("rotation_quaternion"):
+            quaternions.setdefault(fcurve.data_path, {})[fcurve.array_index] = fcurve
+            continue
+        frames,values = read_fcurve_points(fcurve)
+        entry = plain.setdefault(frames.tobytes(), (frames, [], []))
+        entry[1].append(fcurve)
+        entry[2].append(values)
+
+    for data_path,curves in quaternions.items():
+        if len(curves) != 4:
+            for fcurve in curves.values():
+                frames,values = read_fcurve_points(fcurve)
+                entry = plain.setdefault(frames.tobytes(), (frames, [], []))
+                entry[1].append(fcurve)
+                entry[2].append(values)
+            continue
+        points = [read_fcurve_points(curves[i]) for i in range(4)]
+        frames = np.unique(np.concatenate([x[0] for x in points]))
+        samples = get_resample_frames(frames, interval)
+        if samples is None:
+            continue
+        quats = np.stack([np.interp(frames, x[0], x[1]) for x in points], axis=1)
+        quats = make_quaternions_continuous(quats)
+        resampled = interpolate_keys(frames, quats, samples)
+        resampled /= np.linalg.norm(resampled, axis=1)[:,None]
+        for i in range(4):
+            replace_fcurve_points(action, curves[i], samples, resampled[:,i])
+
+    for frames,fcurves,values in plain.values():
+        samples = get_resample_frames(frames, interval)
+        if samples is None:
+            continue
+        resampled = interpolate_keys(frames, np.stack(values, axis=1), samples)
+        for i,fcurve in enumerate(fcurves):
+            replace_fcurve_points(action, fcurve, samples, resampled[:,i])
+
+    after = sum([len(fcurve.keyframe_points) for fcurve in action.fcurves])
+    return (before, after)
+
+def conform_armature(context, obj, skeleton):
+    """Set the rest pose of an armature's bones to the base skeleton's, keeping any keyed animation in place.
+    This expects bones built from the joint matrices, like Blender's collada importer does without Fix Leaf Bones.
+    Returns the amount of bones changed."""
+    old = {}
+    for bone in obj.data.bones:
+        old[bone.name] = np.array(bone.matrix_local)
+
+    new = {}
+    def visit(bone):
+        if bone.parent is None:
+            # The root keeps its placement in the armature, which includes the axis conversion
+            new[bone.name] = old[bone.name]
+        else:
+            local = skeleton.get_local(bone.name)
+            if local is None:
+                local = np.matmul(np.linalg.inv(old[bone.parent.name]), old[bone.name])
+            new[bone.name] = np.matmul(new[bone.parent.name], local)
+        for child in bone.children:
+            visit(child)
+    for bone in obj.data.bones:
+        if bone.parent is None:
+            visit(bone)
+
+    changed = [name for name in new if not np.allclose(new[name], old[name], atol=1e-5)]
+    if len(changed) == 0:
+        return 0
+
+    last_active = context.scene.objects.active
+    # mode_set needs an active object, and there may not be one yet
+    context.scene.objects.active = obj
+    bpy.ops.object.mode_set(mode="OBJECT")
+    bpy.ops.object.mode_set(mode="EDIT")
+    for name in changed:
+        obj.data.edit_bones[name].matrix = Matrix(new[name].tolist())
+    bpy.ops.object.mode_set(mode="OBJECT")
+    context.scene.objects.active = last_active
+
+    action = obj.animation_data.action if obj.animation_data is not None else None
+    if action is not None:
+        # Keys are relative to the rest pose, so move them by the change in each bone's rest relative to its parent
+        corrections = {}
+        for bone in obj.data.bones:
+            if bone.parent is None:
+                old_rest = old[bone.name]
+                new_rest = new[bone.name]
+            else:
+                old_rest = np.matmul(np.linalg.inv(old[bone.parent.name]), old[bone.name])
+                new_rest = np.matmul(np.linalg.inv(new[bone.parent.name]), new[bone.name])
+            correction = np.matmul(np.linalg.inv(new_rest), old_rest)
+            if not np.allclose(correction, np.identity(4), atol=1e-6):
+                corrections[bone.name] = correction
+        retarget_action(action, corrections)
+    return len(changed)
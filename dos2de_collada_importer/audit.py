@@ -0,0 +1,114 @@
+import bpy
+
+import os
+import re
+import gc
+import tracemalloc
+
+from .utils import bytes_to_mb, get_process_memory
+
+audit_collections = ["objects", "meshes", "armatures", "materials", "textures", "images", "actions"]
+
+duplicate_name_pattern = re.compile(r"^(.+)\.\d{3}$")
+
+# Python allocations that survive a garbage collection are only flagged above this, to skip cache noise
+audit_traced_threshold = 1048576
+
+class DOS2_Memory_Snapshot():
+    def __init__(self):
+        gc.collect()
+        self.rss = get_process_memory()[0]
+        self.traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        self.counts = {}
+        self.orphans = {}
+        for attr in audit_collections:
+            collection = getattr(bpy.data, attr)
+            self.counts[attr] = len(collection)
+            self.orphans[attr] = len([x for x in collection if x.users == 0 and not x.use_fake_user])
+        names = set(x.name for x in bpy.data.materials)
+        matches = [duplicate_name_pattern.match(x) for x in names]
+        self.duplicate_materials = len([x for x in matches if x is not None and x.group(1) in names])
+
+class DOS2_Memory_Audit_Entry():
+    def __init__(self, filepath, status, before, after):
+        self.filepath = filepath
+        self.status = status
+        self.rss = after.rss - before.rss
+        self.traced = after.traced - before.traced
+        self.counts = dict((attr, after.counts[attr] - before.counts[attr]) for attr in audit_collections)
+        self.orphans = dict((attr, after.orphans[attr] - before.orphans[attr]) for attr in audit_collections)
+        self.duplicate_materials = after.duplicate_materials - before.duplicate_materials
+
+        self.flags = []
+        for attr in audit_collections:
+            if self.orphans[attr] > 0:
+                self.flags.append("{} orphan {}".format(self.orphans[attr], attr))
+        if self.duplicate_materials > 0:
+            self.flags.append("{} duplicate materials".format(self.duplicate_materials))
+        if self.traced > audit_traced_threshold:
+            self.flags.append("{:.2f} MB python".format(bytes_to_mb(self.traced)))
+
+class DOS2_Memory_Auditor():
+    """Records memory and datablock counts around each imported file, and flags files that leave growth behind.
+
+    Growth is what an import leaves that nothing uses: orphaned datablocks, materials duplicated with a
+    .001 suffix, and Python allocations that survive a garbage collection.
+    """
+    def __init__(self):
+        self.entries = []
+        self.started_tracing = False
+        self.current = None
+        self.start = None
+
+    def begin_batch(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        self.start = DOS2_Memory_Snapshot()
+
+    def begin(self, filepath):
+        self.current = DOS2_Memory_Snapshot()
+
+    def end(self, filepath, status):
+        entry = DOS2_Memory_Audit_Entry(filepath, status, self.current, DOS2_Memory_Snapshot())
+        self.entries.append(entry)
+        self.current = None
+        if len(entry.flags) > 0:
+            print("[DOS2DE-Importer] Memory audit: '{}' left growth behind ({}).".format(os.path.basename(filepath), ", ".join(entry.flags)))
+        return entry
+
+    def end_batch(self):
+        total = DOS2_Memory_Audit_Entry("", "", self.start, DOS2_Memory_Snapshot())
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        return total
+
+    def get_flagged(self):
+        return [x for x in self.entries if len(x.flags) > 0]
+
+    def format_table(self, total):
+        header = ["File", "Status", "RSS MB", "Python MB"] + audit_collections + ["Flags"]
+        rows = []
+        for entry in self.entries + [total]:
+            name = os.path.basename(entry.filepath) if entry.filepath != "" else "Batch Total"
+            row = [name, entry.status, "{:+.2f}".format(bytes_to_mb(entry.rss)), "{:+.2f}".format(bytes_to_mb(entry.traced))]
+            row.extend(["{:+d}".format(entry.counts[attr]) for attr in audit_collections])
+            row.append("; ".join(entry.flags))
+            rows.append(row)
+        widths = [max(len(header[i]), max(len(row[i]) for row in rows)) for i in range(len(header))]
+        lines = ["  ".join(x.ljust(widths[i]) for i,x in enumerate(header)).rstrip()]
+        lines.append("  ".join("-" * x for x in widths))
+        for row in rows:
+            lines.append("  ".join(x.ljust(widths[i]) for i,x in enumerate(row)).rstrip())
+        return "\n".join(lines)
+
+    def write_report(self, total):
+        """Write the per-file delta table for the batch. Returns the report's path."""
+        from .importer import get_batch_report_path
+        path = get_batch_report_path("audit.txt")
+        with open(path, "w") as f:
+            f.write("Datablock columns are the change in each bpy.data collection. Flags list growth left behind after the import.\n\n")
+            f.write(self.format_table(total))
+            f.write("\n")
+        return path
@@ -0,0 +1,375 @@
+import os
+import re
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from .utils import get_cache_dir, get_manifest_key, get_stat_key
+from .divine import read_granny_scratch
+
+collada_namespace = "{http://www.collada.org/2005/11/COLLADASchema}"
+
+def collada_tag(name):
+    return collada_namespace + name
+
+def read_collada_floats(element):
+    if element is None or element.text is None:
+        return np.zeros(0)
+    return np.array(element.text.split(), dtype=np.float64)
+
+class DOS2_Collada_Animation():
+    def __init__(self):
+        # node id -> (name, parent id, rest matrix relative to the parent)
+        self.nodes = {}
+        # (node id, times, local matrices)
+        self.channels = []
+
+def read_collada_animation(filepath):
+    """Read the node hierarchy and matrix animations of a dae file, without building anything in the scene."""
+    animation = DOS2_Collada_Animation()
+    sources = {}
+    samplers = {}
+    channels = []
+    node_stack = []
+    in_animations = False
+
+    for event,elem in ET.iterparse(filepath, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == collada_tag("node"):
+                node_id = elem.get("id", elem.get("name", ""))
+                parent_id = node_stack[-1] if len(node_stack) > 0 else None
+                animation.nodes[node_id] = (elem.get("name", node_id), parent_id, np.identity(4))
+                node_stack.append(node_id)
+            elif tag == collada_tag("library_animations"):
+                in_animations = True
+            continue
+
+        if tag == collada_tag("node"):
+            node_stack.pop()
+        elif tag == collada_tag("matrix") and len(node_stack) > 0:
+            node_id = node_stack[-1]
+            name,parent_id,_ = animation.nodes[node_id]
+            animation.nodes[node_id] = (name, parent_id, read_collada_floats(elem).reshape(4, 4))
+        elif tag == collada_tag("library_animations"):
+            in_animations = False
+        elif in_animations:
+            if tag == collada_tag("source"):
+                values = read_collada_floats(elem.find(collada_tag("float_array")))
+                accessor = elem.find("{0}technique_common/{0}accessor".format(collada_namespace))
+                stride = int(accessor.get("stride", 1)) if accessor is not None else 1
+                sources[elem.get("id")] = (values, stride)
+                elem.clear()
+            elif tag == collada_tag("sampler"):
+                inputs = {}
+                for sampler_input in elem.findall(collada_tag("input")):
+                    inputs[sampler_input.get("semantic")] = sampler_input.get("source", "").lstrip("#")
+                samplers[elem.get("id")] = inputs
+            elif tag == collada_tag("channel"):
+                channels.append((elem.get("source", "").lstrip("#"), elem.get("target", "")))
+        elif tag == collada_tag("geometry") or tag == collada_tag("controller"):
+            elem.clear()
+
+    for sampler_id,target in channels:
+        inputs = samplers.get(sampler_id)
+        if inputs is None or not "INPUT" in inputs or not "OUTPUT" in inputs:
+            continue
+        times,_ = sources.get(inputs["INPUT"], (None, 0))
+        values,stride = sources.get(inputs["OUTPUT"], (None, 0))
+        if times is None or values is None or stride != 16:
+            print("[DOS2DE-Importer] Skipping non-matrix animation channel '{}'.".format(target))
+            continue
+        node_id = target.split("/")[0]
+        animation.channels.append((node_id, times, values.reshape(-1, 4, 4)))
+    return animation
+
+class DOS2_File_Info():
+    def __init__(self):
+        self.kind = "UNKNOWN"
+        self.size = 0
+        self.vertices = 0
+        self.triangles = 0
+        self.bones = 0
+        self.has_animation = False
+        self.time_start = None
+        self.time_end = None
+
+class DOS2_Collada_Scanner():
+    """Collects file info from a dae with expat callbacks, without building elements or keeping geometry text.
+
+    Skinned files are counted by their skin's joints, so scanning stops before the visual scenes.
+    """
+    def __init__(self):
+        self.info = DOS2_File_Info()
+        self.done = False
+        self.path = []
+        self.source_id = None
+        self.source_is_time = False
+        self.source_is_joint = False
+        self.joints = 0
+        self.text = None
+        self.pending_text = None
+        self.accessor_counts = {}
+        self.position_sources = []
+        self.geometries = 0
+        self.controllers = 0
+
+    def start(self, name, attrs):
+        if self.done:
+            return
+        parent = self.path[-1] if len(self.path) > 0 else None
+        self.path.append(name)
+        info = self.info
+        if name == "source":
+            self.source_id = attrs.get("id")
+            self.source_is_time = False
+            self.source_is_joint = False
+        elif name == "accessor" and self.source_id is not None:
+            self.accessor_counts[self.source_id] = int(attrs.get("count", 0))
+        elif name == "param" and attrs.get("name") == "TIME":
+            self.source_is_time = True
+        elif name == "param" and attrs.get("name") == "JOINT":
+            self.source_is_joint = True
+        elif name == "input" and parent == "vertices" and attrs.get("semantic") == "POSITION":
+            self.position_sources.append(attrs.get("source", "").lstrip("#"))
+        elif name == "triangles" or name == "polylist" or name == "polygons":
+            info.triangles += int(attrs.get("count", 0))
+        elif name == "geometry":
+            self.geometries += 1
+        elif name == "controller":
+            self.controllers += 1
+        elif name == "node" and attrs.get("type") == "JOINT":
+            info.bones += 1
+        elif name == "animation":
+            info.has_animation = True
+        elif name == "float_array" and info.time_start is None and "library_animations" in self.path:
+            self.text = []
+        elif name == "library_visual_scenes" and self.joints > 0:
+            # The skin already gave the bone count, and nothing else is needed from the scene
+            info.bones = self.joints
+            self.done = True
+        elif name == "scene":
+            self.done = True
+
+    def end(self, name):
+        if self.done:
+            return
+        self.path.pop()
+        if name == "float_array" and self.text is not None:
+            self.pending_text = "".join(self.text)
+            self.text = None
+        elif name == "source":
+            if self.source_is_time and self.pending_text is not None:
+                times = self.pending_text.split()
+                if len(times) > 0:
+                    self.info.time_start = float(times[0])
+                    self.info.time_end = float(times[-1])
+            if self.source_is_joint:
+                self.joints = max(self.joints, self.accessor_counts.get(self.source_id, 0))
+            self.pending_text = None
+            self.source_id = None
+        elif name == "library_visual_scenes":
+            self.done = True
+
+    def data(self, text):
+        if self.text is not None:
+            self.text.append(text)
+
+    def finish(self):
+        info = self.info
+        info.vertices = sum([self.accessor_counts.get(source, 0) for source in self.position_sources])
+        if info.has_animation and self.geometries == 0:
+            info.kind = "ANIMATION"
+        elif self.controllers > 0:
+            info.kind = "SKINNED_MESH"
+        elif self.geometries > 0:
+            info.kind = "MESH"
+        elif info.bones > 0:
+            info.kind = "RIG"
+        return info
+
+def scan_collada_info(filepath, chunk_size=65536):
+    """Read counts from a dae, stopping once the scene libraries have been seen."""
+    import xml.parsers.expat
+    scanner = DOS2_Collada_Scanner()
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = scanner.start
+    parser.EndElementHandler = scanner.end
+    parser.CharacterDataHandler = scanner.data
+    try:
+        with open(filepath, "rb") as f:
+            while not scanner.done:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                parser.Parse(chunk, False)
+    except xml.parsers.expat.ExpatError as e:
+        print("[DOS2DE-Importer] Error scanning '{}': {}".format(filepath, e))
+        return DOS2_File_Info()
+    return scanner.finish()
+
+def scan_granny_info(filepath, divine_path, timeout=None):
+    """Convert a gr2 to a scratch dae with divine and scan that."""
+    return read_granny_scratch(filepath, divine_path, scan_collada_info, timeout)
+
+collada_mesh_sections = ("library_geometries", "library_controllers", "library_materials", "library_effects", "library_images")
+collada_animation_sections = ("library_animations", "library_animation_clips")
+
+def find_collada_sections(data, name):
+    """Yields the (start, end) byte ranges of every <name> element in the dae's bytes (or an mmap of them)."""
+    open_tag = b"<" + name.encode()
+    close_tag = b"</" + name.encode() + b">"
+    pos = 0
+    while True:
+        start = data.find(open_tag, pos)
+        if start < 0:
+            return
+        pos = start + len(open_tag)
+        if not data[pos:pos+1] in (b">", b"/", b" ", b"\t", b"\r", b"\n"):
+            # A longer tag that starts the same way
+            continue
+        tag_end = data.find(b">", pos)
+        if tag_end < 0:
+            return
+        if data[tag_end-1:tag_end] == b"/":
+            end = tag_end + 1
+        else:
+            end = data.find(close_tag, tag_end)
+            if end < 0:
+                return
+            end += len(close_tag)
+        yield (start, end)
+        pos = end
+
+def strip_scene_mesh_instances(fragment):
+    """Remove the mesh instances from a <library_visual_scenes> fragment. Nodes that only held a mesh are removed too."""
+    root = ET.fromstring(fragment)
+    instance_tags = ("instance_geometry", "instance_controller")
+    def strip(parent):
+        for child in list(parent):
+            if child.tag != "node" and child.tag != "visual_scene":
+                continue
+            instances = [x for x in child if x.tag in instance_tags]
+            if len(instances) > 0 and child.find("node") is None:
+                parent.remove(child)
+                continue
+            for instance in instances:
+                child.remove(instance)
+            strip(child)
+    strip(root)
+    return ET.tostring(root, encoding="utf-8")
+
+collada_init_from_pattern = re.compile(rb"(<init_from>)([^<]*)(</init_from>)")
+collada_uri_scheme_pattern = re.compile(r"^[A-Za-z][A-Za-z0-9+.-]+:")
+
+def absolute_image_paths(fragment, base_dir):
+    """Make the relative image paths in a <library_images> fragment absolute file URIs, resolved against base_dir
+    like Blender's collada importer would resolve them against the original file."""
+    from pathlib import Path
+    from urllib.parse import unquote
+    def replace(m):
+        path = m.group(2).decode("utf-8").strip()
+        if path == "" or collada_uri_scheme_pattern.match(path) or os.path.isabs(unquote(path)):
+            return m.group(0)
+        path = os.path.normpath(os.path.join(base_dir, unquote(path)))
+        return m.group(1) + Path(path).as_uri().encode("utf-8") + m.group(3)
+    return collada_init_from_pattern.sub(replace, fragment)
+
+def strip_collada(filepath, dest, sections, strip_meshes=False, chunk_size=1048576):
+    """Write a copy of a dae without the given library sections, streaming the kept bytes from a memory map.
+
+    With strip_meshes, the visual scene's mesh instances are removed as well, so nothing refers to the
+    stripped geometry. Kept images have their relative paths made absolute, since dest is usually in another
+    directory. Returns the number of bytes removed, or 0 if nothing was removed and dest wasn't written.
+    """
+    import mmap
+    if os.path.getsize(filepath) == 0:
+        return 0
+    with open(filepath, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            ranges = []
+            for name in sections:
+                ranges.extend([(start, end, b"") for start,end in find_collada_sections(data, name)])
+            if strip_meshes:
+                for start,end in find_collada_sections(data, "library_visual_scenes"):
+                    ranges.append((start, end, strip_scene_mesh_instances(data[start:end])))
+            if len(ranges) == 0:
+                return 0
+            if not "library_images" in sections:
+                base_dir = os.path.dirname(os.path.abspath(filepath))
+                for start,end in find_collada_sections(data, "library_images"):
+                    ranges.append((start, end, absolute_image_paths(data[start:end], base_dir)))
+            ranges.sort()
+
+            removed = 0
+            pos = 0
+            with open(dest, "wb") as out:
+                for start,end,replacement in ranges + [(len(data), len(data), b"")]:
+                    if start < pos:
+                        continue
+                    for chunk_start in range(pos, start, chunk_size):
+                        out.write(data[chunk_start:min(chunk_start + chunk_size, start)])
+                    out.write(replacement)
+                    removed += (end - start) - len(replacement)
+                    pos = end
+    return removed
+
+file_info_cache = {}
+granny_info_cache_name = "gr2_info.json"
+# The gr2 info cache file's entries, read once per session
+granny_info_entries = {}
+
+def read_granny_info_cache():
+    import json
+    if "entries" in granny_info_entries:
+        return granny_info_entries["entries"]
+    entries = {}
+    cache_file = os.path.join(get_cache_dir("scan"), granny_info_cache_name)
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file, "r") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+    granny_info_entries["entries"] = entries
+    return entries
+
+def write_granny_info_cache(filepath, stat_key, info):
+    import json
+    cache_file = os.path.join(get_cache_dir("scan"), granny_info_cache_name)
+    entries = read_granny_info_cache()
+    entries[get_manifest_key(filepath)] = {"stat": stat_key, "info": info.__dict__}
+    with open(cache_file, "w") as f:
+        json.dump(entries, f)
+
+def get_file_info(filepath, divine_path="", allow_convert=False, timeout=None):
+    """Returns the memoized DOS2_File_Info for a dae/gr2 file, or None if it hasn't been scanned.
+    Gr2 files are only converted for scanning when allow_convert is set, since that runs divine,
+    stopping it after timeout seconds.
+    Files that haven't been scanned are memoized too, so redraws don't look them up again."""
+    try:
+        stat_key = get_stat_key(filepath)
+    except OSError:
+        return None
+    cached = file_info_cache.get(filepath)
+    if cached is not None and cached[0] == stat_key and (cached[1] is not None or not allow_convert):
+        return cached[1]
+
+    ext = os.path.splitext(filepath)[1].lower()
+    info = None
+    if ext == ".dae":
+        info = scan_collada_info(filepath)
+    elif ext == ".gr2":
+        entry = read_granny_info_cache().get(get_manifest_key(filepath))
+        if entry is not None and entry["stat"] == stat_key:
+            info = DOS2_File_Info()
+            info.__dict__.update(entry["info"])
+        elif allow_convert and divine_path != "" and os.path.isfile(divine_path):
+            info = scan_granny_info(filepath, divine_path, timeout)
+            if info is not None:
+                write_granny_info_cache(filepath, stat_key, info)
+    if info is not None:
+        info.size = os.path.getsize(filepath)
+    file_info_cache[filepath] = (stat_key, info)
+    return info
@@ -0,0 +1,149 @@
+import collections
+
+from .renaming import get_rename_table, get_user_rename_patterns
+
+import_setting_names = (
+    "filter_search",
+    "apply_transformation",
+    "delete_objects",
+    "rename_armatures",
+    "rename_meshes",
+    "use_rename_junk",
+    "rename_dry_run",
+    "use_build_material",
+    "auto_connect",
+    "find_chains",
+    "min_chain_length",
+    "fix_orientation",
+    "import_units",
+    "keep_bind_info",
+    "import_animations",
+    "dae_prefilter",
+    "use_dedup_meshes",
+    "weights_clean_enabled",
+    "weights_max_influences",
+    "weights_prune_threshold",
+    "use_converted_normalmaps",
+    "texture_prefetch",
+    "texture_proxy_level",
+    "action_autorename",
+    "action_set_fake_user",
+    "action_offset_zero",
+    "action_resample_mode",
+    "action_resample_fps",
+    "action_resample_step",
+    "gr2_delete_dae",
+    "gr2_batch_convert",
+    "gr2_conform_enabled",
+    "gr2_set_skeleton",
+    "gr2_conform_mode",
+    "gr2_base_skeleton",
+    "gr2_conform_skeleton_path",
+    "action_clean_enabled",
+    "action_clean_threshold",
+    "action_clean_channels",
+    "action_library_mode",
+    "action_library_armature",
+    "library_cache_mode",
+)
+
+import_derived_names = (
+    "divine_path",
+    "assets_dir",
+    "prefetch_limit",
+    "library_cache_limit",
+    "divine_service_enabled",
+    "divine_service_port",
+    "divine_timeout",
+    "divine_timeout_per_mb",
+    "divine_retries",
+    "base_skeletons",
+    "rename_user_patterns",
+    "conform_skeleton_path",
+    "rename_table_shorthand",
+    "rename_table_file",
+    "enabled_stages",
+)
+
+DOS2_Import_Config = collections.namedtuple("DOS2_Import_Config", import_setting_names + import_derived_names)
+DOS2_Import_Config.__doc__ = """The scene settings and addon preferences for an import batch, resolved once and shared by every file.
+
+Being a plain tuple of plain values, it can be pickled and handed to worker processes that have no bpy context.
+Use replace_import_config to change fields, so the derived values stay in sync.
+
+divine_path, assets_dir, prefetch_limit, library_cache_limit, divine_service_enabled, divine_service_port,
+divine_timeout, divine_timeout_per_mb, divine_retries: From the addon preferences.
+base_skeletons: Tuple of (key, (path, race, gender)) for the base skeletons found in the assets directory.
+rename_user_patterns: The enabled (find, replace) rename patterns from the addon preferences.
+conform_skeleton_path: The skeleton to conform to, unless gr2_base_skeleton is AUTO, where it depends on the file.
+rename_table_shorthand, rename_table_file: Compiled rename tables for the shorthand and filename rename options.
+enabled_stages: The post-import stages the settings enable. plan_import_stages narrows these per file.
+"""
+
+def get_enabled_stages(config):
+    stages = set()
+    if config.gr2_conform_enabled and config.gr2_conform_mode == "BLENDER":
+        stages.add("CONFORM")
+    if (config.action_offset_zero or config.action_autorename or config.action_set_fake_user or
+            config.action_resample_mode != "DISABLED"):
+        stages.add("ACTIONS")
+    if config.apply_transformation:
+        stages.add("TRANSFORM")
+    if config.delete_objects != "DISABLED":
+        stages.add("DELETE")
+    if config.weights_clean_enabled:
+        stages.add("WEIGHTS")
+    if config.rename_armatures != "DISABLED" or config.rename_meshes != "DISABLED":
+        stages.add("RENAME")
+    if config.use_build_material:
+        stages.add("MATERIALS")
+    if config.use_dedup_meshes:
+        stages.add("DEDUP")
+    return frozenset(stages)
+
+def resolve_derived(config):
+    from .divine import resolve_conform_skeleton_path
+    return config._replace(
+        conform_skeleton_path=resolve_conform_skeleton_path(config),
+        rename_table_shorthand=get_rename_table(True, config.use_rename_junk, config.rename_user_patterns),
+        rename_table_file=get_rename_table(False, config.use_rename_junk, config.rename_user_patterns),
+        enabled_stages=get_enabled_stages(config))
+
+def resolve_import_config(context, settings):
+    """Read the scene settings and addon preferences into a DOS2_Import_Config."""
+    from .divine import find_base_skeletons
+    values = dict((name, None) for name in import_derived_names)
+    values.update((name, getattr(settings, name)) for name in import_setting_names)
+    values["divine_path"] = ""
+    values["assets_dir"] = ""
+    values["prefetch_limit"] = 0
+    values["library_cache_limit"] = 0
+    values["divine_service_enabled"] = False
+    values["divine_service_port"] = 0
+    values["divine_timeout"] = 0
+    values["divine_timeout_per_mb"] = 0.0
+    values["divine_retries"] = 0
+    if "dos2de_collada_importer" in context.user_preferences.addons:
+        preferences = context.user_preferences.addons["dos2de_collada_importer"].preferences
+        if preferences is not None:
+            if "divine_path" in preferences:
+                values["divine_path"] = preferences.divine_path
+            if "extracted_assets_dir" in preferences:
+                values["assets_dir"] = preferences.extracted_assets_dir
+            values["prefetch_limit"] = preferences.prefetch_limit * 1048576
+            values["library_cache_limit"] = preferences.library_cache_limit * 1048576
+            values["divine_service_enabled"] = preferences.divine_service_enabled
+            values["divine_service_port"] = preferences.divine_service_port
+            values["divine_timeout"] = preferences.divine_timeout
+            values["divine_timeout_per_mb"] = preferences.divine_timeout_per_mb
+            values["divine_retries"] = preferences.divine_retries
+
+    values["base_skeletons"] = ()
+    if settings.gr2_conform_enabled and settings.gr2_base_skeleton != "DISABLED":
+        values["base_skeletons"] = tuple(sorted(find_base_skeletons(values["assets_dir"]).items()))
+    values["rename_user_patterns"] = get_user_rename_patterns(context)
+    return resolve_derived(DOS2_Import_Config(**values))
+
+def replace_import_config(config, **changes):
+    """config._replace, updating the derived values that depend on the changed settings."""
+    return resolve_derived(config._replace(**changes))
@@ -0,0 +1,355 @@
+import os
+import subprocess
+
+from . import divine_service
+
+base_skeleton_directories = ["Dwarves", "Elves", "Humans", "Lizards"]
+base_skeleton_dict = {}
+
+def find_base_skeletons(assets_dir):
+    """Returns a dict of base skeleton keys (e.g. Humans_Female) to (path, race, gender), for the base skeletons in the assets directory."""
+    skeletons = {}
+    if assets_dir != "" and os.path.isdir(assets_dir):
+        characters_dir = os.path.join(assets_dir, "Characters")
+        if os.path.isdir(characters_dir):
+            for race in base_skeleton_directories:
+                race_dir = os.path.join(characters_dir, race)
+                if os.path.isdir(race_dir):
+                    for gender in ["Female", "Male"]:
+                        base_skeleton = os.path.join(race_dir, race + "_" + gender + "_Base.gr2")
+                        if os.path.isfile(base_skeleton):
+                            skeletons[race + "_" + gender] = (base_skeleton, race, gender)
+    return skeletons
+
+def get_base_skeletons(scene, context):
+    assets_dir = ""
+    if "dos2de_collada_importer" in context.user_preferences.addons:
+        preferences = context.user_preferences.addons["dos2de_collada_importer"].preferences
+        if preferences is not None:
+            if "extracted_assets_dir" in preferences:
+                assets_dir = preferences.extracted_assets_dir
+    
+    skeletons = [("DISABLED", "Disabled", "")]
+    skeletons.append(("AUTO", "Auto", "Auto-select a base skeleton to conform to, based on the file name.\nThis happens when importing, to support multiple imports"))
+
+    found = find_base_skeletons(assets_dir)
+    for race in base_skeleton_directories:
+        for gender in ["Female", "Male"]:
+            key = race + "_" + gender
+            if key in found:
+                skeletons.append((key, race + " " + gender, found[key][0]))
+    base_skeleton_dict.update(found)
+    return skeletons
+
+def read_granny_scratch(filepath, divine_path, reader, timeout=None):
+    """Convert a gr2 to a scratch dae with divine, and return what reader returns for it.
+    Returns None if the conversion failed, or took longer than timeout seconds."""
+    import tempfile
+    import shutil
+    temp_dir = tempfile.mkdtemp(prefix="dos2de_")
+    try:
+        dae_path = os.path.join(temp_dir, os.path.splitext(os.path.basename(filepath))[0] + ".dae")
+        if convert_granny(None, filepath, divine_path, dae_temp_path=dae_path, timeout=timeout) is None:
+            return None
+        return reader(dae_path)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def resolve_conform_skeleton_path(config):
+    """The skeleton to conform to for every file, or the fallback when the base skeleton is auto-selected per file."""
+    conform_skeleton_path = ""
+    if config.gr2_conform_enabled == True:
+        conform_skeleton_path = config.gr2_conform_skeleton_path
+        base_skeleton = config.gr2_base_skeleton
+        if base_skeleton is not None and base_skeleton != "DISABLED" and base_skeleton != "AUTO":
+            print("[DOS2DE-Importer] Looking for '{}'.".format(base_skeleton))
+            entry = dict(config.base_skeletons).get(base_skeleton)
+            if entry is not None and os.path.isfile(entry[0]):
+                conform_skeleton_path = entry[0]
+                print("[DOS2DE-Importer] Using base skeleton '{}'.".format(conform_skeleton_path))
+        elif base_skeleton is None or base_skeleton == "DISABLED":
+            print("[DOS2DE-Importer] No base skeleton set. Using conform path.")
+    return conform_skeleton_path
+
+def get_conform_skeleton_path(load_filepath, config):
+    if config.gr2_conform_enabled != True or config.gr2_base_skeleton != "AUTO":
+        return config.conform_skeleton_path
+
+    filename = os.path.basename(load_filepath)
+    print("  [DOS2DE-Importer] Auto-select base skeleton set. Looking for match in name {}".format(load_filepath))
+
+    auto_skeleton = None
+    for key,entry in config.base_skeletons:
+        base_file = entry[0]
+        if filename.count(key) > 0:
+            auto_skeleton = base_file
+            break
+        else:
+            race = entry[1]
+            gender = entry[2]
+            if filename.count(race + "_Hero_"+gender) > 0:
+                auto_skeleton = base_file
+                break
+
+    if auto_skeleton is not None and os.path.isfile(auto_skeleton):
+        print("    [DOS2DE-Importer] Auto-selected skeleton {}".format(auto_skeleton))
+        return auto_skeleton
+    print("    [DOS2DE-Importer] No auto base skeleton found.")
+    return config.conform_skeleton_path
+
+def get_granny_temp_path(load_filepath):
+    from pathlib import Path
+    path_start = Path(load_filepath)
+    return str(Path(str(path_start.with_suffix("")) + "-temp.dae"))
+
+def get_conversion_timeout(filepath, config):
+    """The seconds divine may take to convert a file before it's killed, scaled by the file's size. None disables the timeout."""
+    if config.divine_timeout <= 0:
+        return None
+    size = os.path.getsize(filepath) if os.path.isfile(filepath) else 0
+    return config.divine_timeout + config.divine_timeout_per_mb * size / 1048576.0
+
+def run_divine(proccess_args, timeout=None):
+    """Run a divine command, killing it if it's still running after timeout seconds. Returns the completed process,
+    or None if it timed out."""
+    if os.name != "nt":
+        import shlex
+        proccess_args = shlex.split(proccess_args)
+    try:
+        return subprocess.run(proccess_args,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return None
+
+def convert_granny(operator, load_filepath, divine_path, conform_skeleton_path="", dae_temp_path=None, timeout=None):
+    """Convert a gr2 file to a temporary dae with divine. Returns the dae path, or None if the conversion failed."""
+    dae_temp_path,error_message = try_convert_granny(load_filepath, divine_path, conform_skeleton_path, dae_temp_path, timeout)
+    if error_message is not None:
+        if operator is not None:
+            operator.report({"ERROR"}, error_message)
+        print(error_message)
+    return dae_temp_path
+
+def try_convert_granny(load_filepath, divine_path, conform_skeleton_path="", dae_temp_path=None, timeout=None):
+    """Returns (dae path, None) if the conversion worked, or (None, error message) if it failed or timed out."""
+    divine_exe = '"{}"'.format(divine_path)
+    
+    if dae_temp_path is None:
+        dae_temp_path = get_granny_temp_path(load_filepath)
+
+    if conform_skeleton_path is not None and os.path.isfile(conform_skeleton_path):
+        gr2_options_str = "-e conform -e conform-copy --conform-path \"{}\"".format(conform_skeleton_path)
+    else:
+        gr2_options_str = ""
+
+    proccess_args = "{} --loglevel all -g dos2de -s \"{}\" -d \"{}\" -i gr2 -o dae -a convert-model {}".format(
+        divine_exe, load_filepath, dae_temp_path, gr2_options_str)
+
+    print("Starting GR2->DAE conversion using divine.exe.")
+    print("Sending command: {}".format(proccess_args))
+
+    process = run_divine(proccess_args, timeout)
+
+    if process is None:
+        # Don't leave a partly written dae behind for the importer to pick up
+        if os.path.isfile(dae_temp_path):
+            os.remove(dae_temp_path)
+        return (None, "[DOS2DE-Importer] [ERROR:TIMEOUT] Divine didn't finish converting GR2 to DAE in {:.0f} seconds, and was stopped.".format(timeout))
+
+    print(process.stdout)
+    
+    if process.returncode != 0:
+        #raise Exception("Error converting DAE to GR2: \"{}\"{}".format(process.stderr, process.stdout))
+        return (None, "[DOS2DE-Importer] [ERROR:{}] Error converting GR2 to DAE. {}".format(process.returncode, '\n'.join(process.stdout.splitlines()[-1:])))
+    return (dae_temp_path, None)
+
+# (source path, reason) for the files quarantined or skipped for being quarantined this batch
+batch_quarantined = []
+quarantine_name = "quarantine.json"
+
+def read_quarantine():
+    import json
+    from .utils import get_cache_dir
+    quarantine_file = os.path.join(get_cache_dir("conversion"), quarantine_name)
+    if os.path.isfile(quarantine_file):
+        try:
+            with open(quarantine_file, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    return {}
+
+def write_quarantine(entries):
+    import json
+    from .utils import get_cache_dir
+    with open(os.path.join(get_cache_dir("conversion"), quarantine_name), "w") as f:
+        json.dump(entries, f, indent=1)
+
+def quarantine_file(load_filepath, reason, divine_path, conform_skeleton_path=""):
+    """Skip the file in later conversions until it changes, so it can't hang every batch it's part of.
+    The divine and conform skeleton it failed with are kept, since a failure may come from either."""
+    from .utils import get_manifest_key, get_stat_key
+    entries = read_quarantine()
+    entries[get_manifest_key(load_filepath)] = {"filepath": load_filepath, "stat": get_stat_key(load_filepath),
+        "divine": divine_path, "conform": conform_skeleton_path or "", "reason": reason}
+    write_quarantine(entries)
+    batch_quarantined.append((load_filepath, reason))
+
+def get_quarantine_reason(load_filepath, divine_path, conform_skeleton_path=""):
+    """Why the file was quarantined, or None if it isn't, or it, the divine path or the conform skeleton
+    have changed since."""
+    from .utils import get_manifest_key, get_stat_key
+    entry = read_quarantine().get(get_manifest_key(load_filepath))
+    if entry is None or entry["stat"] != get_stat_key(load_filepath):
+        return None
+    if entry.get("divine") != divine_path or entry.get("conform") != (conform_skeleton_path or ""):
+        return None
+    return entry["reason"]
+
+def clear_quarantine():
+    """Forget every quarantined file. Returns how many there were."""
+    entries = read_quarantine()
+    write_quarantine({})
+    return len(entries)
+
+def skip_quarantined(operator, load_filepath, divine_path, conform_skeleton_path=""):
+    """Returns True if the file is quarantined, reporting that it's skipped."""
+    reason = get_quarantine_reason(load_filepath, divine_path, conform_skeleton_path)
+    if reason is None:
+        return False
+    operator.report({"WARNING"}, "[DOS2DE-Importer] Skipping quarantined file '{}'. It failed to convert before: {}".format(load_filepath, reason))
+    batch_quarantined.append((load_filepath, "Skipped. Quarantined earlier: {}".format(reason)))
+    return True
+
+def convert_granny_supervised(operator, load_filepath, config, conform_skeleton_path=""):
+    """convert_granny with a timeout scaled by the file's size, retrying failed or hung conversions.
+
+    Files that fail every attempt are quarantined. Returns the dae path, or None if the conversion failed.
+    """
+    timeout = get_conversion_timeout(load_filepath, config)
+    attempts = max(1, config.divine_retries + 1)
+    error_message = None
+    for attempt in range(attempts):
+        if attempt > 0:
+            print("[DOS2DE-Importer] Retrying conversion of '{}' ({}/{}).".format(load_filepath, attempt + 1, attempts))
+        dae_temp_path,error_message = try_convert_granny(load_filepath, config.divine_path, conform_skeleton_path, timeout=timeout)
+        if dae_temp_path is not None:
+            return dae_temp_path
+        print(error_message)
+
+    operator.report({"ERROR"}, error_message)
+    operator.report({"WARNING"}, "[DOS2DE-Importer] Quarantined '{}' after '{}' failed conversions.".format(load_filepath, attempts))
+    quarantine_file(load_filepath, error_message.replace("[DOS2DE-Importer] ", "", 1), config.divine_path, conform_skeleton_path)
+    return None
+
+batch_conversions = {}
+
+def is_collada_complete(dae_path):
+    """Checks that a dae ends with the closing COLLADA tag, so one cut off mid-write isn't imported."""
+    with open(dae_path, "rb") as f:
+        f.seek(max(0, os.path.getsize(dae_path) - 256))
+        return b"</COLLADA>" in f.read()
+
+def convert_granny_batch(operator, filepaths, divine_path, conform_skeleton_path="", timeout=None):
+    """Convert several gr2 files with one divine process, so divine's startup is paid once.
+
+    The files are staged into a job directory and converted with divine's convert-models action. Each output
+    is moved to the file's usual temporary dae path. If divine runs past the timeout, it's stopped.
+    When divine is stopped or fails, only the outputs it finished writing are used. Returns a dict of source path to dae path for the files
+    that converted. Anything missing from it should be converted on its own.
+    """
+    import tempfile
+    import shutil
+    job_dir = tempfile.mkdtemp(prefix="dos2de_batch_")
+    try:
+        source_dir = os.path.join(job_dir, "source")
+        dest_dir = os.path.join(job_dir, "dest")
+        os.makedirs(source_dir)
+        os.makedirs(dest_dir)
+
+        staged = {}
+        for filepath in filepaths:
+            stem = os.path.splitext(os.path.basename(filepath))[0]
+            if os.path.normcase(stem) in staged:
+                # Same name from another folder. It's converted on its own instead.
+                continue
+            staged_path = os.path.join(source_dir, stem + ".gr2")
+            try:
+                os.link(filepath, staged_path)
+            except OSError:
+                shutil.copy2(filepath, staged_path)
+            staged[os.path.normcase(stem)] = (stem, filepath)
+
+        divine_exe = '"{}"'.format(divine_path)
+        if conform_skeleton_path is not None and os.path.isfile(conform_skeleton_path):
+            gr2_options_str = "-e conform -e conform-copy --conform-path \"{}\"".format(conform_skeleton_path)
+        else:
+            gr2_options_str = ""
+
+        proccess_args = "{} --loglevel all -g dos2de -s \"{}\" -d \"{}\" -i gr2 -o dae -a convert-models {}".format(
+            divine_exe, source_dir, dest_dir, gr2_options_str)
+
+        print("[DOS2DE-Importer] Converting '{}' GR2 files with one divine process.".format(len(staged)))
+        print("Sending command: {}".format(proccess_args))
+
+        process = run_divine(proccess_args, timeout)
+
+        if process is not None:
+            print(process.stdout)
+
+        results = {}
+        for stem,filepath in staged.values():
+            output = os.path.join(dest_dir, stem + ".dae")
+            if not os.path.isfile(output) or os.path.getsize(output) == 0:
+                continue
+            if (process is None or process.returncode != 0) and not is_collada_complete(output):
+                # Divine was stopped or crashed while writing it
+                continue
+            dae_temp_path = get_granny_temp_path(filepath)
+            shutil.move(output, dae_temp_path)
+            results[filepath] = dae_temp_path
+
+        if process is None:
+            print("[DOS2DE-Importer] [ERROR:TIMEOUT] Batch conversion didn't finish in {:.0f} seconds, and was stopped.".format(timeout))
+        elif process.returncode != 0:
+            print("[DOS2DE-Importer] [ERROR:{}] Batch conversion failed. {}".format(process.returncode, '\n'.join(process.stdout.splitlines()[-1:])))
+        if len(results) < len(filepaths):
+            print("[DOS2DE-Importer] '{}' files weren't converted by the batch, and will be converted one at a time.".format(len(filepaths) - len(results)))
+        return results
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+def take_batch_conversion(load_filepath):
+    """Returns the dae convert_granny_batch made for this file, if it's still there, and forgets it."""
+    dae_temp_path = batch_conversions.pop(os.path.normcase(os.path.abspath(load_filepath)), None)
+    if dae_temp_path is not None and os.path.isfile(dae_temp_path):
+        return dae_temp_path
+    return None
+
+def discard_batch_conversions(delete_files=True):
+    """Forget the batch conversions that weren't imported, deleting their dae files."""
+    for dae_temp_path in batch_conversions.values():
+        if delete_files and os.path.isfile(dae_temp_path):
+            os.remove(dae_temp_path)
+    batch_conversions.clear()
+
+def convert_granny_service(operator, load_filepath, config, conform_skeleton_path=""):
+    """Convert through the shared conversion service. Returns (dae path, reached). The dae is in the service's cache,
+    or None if the conversion failed. reached is False if the service isn't enabled or running,
+    and the file should be converted in this session instead."""
+    if not config.divine_service_enabled:
+        return (None, False)
+
+    response = divine_service.request_conversion(config.divine_service_port, load_filepath, conform_skeleton_path)
+    if response is None:
+        print("[DOS2DE-Importer] Conversion service isn't running. Converting in this session instead.")
+        return (None, False)
+    print(response["log"])
+    if response["status"] != "ok":
+        # The service ran divine on the file, so converting it again here would fail the same way
+        error_message = "[DOS2DE-Importer] [ERROR:{}] Error converting GR2 to DAE. {}".format(response["returncode"], '\n'.join(response["log"].splitlines()[-1:]))
+        operator.report({"ERROR"}, error_message)
+        print(error_message)
+        return (None, True)
+    print("[DOS2DE-Importer] Converted '{}' with the conversion service{}.".format(load_filepath, " (cached)" if response["cached"] else ""))
+    return (response["dae"], True)
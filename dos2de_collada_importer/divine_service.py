@@ -0,0 +1,236 @@
+"""Local GR2 -> DAE conversion service shared by Blender sessions on the same machine.
+
+Run it with Blender's Python (or any Python 3), e.g.:
+    python divine_service.py --divine "C:/Tools/divine.exe" --port 47823 --workers 2 --cache "C:/Temp/dos2de_divine_cache"
+
+Importers send conversion requests over a local connection. Identical requests that arrive while a
+conversion is running wait on the same job, and finished conversions are served from the shared cache.
+This module has no Blender dependencies, so the addon can also import it for the client side.
+
+Connections are authenticated with a random key kept in a file only the current user can read, so the
+service only accepts requests from the user that started it. Messages are JSON, never pickles, and the
+service only ever runs the divine it was started with.
+"""
+
+import os
+import sys
+import json
+import stat
+import time
+import shutil
+import hashlib
+import threading
+import subprocess
+from multiprocessing.connection import Listener, Client
+from concurrent.futures import ThreadPoolExecutor
+
+default_port = 47823
+authkey_name = ".dos2de_divine_service_key"
+# Requests and responses are small. Anything larger isn't from the importer.
+max_message_size = 1048576
+
+def get_authkey_path():
+    return os.path.join(os.path.expanduser("~"), authkey_name)
+
+def get_authkey():
+    """Read the current user's connection key, creating it with a random value on first use."""
+    path = get_authkey_path()
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(os.urandom(32))
+    except FileExistsError:
+        pass
+    if os.name != "nt" and os.stat(path).st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise PermissionError("'{}' can be read by other users. Delete it, and it will be created again.".format(path))
+    with open(path, "rb") as f:
+        return f.read()
+
+def send_message(connection, message):
+    connection.send_bytes(json.dumps(message).encode("utf-8"))
+
+def receive_message(connection):
+    message = json.loads(connection.recv_bytes(max_message_size).decode("utf-8"))
+    if not isinstance(message, dict):
+        raise ValueError("Expected a JSON object")
+    return message
+
+def get_file_hash(filepath, block_size=1048576):
+    sha = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def build_divine_args(divine_path, source, dest, conform_path=""):
+    args = [divine_path, "--loglevel", "all", "-g", "dos2de", "-s", source, "-d", dest, "-i", "gr2", "-o", "dae", "-a", "convert-model"]
+    if conform_path != "" and os.path.isfile(conform_path):
+        args.extend(["-e", "conform", "-e", "conform-copy", "--conform-path", conform_path])
+    return args
+
+class DivineService():
+    def __init__(self, divine_path, cache_dir, workers=2, timeout=0, timeout_per_mb=0.0, cache_limit=0, cache_min_age=600):
+        self.divine_path = divine_path
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.timeout_per_mb = timeout_per_mb
+        self.cache_limit = cache_limit
+        # Outputs used this recently are kept over the limit, since a client may still be importing them
+        self.cache_min_age = cache_min_age
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.jobs = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_job_key(self, request):
+        sha = hashlib.sha1()
+        sha.update(self.divine_path.encode())
+        sha.update(get_file_hash(request["source"]).encode())
+        conform_path = request.get("conform", "")
+        if conform_path != "" and os.path.isfile(conform_path):
+            sha.update(get_file_hash(conform_path).encode())
+        return sha.hexdigest()
+
+    def get_output_path(self, key, source):
+        # Keep the source's name, since the importer names actions and finds textures from it
+        stem = os.path.splitext(os.path.basename(source))[0]
+        return os.path.join(self.cache_dir, key, stem + "-temp.dae")
+
+    def get_timeout(self, source):
+        if self.timeout <= 0:
+            return None
+        return self.timeout + self.timeout_per_mb * os.path.getsize(source) / 1048576.0
+
+    def convert(self, request, dest):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        partial = dest + ".partial.dae"
+        args = build_divine_args(self.divine_path, request["source"], partial, request.get("conform", ""))
+        timeout = self.get_timeout(request["source"])
+        print("[divine_service] Converting '{}'.".format(request["source"]))
+        try:
+            process = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            shutil.rmtree(os.path.dirname(dest), ignore_errors=True)
+            return {"status": "error", "returncode": "TIMEOUT", "log": "Divine didn't finish in {:.0f} seconds, and was stopped.".format(timeout)}
+        if process.returncode != 0 or not os.path.isfile(partial):
+            shutil.rmtree(os.path.dirname(dest), ignore_errors=True)
+            return {"status": "error", "returncode": process.returncode, "log": process.stdout}
+        os.replace(partial, dest)
+        self.evict(os.path.dirname(dest))
+        return {"status": "ok", "dae": dest, "cached": False, "log": process.stdout}
+
+    def evict(self, keep):
+        """Delete the least recently used outputs, other than keep's, until the cache fits in the limit."""
+        if self.cache_limit <= 0:
+            return
+        entries = []
+        total = 0
+        now = time.time()
+        with self.lock:
+            for entry in os.scandir(self.cache_dir):
+                if not entry.is_dir() or entry.name in self.jobs or os.path.samefile(entry.path, keep):
+                    continue
+                size = sum(x.stat().st_size for x in os.scandir(entry.path) if x.is_file())
+                entries.append((entry.stat().st_mtime, size, entry.path))
+                total += size
+        entries.sort()
+        for mtime,size,path in entries:
+            if total <= self.cache_limit:
+                break
+            if now - mtime < self.cache_min_age:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            print("[divine_service] Evicted '{}'.".format(path))
+
+    def submit(self, request):
+        key = self.get_job_key(request)
+        dest = self.get_output_path(key, request["source"])
+        with self.lock:
+            if os.path.isfile(dest):
+                # The directory's modification time tracks the last use, for eviction
+                os.utime(os.path.dirname(dest), None)
+                return {"status": "ok", "dae": dest, "cached": True, "log": ""}
+            job = self.jobs.get(key)
+            if job is None:
+                job = self.executor.submit(self.convert, request, dest)
+                self.jobs[key] = job
+                job.add_done_callback(lambda f: self.finish(key))
+        return job.result()
+
+    def finish(self, key):
+        with self.lock:
+            self.jobs.pop(key, None)
+
+    def handle(self, connection):
+        try:
+            while True:
+                try:
+                    request = receive_message(connection)
+                except (EOFError, OSError, ValueError):
+                    break
+                action = request.get("action")
+                if action == "convert":
+                    try:
+                        if not isinstance(request.get("source"), str) or not os.path.isfile(request["source"]):
+                            raise ValueError("Source '{}' isn't a file".format(request.get("source")))
+                        response = self.submit(request)
+                    except Exception as e:
+                        response = {"status": "error", "returncode": -1, "log": str(e)}
+                elif action == "ping":
+                    response = {"status": "ok"}
+                else:
+                    response = {"status": "error", "returncode": -1, "log": "Unknown action '{}'".format(action)}
+                send_message(connection, response)
+        finally:
+            connection.close()
+
+    def serve(self, port):
+        with Listener(("127.0.0.1", port), authkey=get_authkey()) as listener:
+            print("[divine_service] Listening on port {}. Cache: '{}'.".format(port, self.cache_dir))
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception as e:
+                    print("[divine_service] Rejected connection: {}".format(e))
+                    continue
+                threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+
+def request_conversion(port, source, conform_path=""):
+    """Ask a running service to convert a gr2 file with the divine it was started with.
+    Returns the response, or None if no service is running."""
+    try:
+        connection = Client(("127.0.0.1", port), authkey=get_authkey())
+    except (OSError, EOFError):
+        return None
+    except Exception as e:
+        # AuthenticationError, when the port belongs to another user's service or something else
+        print("[DOS2DE-Importer] Couldn't connect to the conversion service: {}".format(e))
+        return None
+    try:
+        send_message(connection, {"action": "convert", "source": os.path.abspath(source), "conform": conform_path})
+        return receive_message(connection)
+    except (OSError, EOFError, ValueError):
+        return None
+    finally:
+        connection.close()
+
+def main(argv):
+    import argparse
+    import tempfile
+    parser = argparse.ArgumentParser(description="Shared divine conversion service for the Divinity Collada Importer.")
+    parser.add_argument("--divine", required=True, help="The divine executable. Requests can't choose another one")
+    parser.add_argument("--port", type=int, default=default_port)
+    parser.add_argument("--workers", type=int, default=2, help="How many divine processes may run at once")
+    parser.add_argument("--cache", default=os.path.join(tempfile.gettempdir(), "dos2de_divine_cache"), help="Directory for converted files")
+    parser.add_argument("--cache-limit", type=int, default=4096, help="MB of converted files to keep before the least recently used are deleted. 0 disables the limit")
+    parser.add_argument("--timeout", type=int, default=120, help="Seconds a conversion may take before divine is stopped, on top of --timeout-per-mb. 0 disables the timeout")
+    parser.add_argument("--timeout-per-mb", type=float, default=30.0, help="Extra seconds a conversion may take per MB of gr2")
+    args = parser.parse_args(argv)
+    if not os.path.isfile(args.divine):
+        parser.error("Divine wasn't found at '{}'.".format(args.divine))
+    DivineService(os.path.abspath(args.divine), args.cache, args.workers, args.timeout, args.timeout_per_mb,
+        args.cache_limit * 1048576).serve(args.port)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
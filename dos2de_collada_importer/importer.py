@@ -0,0 +1,649 @@
+import bpy
+
+import os
+import time
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+
+from .utils import bytes_to_mb, get_cache_dir, get_file_hash, get_manifest_key, get_stat_key
+from .collada import collada_animation_sections, collada_mesh_sections, get_file_info, strip_collada
+from .materials import create_material, get_texture_search_name
+from .meshes import clean_mesh_weights, dedup_meshes, mesh_dedup_stats, mesh_hash_index
+from .animation import (action_library_skeleton_blocks, action_library_targets, conform_armature, get_resample_interval,
+    import_action_library, load_base_skeleton, resample_action)
+from .renaming import apply_renames, plan_renames
+from .library import can_cache_library, find_library, load_library, write_library
+from .divine import (batch_conversions, batch_quarantined, convert_granny_batch, convert_granny_service, convert_granny_supervised,
+    discard_batch_conversions, get_conform_skeleton_path, get_conversion_timeout, get_quarantine_reason, skip_quarantined,
+    take_batch_conversion)
+
+manifest_data_collections = {
+    "OBJECT": "objects",
+    "MESH": "meshes",
+    "ARMATURE": "armatures",
+    "ACTION": "actions",
+    "MATERIAL": "materials"
+}
+
+# Names the batch's report files, so everything written for one batch sits together
+batch_info = {"id": ""}
+
+def begin_batch():
+    """Reset the caches shared by the files of one import batch. Returns the dedup stats for the batch."""
+    batch_info["id"] = time.strftime("%Y%m%d_%H%M%S")
+    action_library_targets.clear()
+    action_library_skeleton_blocks.clear()
+    mesh_hash_index.clear()
+    mesh_dedup_stats["meshes"] = 0
+    mesh_dedup_stats["bytes"] = 0
+    discard_batch_conversions()
+    del batch_quarantined[:]
+    return mesh_dedup_stats
+
+def end_batch(config):
+    """Clean up after a batch, deleting any batch conversions that weren't imported."""
+    discard_batch_conversions(config.gr2_delete_dae)
+
+def get_batch_report_path(ext):
+    return os.path.join(get_cache_dir("reports"), "batch_{}.{}".format(batch_info["id"], ext))
+
+def write_batch_report(quarantined):
+    """Write the list of files quarantined in the batch, with the reason for each. Returns the report's path."""
+    path = get_batch_report_path("txt")
+    with open(path, "w") as f:
+        f.write("Quarantined files are skipped until they change, or the quarantine is cleared in the addon preferences.\n\n")
+        for filepath,reason in quarantined:
+            f.write("{}\n    {}\n".format(filepath, reason))
+    return path
+
+def report_quarantined(operator):
+    """Write the batch report and warn about it, if any files were quarantined in the batch."""
+    if len(batch_quarantined) > 0:
+        report_path = write_batch_report(batch_quarantined)
+        operator.report({"WARNING"}, "[DOS2DE-Importer] '{}' files were quarantined after failing to convert. Listed them in '{}'.".format(
+            len(batch_quarantined), report_path))
+
+def start_texture_prefetch(filepaths, config):
+    """Start reading the textures the batch's materials will use in the background. Returns the prefetcher, or None."""
+    if not config.use_build_material or not config.texture_prefetch or config.assets_dir == "":
+        return None
+    from .prefetch import DOS2_Texture_Prefetcher
+    prefetcher = DOS2_Texture_Prefetcher(config.assets_dir, config.prefetch_limit)
+    for filepath in filepaths:
+        prefetcher.queue_file(filepath)
+    return prefetcher
+
+def prepare_granny_batch(operator, settings, filepaths, config, sync=False):
+    """Convert the batch's gr2 files up front, with one divine process for each set of conform options.
+
+    import_granny picks the results up. Files the batch couldn't convert are converted one at a time as usual.
+    Returns how many files were converted.
+    """
+    if not config.gr2_batch_convert or config.divine_service_enabled:
+        return 0
+    if config.divine_path == "" or not os.path.isfile(config.divine_path):
+        return 0
+
+    groups = {}
+    for filepath in filepaths:
+        if os.path.splitext(filepath)[1].lower() != ".gr2" or not os.path.isfile(filepath):
+            continue
+        if sync and manifest_is_unchanged(settings, filepath):
+            continue
+        if find_library(filepath, config) is not None:
+            continue
+        conform_skeleton_path = ""
+        if config.gr2_conform_mode == "DIVINE":
+            conform_skeleton_path = get_conform_skeleton_path(filepath, config)
+        if get_quarantine_reason(filepath, config.divine_path, conform_skeleton_path) is not None:
+            continue
+        groups.setdefault(conform_skeleton_path, []).append(filepath)
+
+    converted = 0
+    for conform_skeleton_path,group in groups.items():
+        if len(group) < 2:
+            continue
+        timeout = None
+        if config.divine_timeout > 0:
+            timeout = sum([get_conversion_timeout(filepath, config) for filepath in group])
+        results = convert_granny_batch(operator, group, config.divine_path, conform_skeleton_path, timeout)
+        for source,dae_temp_path in results.items():
+            batch_conversions[get_manifest_key(source)] = dae_temp_path
+        converted += len(results)
+    return converted
+
+def transform_apply(self, context, obj, location=False, rotation=False, scale=False, children=False):
+    last_active = getattr(bpy.context.scene.objects, "active", None)
+    recurse_targets = []
+    try:
+        bpy.ops.object.mode_set(mode="OBJECT")
+        bpy.ops.object.select_all(action='DESELECT')
+        bpy.context.scene.objects.active = obj
+        obj.select = True
+        bpy.ops.object.transform_apply(location=location, rotation=rotation, scale=scale)
+
+        if children:
+            for childobj in obj.children:
+                childobj.select = True
+                if childobj.children is not None:
+                    recurse_targets.append(childobj)
+            bpy.ops.object.mode_set(mode="OBJECT")
+            bpy.ops.object.transform_apply(location=location, rotation=rotation, scale=scale)
+            bpy.ops.object.select_all(action='DESELECT')
+        obj.select = False
+    except:
+        pass
+
+    if last_active is not None:
+        bpy.context.scene.objects.active = last_active
+    if len(recurse_targets) > 0:
+        for recobj in recurse_targets:
+            transform_apply(self, context, recobj, location, rotation, scale, children)
+
+def can_delete(objtype, delete_objects):
+    return (delete_objects == "ALL" or (delete_objects == "ARMATURE" and objtype == "ARMATURE") 
+                or (delete_objects == "MESH" and objtype == "MESH"))
+
+import_stage_timings = {}
+
+class DOS2_Stage_Plan():
+    """The post-import passes import_collada will run for a file, along with why the others were skipped."""
+    def __init__(self):
+        self.stages = []
+        self.skipped = []
+        self.started = 0.0
+
+    def skip(self, stage, reason):
+        self.skipped.append((stage, reason))
+
+    def begin(self, stage):
+        if stage in self.stages:
+            self.started = time.perf_counter()
+            return True
+        return False
+
+    def end(self, stage):
+        elapsed = time.perf_counter() - self.started
+        timing = import_stage_timings.setdefault(stage, [0.0, 0])
+        timing[0] += elapsed
+        timing[1] += 1
+
+    def estimate_saved(self):
+        """Estimate the time saved by skipped stages, from the average time those stages took when they ran."""
+        saved = 0.0
+        for stage,reason in self.skipped:
+            timing = import_stage_timings.get(stage)
+            if timing is not None and timing[1] > 0:
+                saved += timing[0] / timing[1]
+        return saved
+
+    def log(self, filepath):
+        print("[DOS2DE-Importer] Stage plan for '{}': {}".format(os.path.basename(filepath), ", ".join(self.stages) if len(self.stages) > 0 else "None"))
+        if len(self.skipped) > 0:
+            for stage,reason in self.skipped:
+                print("  [DOS2DE-Importer] Skipping {}: {}".format(stage, reason))
+            print("  [DOS2DE-Importer] Estimated time saved: {:.3f}s".format(self.estimate_saved()))
+
+def plan_import_stages(info, config):
+    """Decide which of the config's enabled post-import passes can have an effect, from a pre-scan of the file."""
+    plan = DOS2_Stage_Plan()
+    delete_objects = config.delete_objects
+    rename_armatures = config.rename_armatures
+    rename_meshes = config.rename_meshes
+
+    if info is None or info.kind == "UNKNOWN":
+        # Nothing is known about the file, so every enabled pass might apply
+        has_meshes = True
+        has_armatures = True
+        has_animation = True
+    else:
+        has_meshes = info.vertices > 0 or info.kind == "MESH" or info.kind == "SKINNED_MESH"
+        has_armatures = info.bones > 0
+        has_animation = info.has_animation
+    has_animation = has_animation and config.import_animations
+    keeps_meshes = has_meshes and not can_delete("MESH", delete_objects)
+    keeps_armatures = has_armatures and not can_delete("ARMATURE", delete_objects)
+
+    stages = [
+        ("CONFORM", has_armatures, "no armature in file"),
+        ("ACTIONS", has_animation, "no animation imported from file"),
+        ("TRANSFORM", keeps_meshes or keeps_armatures, "no objects are kept after deleting"),
+        ("DELETE", delete_objects == "ALL" or (delete_objects == "MESH" and has_meshes) or (delete_objects == "ARMATURE" and has_armatures),
+            "no objects of the deleted type in file"),
+        ("WEIGHTS", keeps_meshes and (info is None or info.kind != "MESH"), "no kept skinned meshes"),
+        ("RENAME", (rename_armatures != "DISABLED" and keeps_armatures) or (rename_meshes != "DISABLED" and keeps_meshes),
+            "no kept objects of the renamed types"),
+        ("MATERIALS", keeps_meshes, "no kept meshes"),
+        ("DEDUP", keeps_meshes, "no kept meshes"),
+    ]
+
+    for stage,applies,reason in stages:
+        if stage in config.enabled_stages:
+            if applies:
+                plan.stages.append(stage)
+            else:
+                plan.skip(stage, reason)
+    return plan
+
+def prefilter_collada(load_filepath, config):
+    """Write a copy of the dae without the libraries the settings would throw away after importing.
+
+    Returns (scratch directory, path to import). The scratch directory is None when the file is imported as is.
+    """
+    sections = []
+    strip_meshes = config.dae_prefilter and can_delete("MESH", config.delete_objects)
+    if strip_meshes:
+        sections.extend(collada_mesh_sections)
+    if not config.import_animations:
+        sections.extend(collada_animation_sections)
+    if len(sections) == 0:
+        return (None, load_filepath)
+
+    scratch_dir = tempfile.mkdtemp(prefix="dos2de_")
+    import_filepath = os.path.join(scratch_dir, os.path.basename(load_filepath))
+    try:
+        removed = strip_collada(load_filepath, import_filepath, sections, strip_meshes)
+    except (OSError, ValueError, ET.ParseError) as e:
+        print("[DOS2DE-Importer] Failed to filter '{}', importing it as is: {}".format(load_filepath, e))
+        removed = 0
+    if removed == 0:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        return (None, load_filepath)
+    print("[DOS2DE-Importer] Stripped {:.2f} MB of unused data from '{}' before importing.".format(bytes_to_mb(removed), os.path.basename(load_filepath)))
+    return (scratch_dir, import_filepath)
+
+def import_collada(operator, context, load_filepath, config, rename_temp=False):
+    rename_actions = config.action_autorename
+
+    action_set_fake_user = config.action_set_fake_user
+    action_offset_zero = config.action_offset_zero
+    action_resample_interval = get_resample_interval(context, config)
+    action_clean_enabled = config.action_clean_enabled
+    action_clean_threshold = config.action_clean_threshold
+    action_clean_channels = config.action_clean_channels
+
+    delete_objects_options = config.delete_objects
+    rename_dry_run = config.rename_dry_run
+
+    fix_orientation = config.fix_orientation
+    auto_connect = config.auto_connect
+    find_chains = config.find_chains
+    min_chain_length = config.min_chain_length
+    import_units = config.import_units
+    keep_bind_info = config.keep_bind_info
+
+    #ignored_objects = list(filter(lambda obj: obj.type == "ARMATURE", context.scene.objects.values()))
+    ignored_objects = context.scene.objects.values()
+
+    print("[DOS2DE-Importer] Importing collada file: '{}'".format(load_filepath))
+
+    plan = plan_import_stages(get_file_info(load_filepath), config)
+    plan.log(load_filepath)
+
+    scratch_dir,import_filepath = prefilter_collada(load_filepath, config)
+    try:
+        bpy.ops.wm.collada_import(filepath=import_filepath, fix_orientation=fix_orientation, import_units=import_units, 
+            find_chains=find_chains, auto_connect=auto_connect, min_chain_length=min_chain_length, keep_bind_info=keep_bind_info)
+    finally:
+        if scratch_dir is not None:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    if plan.begin("CONFORM"):
+        skeleton = None
+        if config.fix_orientation or config.import_units:
+            # The base skeleton's rest matrices are the dae's own, and only match bones built from them unchanged
+            operator.report({"WARNING"}, "[DOS2DE-Importer] Skipped conforming '{}' in Blender, since Fix Leaf Bones or Import Units change the bones' rest matrices.".format(
+                os.path.basename(load_filepath)))
+        else:
+            skeleton_path = get_conform_skeleton_path(load_filepath, config)
+            skeleton = load_base_skeleton(skeleton_path, config.divine_path, get_conversion_timeout(skeleton_path, config))
+        if skeleton is not None:
+            new_armatures = list(filter(lambda obj: obj.type == "ARMATURE" and not obj in ignored_objects, context.scene.objects.values()))
+            for obj in new_armatures:
+                changed = conform_armature(context, obj, skeleton)
+                print("[DOS2DE-Importer] Conformed '{}' bones of '{}' to '{}'.".format(changed, obj.name, skeleton_path))
+        plan.end("CONFORM")
+
+    if plan.begin("ACTIONS"):
+        new_armatures = list(filter(lambda obj: obj.type == "ARMATURE" and obj.animation_data != None and not obj in ignored_objects, context.scene.objects.values()))
+        if len(new_armatures) > 0:
+            print("[DOS2DE-Importer] New Armature Objects: ({}). Parsing actions".format(len(new_armatures)))
+            for ob in new_armatures:
+                action = (ob.animation_data.action
+                    if ob.animation_data is not None and
+                    ob.animation_data.action is not None
+                    else None)
+
+                if action is not None:
+                    action_name = action.name
+
+                    if rename_actions:
+                        new_name = bpy.path.display_name_from_filepath(load_filepath)
+                        if rename_temp:
+                            new_name = str.replace(new_name, "-temp", "")
+                        operator.report({'INFO'}, "[DOS2DE-Importer] Renamed action '{}' to '{}'.".format(action_name, new_name))
+                        ob.animation_data.action.name = new_name
+                        action_name = new_name
+
+                    if action_set_fake_user:
+                        action.use_fake_user = True
+                        print("[DOS2DE-Importer] Enabled fake user for action '{}'.".format(action_name))
+
+                    if action_offset_zero:
+                        fcurves = ob.animation_data.action.fcurves
+                        for fc in fcurves:
+                            for keyframe in fc.keyframe_points:
+                                keyframe.co.x += 1
+
+                    if action_resample_interval is not None:
+                        keys_before,keys_after = resample_action(action, action_resample_interval)
+                        operator.report({'INFO'}, "[DOS2DE-Importer] Resampled action '{}' from '{}' to '{}' keys.".format(action_name, keys_before, keys_after))
+
+                    # if action_clean_enabled:
+                    #     print("[DOS2DE-Importer] Cleaning action. Threshold '{}' Channels '{}'.".format(action_clean_threshold, action_clean_channels))
+                    #     bpy.ops.object.select_all(action='DESELECT')
+                    #     last = bpy.context.scene.objects.active
+                    #     bpy.context.scene.objects.active = ob
+                    #     ob.select = True
+                    #     bpy.ops.object.mode_set(mode="POSE")
+                    #     bpy.ops.action.clean(threshold=action_clean_threshold, channels=action_clean_channels)
+                    #     #bpy.ops.action.clean(0.001, True)
+                    #     bpy.ops.object.mode_set(mode="OBJECT")
+                    #     ob.select = False
+                    #     bpy.context.scene.objects.active = last
+
+        else:
+            #operator.report({'INFO'}, "[DOS2DE-Importer] No new actions to rename.")
+            pass
+        plan.end("ACTIONS")
+
+    if plan.begin("TRANSFORM"):
+        new_armatures = list(filter(lambda obj: not obj in ignored_objects, context.scene.objects.values()))
+        for obj in new_armatures:
+            print("[DOS2DE-Importer] Applying transformation for object '{}:{}' and children.".format(obj.name, obj.type))
+            transform_apply(operator, context, obj, location=True, rotation=True, scale=True, children=True)
+        plan.end("TRANSFORM")
+
+    if plan.begin("DELETE"):
+        delete_objects = list(filter(lambda obj: not obj in ignored_objects and can_delete(obj.type, delete_objects_options), context.scene.objects.values()))
+        print("[DOS2DE-Importer] Deleting '{}' new objects after import.".format(len(delete_objects)))
+        for obj in delete_objects:
+            index = bpy.data.objects.find(obj.name)
+            if index > -1:
+                obj_data = bpy.data.objects[index]
+                print("[DOS2DE-Importer] Deleting object '{}:{}'.".format(obj.name, obj.type))
+                bpy.data.objects.remove(obj_data)
+        plan.end("DELETE")
+
+    if plan.begin("WEIGHTS"):
+        new_meshes = list(filter(lambda obj: not obj in ignored_objects and obj.type == "MESH" and len(obj.vertex_groups) > 0, context.scene.objects.values()))
+        totals = {"limited": 0, "pruned": 0, "normalized": 0, "groups_removed": 0}
+        for obj in new_meshes:
+            stats = clean_mesh_weights(obj, config.weights_max_influences, config.weights_prune_threshold)
+            for key,value in stats.items():
+                totals[key] += value
+        operator.report({'INFO'}, "[DOS2DE-Importer] Cleaned weights on '{}' meshes. Limited '{}' and pruned '{}' influences, normalized '{}' vertices, removed '{}' empty groups.".format(
+            len(new_meshes), totals["limited"], totals["pruned"], totals["normalized"], totals["groups_removed"]))
+        plan.end("WEIGHTS")
+
+    if plan.begin("RENAME"):
+        new_objects = list(filter(lambda obj: not obj in ignored_objects, context.scene.objects.values()))
+        planned = plan_renames(new_objects, load_filepath, config)
+        for obj,next_name in planned:
+            if rename_dry_run:
+                print("[DOS2DE-Importer] (Dry Run) Would rename object '{} => {}'.".format(obj.name, next_name))
+            else:
+                print("[DOS2DE-Importer] Renaming object '{} => {}'.".format(obj.name, next_name))
+        if rename_dry_run:
+            operator.report({'INFO'}, "[DOS2DE-Importer] Rename dry run: '{}' objects would be renamed. See the console for the list.".format(len(planned)))
+        else:
+            apply_renames(planned)
+        plan.end("RENAME")
+
+    if plan.begin("MATERIALS"):
+        assets_dir = config.assets_dir
+        if assets_dir != "":
+            check_findname = get_texture_search_name(load_filepath)
+            new_meshes = list(filter(lambda obj: not obj in ignored_objects and obj.type == "MESH", context.scene.objects.values()))
+            for mesh in new_meshes:
+                mat_name="{}_DOS2DE_PBR".format(mesh.name)
+                mat = bpy.data.materials.get(mat_name)
+                if mat is None:
+                    if create_material(mat_name, mesh, check_findname, context, assets_dir,
+                            config.use_converted_normalmaps, config.texture_proxy_level):
+                        print("[DOS2DE-Importer] Created material for '{}'".format(mesh.name))
+                else:
+                    mesh.data.materials.append(mat)
+        plan.end("MATERIALS")
+
+    if plan.begin("DEDUP"):
+        new_meshes = list(filter(lambda obj: not obj in ignored_objects and obj.type == "MESH", context.scene.objects.values()))
+        freed,saved = dedup_meshes(operator, context, new_meshes)
+        if freed > 0:
+            mesh_dedup_stats["meshes"] += freed
+            mesh_dedup_stats["bytes"] += saved
+            operator.report({'INFO'}, "[DOS2DE-Importer] Shared '{}' duplicate meshes, saving about {:.2f} MB.".format(freed, bytes_to_mb(saved)))
+        plan.end("DEDUP")
+    return True
+
+def import_granny(operator, context, load_filepath, config):
+    conform_skeleton_path = ""
+    if config.gr2_conform_mode == "DIVINE":
+        conform_skeleton_path = get_conform_skeleton_path(load_filepath, config)
+    delete_dae = config.gr2_delete_dae
+
+    if skip_quarantined(operator, load_filepath, config.divine_path, conform_skeleton_path):
+        return False
+
+    dae_temp_path = take_batch_conversion(load_filepath)
+    if dae_temp_path is None:
+        dae_temp_path,reached = convert_granny_service(operator, load_filepath, config, conform_skeleton_path)
+        if reached:
+            # The service's cache owns the converted file
+            delete_dae = False
+        else:
+            dae_temp_path = convert_granny_supervised(operator, load_filepath, config, conform_skeleton_path)
+    if dae_temp_path is not None:
+        #Deleta .dae
+        print("[DOS2DE-Importer] Importing temp dae file: '{}'.".format(dae_temp_path))
+        if config.action_library_mode != "DISABLED":
+            result = import_action_library(operator, context, dae_temp_path, config, rename_temp=True)
+        else:
+            result = import_collada(operator, context, dae_temp_path, config, rename_temp=True)
+        if result:
+            if delete_dae:
+                print("[DOS2DE-Importer] Deleting temp file: '{}'.".format(dae_temp_path))
+                if os.path.isfile(dae_temp_path):
+                    os.remove(dae_temp_path)
+            return True
+        else:
+            print("Failed?")
+    return False
+
+def import_start(operator, context, load_filepath, config):
+    name = os.path.split(load_filepath)[-1].split(".")[0]
+    parts = os.path.splitext(load_filepath)
+    ext = parts[1].lower()
+
+    print("[DOS2DE-Importer] Importing file: '{}'.".format(load_filepath))
+
+    # Ignore current armatures when renaming actions
+    ignored_objects = list(filter(lambda obj: obj.type == "ARMATURE", context.scene.objects.values()))
+    #print("[DOS2DE-Importer] Ignored Objects {}".format(len(ignored_objects)))
+    if ext == ".dae":
+        if config.action_library_mode != "DISABLED":
+            return import_action_library(operator, context, load_filepath, config)
+        return import_collada(operator, context, load_filepath, config)
+    elif ext == ".gr2":
+        if config.divine_path != "" and os.path.isfile(config.divine_path):
+            return import_granny(operator, context, load_filepath, config)
+        else:
+            operator.report({"ERROR"}, "[DOS2DE-Importer] Failed to find divine.exe at path: '{}'. Canceling GR2 import.".format(config.divine_path))
+            return False
+    else:
+        raise RuntimeError("[DOS2DE-Importer] Unknown extension: %s" % ext)
+        return False
+    return True
+
+def snapshot_datablocks():
+    snapshot = {}
+    for data_type,attr in manifest_data_collections.items():
+        snapshot[data_type] = set(block.as_pointer() for block in getattr(bpy.data, attr))
+    return snapshot
+
+def get_new_datablocks(snapshot):
+    created = {}
+    for data_type,attr in manifest_data_collections.items():
+        existing = snapshot[data_type]
+        created[data_type] = [block for block in getattr(bpy.data, attr) if not block.as_pointer() in existing]
+    return created
+
+manifest_sync_suffix = "__dos2de_sync"
+# Blender truncates longer datablock names
+manifest_max_name_length = 63
+
+def manifest_free_names(entry):
+    """Move the entry's datablocks out of the way, so a re-import creates blocks with the same names."""
+    previous = []
+    for index,item in enumerate(entry.items):
+        collection = getattr(bpy.data, manifest_data_collections[item.data_type])
+        block = collection.get(item.name)
+        # Linked datablocks are read-only, and can't be renamed or replaced
+        if block is not None and block.library is None:
+            temp_name = item.name + manifest_sync_suffix
+            if len(temp_name) > manifest_max_name_length:
+                temp_name = "{}_{}".format(manifest_sync_suffix, index)
+            block.name = temp_name
+            previous.append((item.data_type, item.name, block))
+    return previous
+
+def manifest_replace_datablocks(previous, created):
+    """Swap re-imported data into the previously imported datablocks.
+
+    Objects from the previous import are kept (along with any user changes to them) and receive the new data,
+    while meshes, armatures, actions and materials are replaced by their new versions everywhere they're used.
+    Returns the datablocks that now represent the file.
+    """
+    new_blocks = {}
+    for data_type,blocks in created.items():
+        for block in blocks:
+            new_blocks[(data_type, block.name)] = block
+
+    kept = []
+    replaced_objects = []
+    replaced_data = []
+    for data_type,name,old in previous:
+        new = new_blocks.pop((data_type, name), None)
+        if new is None:
+            old.name = name
+            kept.append((data_type, old))
+        elif data_type == "OBJECT":
+            replaced_objects.append((old, new))
+        else:
+            replaced_data.append((data_type, name, old, new))
+
+    for old,new in replaced_objects:
+        if old.type == new.type and old.data != new.data:
+            old.vertex_groups.clear()
+            for group in new.vertex_groups:
+                old.vertex_groups.new(name=group.name)
+            old.data = new.data
+        if new.animation_data is not None and new.animation_data.action is not None:
+            if old.animation_data is None:
+                old.animation_data_create()
+            old.animation_data.action = new.animation_data.action
+        for obj in bpy.data.objects:
+            if obj.parent == new:
+                obj.parent = old
+            for mod in obj.modifiers:
+                if getattr(mod, "object", None) == new:
+                    mod.object = old
+        name = new.name
+        bpy.data.objects.remove(new, do_unlink=True)
+        old.name = name
+        kept.append(("OBJECT", old))
+
+    for data_type,name,old,new in replaced_data:
+        if data_type == "ACTION":
+            new.use_fake_user = new.use_fake_user or old.use_fake_user
+        old.user_remap(new)
+        getattr(bpy.data, manifest_data_collections[data_type]).remove(old, do_unlink=True)
+        new.name = name
+        kept.append((data_type, new))
+
+    for key,block in new_blocks.items():
+        kept.append((key[0], block))
+
+    print("[DOS2DE-Importer] Synced '{}' objects and '{}' datablocks in place.".format(len(replaced_objects), len(replaced_data)))
+    return kept
+
+def manifest_is_unchanged(settings, load_filepath):
+    """Whether sync mode would skip the file, going by its size and modification time alone."""
+    entry = settings.manifest_entries.get(get_manifest_key(load_filepath))
+    return entry is not None and entry.stat_key == get_stat_key(load_filepath)
+
+def manifest_import(operator, context, settings, load_filepath, config, sync=False):
+    """Import a file and record what it created in the scene's manifest.
+
+    When syncing, unchanged files are skipped and files imported before are updated in place.
+    Returns "SKIPPED", "UPDATED", "IMPORTED" or "FAILED".
+    """
+    key = get_manifest_key(load_filepath)
+    entry = settings.manifest_entries.get(key)
+    stat_key = get_stat_key(load_filepath)
+    # Only syncs compare contents, so other imports record the stat key alone and skip hashing the file
+    content_hash = ""
+
+    if sync and entry is not None:
+        if entry.stat_key == stat_key:
+            print("[DOS2DE-Importer] Skipping unchanged file '{}'.".format(load_filepath))
+            return "SKIPPED"
+        content_hash = get_file_hash(load_filepath)
+        if entry.content_hash == content_hash:
+            entry.stat_key = stat_key
+            print("[DOS2DE-Importer] Skipping unchanged file '{}'.".format(load_filepath))
+            return "SKIPPED"
+
+    if sync and content_hash == "":
+        content_hash = get_file_hash(load_filepath)
+
+    previous = []
+    if sync and entry is not None:
+        previous = manifest_free_names(entry)
+
+    snapshot = snapshot_datablocks()
+    library_path = find_library(load_filepath, config)
+    if library_path is not None:
+        # Linked datablocks can't take the place of the previous ones, so syncs always append
+        link = config.library_cache_mode == "LINK" and len(previous) == 0
+        result = load_library(operator, context, load_filepath, library_path, link=link)
+    else:
+        result = import_start(operator, context, load_filepath, config)
+    created = get_new_datablocks(snapshot)
+    for data_type,blocks in created.items():
+        created[data_type] = [block for block in blocks if not block.as_pointer() in action_library_skeleton_blocks]
+    if library_path is None and result != False and can_cache_library(config):
+        write_library(load_filepath, config, created)
+
+    if len(previous) > 0:
+        blocks = manifest_replace_datablocks(previous, created)
+    else:
+        blocks = [(data_type, block) for data_type,data_blocks in created.items() for block in data_blocks]
+
+    if result == False:
+        return "FAILED"
+
+    status = "UPDATED" if entry is not None else "IMPORTED"
+    if entry is None:
+        entry = settings.manifest_entries.add()
+        entry.name = key
+    entry.filepath = load_filepath
+    entry.content_hash = content_hash
+    entry.stat_key = stat_key
+    entry.items.clear()
+    for data_type,block in blocks:
+        item = entry.items.add()
+        item.name = block.name
+        item.data_type = data_type
+    return status
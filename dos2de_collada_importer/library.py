@@ -0,0 +1,101 @@
+import bpy
+
+import os
+import json
+import hashlib
+
+from .utils import evict_cache, get_cache_dir, get_cached_file_hash, get_manifest_key, touch_cache_file
+from .config import import_setting_names
+from .divine import get_conform_skeleton_path
+
+# Bump when the importer changes what it builds, so libraries written by older versions are rebuilt
+library_cache_version = 1
+
+# Settings that change how a batch runs, but not what importing a file builds
+library_ignored_settings = ("filter_search", "texture_prefetch", "gr2_batch_convert", "gr2_delete_dae", "library_cache_mode")
+
+def can_cache_library(config):
+    # Action libraries add actions to an armature already in the scene, rather than importing an asset
+    return config.library_cache_mode != "DISABLED" and config.action_library_mode == "DISABLED"
+
+def get_library_paths(load_filepath):
+    """Returns the (blend, info) paths of a source file's cached library. Each source file has one library."""
+    cache_dir = get_cache_dir("library")
+    stem = "{}_{}".format(os.path.splitext(os.path.basename(load_filepath))[0],
+        hashlib.sha1(get_manifest_key(load_filepath).encode("utf-8")).hexdigest()[:12])
+    return (os.path.join(cache_dir, stem + ".blend"), os.path.join(cache_dir, stem + ".json"))
+
+def get_library_settings_key(load_filepath, config):
+    """A hash of every setting that affects what importing the file builds."""
+    values = [library_cache_version]
+    values.extend((name, getattr(config, name)) for name in import_setting_names if not name in library_ignored_settings)
+    conform_skeleton_path = ""
+    if config.gr2_conform_enabled and os.path.splitext(load_filepath)[1].lower() == ".gr2":
+        conform_skeleton_path = get_conform_skeleton_path(load_filepath, config)
+    values.append(("conform_skeleton_path", conform_skeleton_path))
+    values.append(("rename_user_patterns", config.rename_user_patterns))
+    values.append(("assets_dir", config.assets_dir))
+    return hashlib.sha1(repr(values).encode("utf-8")).hexdigest()
+
+def find_library(load_filepath, config):
+    """Returns the path to the file's cached library, or None if there isn't one built from the file's current
+    contents with the same settings."""
+    if not can_cache_library(config):
+        return None
+    blend_path,info_path = get_library_paths(load_filepath)
+    if not os.path.isfile(blend_path) or not os.path.isfile(info_path):
+        return None
+    try:
+        with open(info_path, "r") as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if info.get("hash") != get_cached_file_hash(load_filepath):
+        return None
+    if info.get("settings") != get_library_settings_key(load_filepath, config):
+        print("[DOS2DE-Importer] Import settings changed since '{}' was cached. Its library will be rebuilt.".format(load_filepath))
+        return None
+    return blend_path
+
+def load_library(operator, context, load_filepath, blend_path, link=False):
+    """Link or append the objects and actions of a cached library into the scene, instead of importing the file."""
+    with bpy.data.libraries.load(blend_path, link=link) as (data_from, data_to):
+        data_to.objects = data_from.objects
+        data_to.actions = data_from.actions
+    objects = [obj for obj in data_to.objects if obj is not None]
+    for obj in objects:
+        context.scene.objects.link(obj)
+    touch_cache_file(blend_path)
+    operator.report({'INFO'}, "[DOS2DE-Importer] {} '{}' objects for '{}' from the library cache.".format(
+        "Linked" if link else "Appended", len(objects), os.path.basename(load_filepath)))
+    return True
+
+def write_library(load_filepath, config, created):
+    """Write the objects and actions an import created, along with the data they use, to the file's library.
+    Returns the library's path, or None if the import created nothing to cache."""
+    blocks = set(created.get("OBJECT", [])) | set(created.get("ACTION", []))
+    if len(blocks) == 0:
+        return None
+    blend_path,info_path = get_library_paths(load_filepath)
+    # Remove the info first, so a library that fails to write is never picked up
+    if os.path.isfile(info_path):
+        os.remove(info_path)
+    bpy.data.libraries.write(blend_path, blocks)
+    with open(info_path, "w") as f:
+        json.dump({
+            "source": load_filepath,
+            "hash": get_cached_file_hash(load_filepath),
+            "settings": get_library_settings_key(load_filepath, config)
+        }, f)
+    print("[DOS2DE-Importer] Cached '{}' datablocks from '{}' in '{}'.".format(len(blocks), os.path.basename(load_filepath), blend_path))
+    if config.library_cache_limit > 0:
+        for path in evict_cache(os.path.dirname(blend_path), config.library_cache_limit, ".blend", remove_library):
+            print("[DOS2DE-Importer] Evicted cached library '{}'.".format(path))
+    return blend_path
+
+def remove_library(blend_path):
+    # Remove the info first, so a library that fails to delete is never picked up
+    info_path = os.path.splitext(blend_path)[0] + ".json"
+    if os.path.isfile(info_path):
+        os.remove(info_path)
+    os.remove(blend_path)
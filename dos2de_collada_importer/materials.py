@@ -0,0 +1,470 @@
+import bpy
+
+import os
+import re
+
+import numpy as np
+
+from .utils import evict_cache, get_cache_dir, get_cached_file_hash, touch_cache_file
+from .renaming import rename_race_patterns
+
+hero_pattern = re.compile(r'.*(Dwarves|Elves|Humans|Lizards)_(Male|Female)')
+
+texture_pattern_basecolor = "{}.*?_(BM|BMA).dds"
+texture_pattern_mskcloth = "{}.*?_(MSKcloth).dds"
+texture_pattern_mskskin = "{}.*?_(MSKskin).dds"
+texture_pattern_normalmap = "{}.*?_(NM).dds"
+texture_pattern_physical = "{}.*?_(PM).dds"
+
+class DOS2_Material_Textures():
+    def __init__(self, bm=None, nm=None, pm=None):
+        self.basecolor = bm
+        self.normalmap = nm
+        self.physicalmap = pm
+        self.textures = [bm,nm,pm]
+
+def get_texture_search_name(load_filepath):
+    """The name create_material looks textures up by, for a source gr2 or the dae imported from it."""
+    name = os.path.basename(load_filepath)
+    if os.path.splitext(name)[1].lower() == ".gr2":
+        return os.path.splitext(name)[0]
+    return name.replace("-temp.dae", "")
+
+texture_dir_listings = {}
+
+def get_texture_dir_files(textures_dir):
+    """The dds files in a texture directory, memoized until the directory changes."""
+    mtime = os.stat(textures_dir).st_mtime_ns
+    cached = texture_dir_listings.get(textures_dir)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, [f for f in os.listdir(textures_dir) if f.endswith(".dds")])
+        texture_dir_listings[textures_dir] = cached
+    return cached[1]
+
+def get_textures(obj, filename, context, assets_dir):
+    textures = None
+    m = hero_pattern.match(filename)
+    if m != None:
+        race = m.group(1)
+        gender = m.group(2)
+        racegender = "{}_{}".format(race, gender)
+        textures_dir = os.path.join(assets_dir, "Textures/Characters/{}/{}".format(race, racegender))
+        if os.path.isdir(textures_dir):
+            bm_pattern = re.compile(texture_pattern_basecolor.format(filename))
+            nm_pattern = re.compile(texture_pattern_normalmap.format(filename))
+            pm_pattern = re.compile(texture_pattern_physical.format(filename))
+            files = get_texture_dir_files(textures_dir)
+            basemap_texture = next(iter([f for f in files if bm_pattern.match(f)]), None)
+            normalmap_texture = next(iter([f for f in files if nm_pattern.match(f)]), None)
+            physicalmap_texture = next(iter([f for f in files if pm_pattern.match(f)]), None)
+            if basemap_texture != None:
+                basemap_texture = os.path.join(textures_dir, basemap_texture)
+            if normalmap_texture != None:
+                normalmap_texture = os.path.join(textures_dir, normalmap_texture)
+            if physicalmap_texture != None:
+                physicalmap_texture = os.path.join(textures_dir, physicalmap_texture)
+            textures = DOS2_Material_Textures(
+                bm=basemap_texture, 
+                nm=normalmap_texture, 
+                pm=physicalmap_texture
+            )
+    else:
+        textures = DOS2_Material_Textures()
+    return textures
+
+def float_lerp(a, b, t):
+    return (1.0 - t) * a + t * b
+
+def sum_heights(nodes_array):
+    result = 0
+    for node in nodes_array:
+        result = result + node.height
+    return result
+
+def sum_widths(depth_nodes):
+    result = 0
+    for depth in depth_nodes:
+        max_width = 0
+        for node in depth_nodes[depth]:
+            if max_width < node.width:
+                max_width = node.width
+        result = result + max_width
+    return result
+
+def calc_priority_by_socket(node):
+    if len(node.inputs) is 0:
+        return -9999
+    if len(node.outputs) is 0:
+        return 9999
+
+    result = 0
+    for in_socket in node.inputs:
+        if in_socket.is_linked:
+            for link in in_socket.links:
+                if link.is_valid:
+                    if len(link.from_node.inputs) is 0:
+                        result -= 1
+                    else:
+                        result += 2
+
+    for out_socket in node.outputs:
+        if out_socket.is_linked:
+            for link in out_socket.links:
+                if link.is_valid:
+                    if len(link.to_node.outputs) is 0:
+                        result += 10
+                    else:
+                        result -= 1
+
+    return result
+
+def arrange_nodes(node_array, calc_priority, horiz_padding=0.125, vert_padding=0.125):
+
+    # Create a dictionary where the key is the
+    # depth and the value is an array of nodes.
+    depth_nodes = {}
+    for node in node_array:
+
+        depth = calc_priority(node)
+        if depth in depth_nodes:
+
+            # Add the node to the node array at that depth.
+            depth_nodes[depth].append(node)
+        else:
+
+            # Begin a new array.
+            depth_nodes[depth] = [node]
+
+    # Add padding to half the width.
+    extents_w = (0.5 + horiz_padding) * sum_widths(depth_nodes)
+    t_w_max = 0.5
+    sz0 = len(depth_nodes)
+    if sz0 > 1:
+        t_w_max = 1.0 / (sz0 - 1)
+
+    # List of dictionary KVPs.
+    depths = sorted(depth_nodes.items())
+    depths_range = range(0, sz0, 1)
+    for i in depths_range:
+        nodes_array = depths[i][1]
+        t_w = i * t_w_max
+        x = float_lerp(-extents_w, extents_w, t_w)
+
+        extents_h = (0.5 + vert_padding) * sum_heights(nodes_array)
+        t_h_max = 0.5
+        sz1 = len(nodes_array)
+        if sz1 > 1:
+            t_h_max = 1.0 / (sz1 - 1)
+
+        nodes_range = range(0, sz1, 1)
+        for j in nodes_range:
+            node = nodes_array[j]
+            t_h = j * t_h_max
+            y = float_lerp(-extents_h, extents_h, t_h)
+            half_w = 0.5 * node.width
+            half_h = 0.5 * node.height
+            node.location.xy = (x - half_w, y - half_h)
+
+def get_image(file, context):
+    if file != "" and file != None:
+        for img in bpy.data.images:
+            if img.filepath != "" and img.filepath != None:
+                if img.filepath == file:
+                    return img
+                elif bpy.path.basename(img.filepath) == bpy.path.basename(file):
+                    img.filepath = file
+                    return img
+        print("Loading image: " + file)
+        img = bpy.data.images.load(file, check_existing=True)
+        return img
+    return None
+
+def get_converted_normalmap(file, context):
+    """Returns the path to the DOS2 normal map converted to a standard OpenGL tangent-space image.
+    Conversions are cached on disk by the hash of the source texture."""
+    if file is None or file == "" or not os.path.isfile(file):
+        return None
+    stem = os.path.splitext(os.path.basename(file))[0]
+    cache_file = os.path.join(get_cache_dir("normalmaps"), "{}_{}.png".format(stem, get_cached_file_hash(file)))
+    if not os.path.isfile(cache_file):
+        print("Converting normal map: " + file)
+        source = bpy.data.images.load(file, check_existing=True)
+        width,height = source.size
+        if width == 0 or height == 0:
+            return None
+        pixels = np.array(source.pixels[:], dtype=np.float32).reshape(-1, 4)
+        converted = np.empty_like(pixels)
+        converted[:,0] = pixels[:,3] # Alpha to Red Channel
+        converted[:,1] = 1.0 - pixels[:,1] # Invert Green for OpenGL
+        converted[:,2] = pixels[:,2] # Blue to Blue Channel
+        converted[:,3] = 1.0
+        image = bpy.data.images.new(os.path.basename(cache_file), width, height, alpha=False)
+        image.pixels = converted.ravel().tolist()
+        image.filepath_raw = cache_file
+        image.file_format = "PNG"
+        image.save()
+        bpy.data.images.remove(image)
+        if source.users == 0:
+            bpy.data.images.remove(source)
+    return cache_file
+
+texture_proxy_divisors = {
+    "FULL": 1,
+    "HALF": 2,
+    "QUARTER": 4,
+    "EIGHTH": 8
+}
+
+def get_texture_proxy(file, context, level):
+    """Returns the path to a reduced resolution copy of a texture, creating it in the proxy cache on first use."""
+    divisor = texture_proxy_divisors[level]
+    stem = os.path.splitext(os.path.basename(file))[0]
+    cache_dir = get_cache_dir("proxies")
+    cache_file = os.path.join(cache_dir, "{}_{}_{}.png".format(stem, get_cached_file_hash(file), divisor))
+    if os.path.isfile(cache_file):
+        touch_cache_file(cache_file)
+        return cache_file
+
+    print("Creating texture proxy: " + cache_file)
+    source = bpy.data.images.load(file, check_existing=True)
+    width,height = source.size
+    if width == 0 or height == 0:
+        if source.users == 0:
+            bpy.data.images.remove(source)
+        return None
+    image = source.copy()
+    image.scale(max(1, width // divisor), max(1, height // divisor))
+    image.filepath_raw = cache_file
+    image.file_format = "PNG"
+    image.save()
+    bpy.data.images.remove(image)
+    if source.users == 0:
+        bpy.data.images.remove(source)
+
+    limit = 0
+    if "dos2de_collada_importer" in context.user_preferences.addons:
+        preferences = context.user_preferences.addons["dos2de_collada_importer"].preferences
+        if preferences is not None:
+            limit = preferences.proxy_cache_limit * 1048576
+    if limit > 0:
+        for path in evict_cache(cache_dir, limit):
+            print("[DOS2DE-Importer] Evicted texture proxy '{}'.".format(path))
+    return cache_file
+
+def get_texture_image(file, context, proxy_level="FULL"):
+    """get_image, optionally through the proxy cache. The image remembers its full resolution source for swapping back."""
+    if file == "" or file == None:
+        return None
+    source = file
+    if proxy_level != "FULL" and os.path.isfile(file):
+        proxy = get_texture_proxy(file, context, proxy_level)
+        if proxy is not None:
+            file = proxy
+    img = get_image(file, context)
+    if img is not None:
+        img["dos2de_source"] = source
+        img["dos2de_proxy"] = proxy_level
+    return img
+
+def get_node_type(nodes, name):
+    for x in nodes:
+        if name in x.bl_idname:
+            return x
+    return None
+
+def offset_node_x(node, bynode, padding=50):
+    node.location[0] = (bynode.location[0] + bynode.width) + padding
+    node.location[1] = bynode.location[1]
+
+def offset_node_y(node, bynode, padding=200):
+    node.location[1] = (bynode.location[1] - bynode.height) - padding
+    node.location[0] = bynode.location[0]
+
+def create_dos2de_nodes(mat, context, textures=None, convert_normalmap=False, proxy_level="FULL"):
+    nodes = mat.node_tree.nodes
+    links = mat.node_tree.links
+
+    diffuse = get_node_type(nodes, "ShaderNodeBsdfDiffuse")
+    if diffuse is not None:
+        #diffuse = nodes.new("ShaderNodeBsdfDiffuse")
+        nodes.remove(diffuse)
+    shader = nodes.new("ShaderNodeBsdfPrincipled")
+    #diffuse.location = (50,0)
+
+    bm_input = 0
+    nm_input = 17
+    metal_input = 4
+    roughness_input = 7
+
+    index = 0
+    for inputnode in shader.inputs:
+        if inputnode.name == "Normal":
+            nm_input = index
+        elif inputnode.name == "Roughness":
+            roughness_input = index
+        elif inputnode.name == "Metalness":
+            metal_input = index
+        elif inputnode.name == "Base Color":
+            bm_input = index
+        index = index + 1
+
+    bm_node = nodes.new("ShaderNodeTexImage")
+    bm_node.location = (10,0)
+    bm_node.label = "BaseColor"
+    if textures != None:
+        bm_tex = get_texture_image(textures.basecolor, context, proxy_level)
+        bm_node.image = bm_tex
+    links.new(bm_node.outputs[0], shader.inputs[bm_input])
+
+    pm_node = nodes.new("ShaderNodeTexImage")
+    offset_node_y(pm_node, bm_node)
+    pm_node.label = "PhysicalMap"
+    if textures != None:
+        pm_tex = get_texture_image(textures.physicalmap, context, proxy_level)
+        pm_node.image = pm_tex
+    pm_node.color_space = "NONE"
+    pmsep_node = nodes.new("ShaderNodeSeparateXYZ")
+    offset_node_x(pmsep_node, pm_node)
+    links.new(pm_node.outputs[0], pmsep_node.inputs[0])
+    links.new(pmsep_node.outputs[0], shader.inputs[metal_input])
+    links.new(pmsep_node.outputs[1], shader.inputs[roughness_input])
+
+    nm_node = nodes.new("ShaderNodeTexImage")
+    offset_node_y(nm_node, pm_node)
+    nm_node.label = "NormalMap"
+    nm_converted = False
+    if textures != None:
+        nm_tex = None
+        if convert_normalmap:
+            nm_file = get_converted_normalmap(textures.normalmap, context)
+            if nm_file is not None:
+                nm_tex = get_texture_image(nm_file, context, proxy_level)
+                nm_converted = nm_tex is not None
+        if nm_tex is None:
+            nm_tex = get_texture_image(textures.normalmap, context, proxy_level)
+        nm_node.image = nm_tex
+    nm_node.color_space = "NONE"
+
+    if nm_converted:
+        # The image is already an OpenGL normal map, so it can go straight into the Normal Map node
+        vector_node = nodes.new("ShaderNodeNormalMap")
+        offset_node_x(vector_node, nm_node)
+        links.new(nm_node.outputs[0], vector_node.inputs["Color"])
+    else:
+        sep_node = nodes.new("ShaderNodeSeparateXYZ")
+        offset_node_x(sep_node, nm_node)
+        invert_node = nodes.new("ShaderNodeInvert")
+        offset_node_x(invert_node, sep_node)
+        combine_node = nodes.new("ShaderNodeCombineXYZ")
+        offset_node_x(combine_node, invert_node)
+        vector_node = nodes.new("ShaderNodeNormalMap")
+        offset_node_x(vector_node, combine_node)
+        links.new(nm_node.outputs[0], sep_node.inputs[0])
+        links.new(nm_node.outputs[1], combine_node.inputs[0]) # Alpha to Red Channel
+        links.new(sep_node.outputs[1], invert_node.inputs[1]) # Invert Green for OpenGL
+        links.new(sep_node.outputs[2], combine_node.inputs[2]) # Blue to Blue Channel
+        links.new(invert_node.outputs[0], combine_node.inputs[1]) # Inverted Green to Green Channel
+        links.new(combine_node.outputs[0], vector_node.inputs[0]) # Combined XYZ to Normal Map
+    links.new(vector_node.outputs[0], shader.inputs[nm_input])
+
+    offset_node_x(shader, vector_node)
+    shader.location[1] = bm_node.location[1]
+
+    output = get_node_type(nodes, "ShaderNodeOutputMaterial")
+    if output is None:
+        output = nodes.new("ShaderNodeOutputMaterial")
+    offset_node_x(output, shader)
+    links.new(shader.outputs[0], output.inputs[0])
+
+def create_material(mat_name, obj, file, context, assets_dir, convert_normalmap=False, proxy_level="FULL"):
+    textures = get_textures(obj, file, context, assets_dir)
+    if textures != None:
+        mat = bpy.data.materials.new(mat_name)
+        obj.data.materials.append(mat)
+        mat.use_nodes = True
+        create_dos2de_nodes(mat, context, textures, convert_normalmap, proxy_level)
+
+            #arrange_nodes(nodes, calc_priority_by_socket)
+        return True
+    #except Exception as e:
+    #    print("[DOS2DE-Importer:create_material] Error creating material for '{}':\n    {}".format(obj.name, e))
+    #    return False
+
+blender_suffix_pattern = re.compile(r"\.\d{3}$")
+
+# Race shorthands left by the importer's renaming, mapped back to the names the textures are under
+race_shorthands = dict((short, full) for full,short in rename_race_patterns)
+race_shorthand_pattern = re.compile(r"(?<![A-Za-z0-9])({})(?=_|$)".format("|".join(re.escape(x) for x in race_shorthands)))
+
+def get_object_texture_names(obj):
+    """The names to look an object's textures up by: its own name and its data's, without Blender's .001 suffixes.
+    Names shortened by the race renaming are tried with the full race name first."""
+    names = []
+    for name in (obj.name, obj.data.name):
+        name = blender_suffix_pattern.sub("", name).replace("_MeshShape", "")
+        full_name = race_shorthand_pattern.sub(lambda m: race_shorthands[m.group(0)], name)
+        for x in (full_name, name):
+            if not x in names:
+                names.append(x)
+    return names
+
+def is_dos2de_material(mat):
+    return blender_suffix_pattern.sub("", mat.name).endswith("_DOS2DE_PBR")
+
+def assign_material(obj, mat):
+    """Put the material in the object's empty slots, and the slots holding materials this addon built.
+    Other materials are kept. Returns False if there was no slot to put it in."""
+    if len(obj.material_slots) == 0:
+        obj.data.materials.append(mat)
+        return True
+    assigned = False
+    for slot in obj.material_slots:
+        if slot.material is None or is_dos2de_material(slot.material):
+            slot.material = mat
+            assigned = True
+    return assigned
+
+def rebuild_materials(context, objects, assets_dir, convert_normalmap=False, proxy_level="FULL"):
+    """Build DOS2DE PBR materials for many meshes at once, finding each one's textures from its name.
+
+    Every object's textures are resolved first, so each texture set's material is built once and shared
+    by all the objects using it. Returns (objects assigned a material, materials built).
+    """
+    texture_sets = {}
+    targets = []
+    for obj in objects:
+        if obj.type != "MESH":
+            continue
+        for name in get_object_texture_names(obj):
+            textures = get_textures(obj, name, context, assets_dir)
+            if textures is not None and any(x is not None for x in textures.textures):
+                key = tuple(textures.textures)
+                if not key in texture_sets:
+                    texture_sets[key] = (name, textures)
+                targets.append((obj, key))
+                break
+
+    window_manager = context.window_manager
+    window_manager.progress_begin(0, len(texture_sets) + len(targets))
+    built = 0
+    try:
+        materials = {}
+        for index,(key,(name,textures)) in enumerate(texture_sets.items()):
+            mat_name = "{}_DOS2DE_PBR".format(name)
+            mat = bpy.data.materials.get(mat_name)
+            if mat is None:
+                mat = bpy.data.materials.new(mat_name)
+                mat.use_nodes = True
+                create_dos2de_nodes(mat, context, textures, convert_normalmap, proxy_level)
+                built += 1
+            materials[key] = mat
+            window_manager.progress_update(index)
+
+        assigned = 0
+        for index,(obj,key) in enumerate(targets):
+            if assign_material(obj, materials[key]):
+                assigned += 1
+            window_manager.progress_update(len(texture_sets) + index)
+    finally:
+        window_manager.progress_end()
+    return (assigned, built)
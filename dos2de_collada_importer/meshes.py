@@ -0,0 +1,170 @@
+import bpy
+
+import hashlib
+
+import numpy as np
+
+def read_mesh_weights(obj):
+    """Returns (vertex indices, group indices, weights) arrays for every deform weight in the object's mesh.
+    Deform weights have no foreach_get, so this is the one per-vertex pass."""
+    vertices = []
+    groups = []
+    weights = []
+    for v in obj.data.vertices:
+        for g in v.groups:
+            vertices.append(v.index)
+            groups.append(g.group)
+            weights.append(g.weight)
+    return (np.array(vertices, dtype=np.int32), np.array(groups, dtype=np.int32), np.array(weights, dtype=np.float32))
+
+def clean_mesh_weights(obj, max_influences=4, threshold=0.001):
+    """Limit, prune and normalize an object's skin weights, and remove vertex groups left empty.
+    Returns a dict of counts of what changed."""
+    stats = {"limited": 0, "pruned": 0, "normalized": 0, "groups_removed": 0}
+    vertices,groups,weights = read_mesh_weights(obj)
+    if len(vertices) > 0:
+        # Sort by vertex, then by weight descending, to rank each vertex's influences
+        order = np.lexsort((-weights, vertices))
+        vertices = vertices[order]
+        groups = groups[order]
+        weights = weights[order]
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(vertices)) + 1])
+        counts = np.diff(np.concatenate([starts, [len(vertices)]]))
+        rank = np.arange(len(vertices)) - np.repeat(starts, counts)
+
+        over_limit = rank >= max_influences if max_influences > 0 else np.zeros(len(vertices), dtype=bool)
+        below_threshold = weights < threshold
+        # Always keep each vertex's strongest influence, so nothing ends up unweighted
+        keep = ~(over_limit | below_threshold) | (rank == 0)
+        stats["limited"] = int(np.count_nonzero(over_limit & ~keep))
+        stats["pruned"] = int(np.count_nonzero(below_threshold & ~over_limit & ~keep))
+
+        totals = np.bincount(vertices[keep], weights=weights[keep], minlength=int(vertices.max()) + 1)
+        new_weights = np.where(keep, weights / np.maximum(totals[vertices], 1e-12), 0.0)
+        changed = keep & (np.abs(new_weights - weights) > 1e-6)
+        stats["normalized"] = len(np.unique(vertices[changed]))
+
+        # Removals are written per group in bulk
+        for group_index in np.unique(groups[~keep]):
+            obj.vertex_groups[int(group_index)].remove(vertices[~keep & (groups == group_index)].tolist())
+
+        if np.any(changed):
+            updates = {}
+            for v,g,w in zip(vertices[changed].tolist(), groups[changed].tolist(), new_weights[changed].tolist()):
+                updates.setdefault(v, {})[g] = w
+            mesh_vertices = obj.data.vertices
+            for v,vertex_updates in updates.items():
+                for g in mesh_vertices[v].groups:
+                    weight = vertex_updates.get(g.group)
+                    if weight is not None:
+                        g.weight = weight
+
+        used = set(np.unique(groups[keep]).tolist())
+    else:
+        used = set()
+
+    empty = [vg for vg in obj.vertex_groups if not vg.index in used]
+    for vg in empty:
+        obj.vertex_groups.remove(vg)
+    stats["groups_removed"] = len(empty)
+    return stats
+
+mesh_hash_index = {}
+mesh_dedup_stats = {"meshes": 0, "bytes": 0}
+
+def get_material_key(mat):
+    """Identify a material by the textures it uses, so the per-object materials built for the same textures match."""
+    if mat is None:
+        return ""
+    if mat.node_tree is not None:
+        images = sorted(set(node.image.get("dos2de_source", node.image.filepath) for node in mat.node_tree.nodes
+            if node.type == "TEX_IMAGE" and node.image is not None))
+        if len(images) > 0:
+            return "|".join(images)
+    return mat.name
+
+def get_mesh_geometry_hash(obj):
+    """Hash an object's mesh positions, topology, UVs, vertex group names and material textures, read in bulk with foreach_get."""
+    mesh = obj.data
+    counts = (len(mesh.vertices), len(mesh.edges), len(mesh.loops), len(mesh.polygons))
+    sha = hashlib.sha1(repr(counts).encode())
+
+    co = np.empty(counts[0] * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", co)
+    sha.update(co.tobytes())
+
+    loop_vertices = np.empty(counts[2], dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_vertices)
+    sha.update(loop_vertices.tobytes())
+
+    loop_totals = np.empty(counts[3], dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", loop_totals)
+    sha.update(loop_totals.tobytes())
+
+    for uv_layer in mesh.uv_layers:
+        uv = np.empty(counts[2] * 2, dtype=np.float32)
+        uv_layer.data.foreach_get("uv", uv)
+        sha.update(uv.tobytes())
+
+    sha.update(";".join([group.name for group in obj.vertex_groups]).encode())
+    sha.update(";".join([get_material_key(mat) for mat in mesh.materials]).encode())
+    return sha.hexdigest()
+
+def mesh_weights_equal(a, b):
+    # Deform weights have no foreach_get, so they're only compared once the geometry hashes match
+    for va,vb in zip(a.vertices, b.vertices):
+        if len(va.groups) != len(vb.groups):
+            return False
+        for ga,gb in zip(va.groups, vb.groups):
+            if ga.group != gb.group or abs(ga.weight - gb.weight) > 1e-6:
+                return False
+    return True
+
+def estimate_mesh_size(mesh):
+    # Approximate sizes of Blender's MVert, MEdge, MLoop, MPoly, MLoopUV and MDeformVert structs
+    size = len(mesh.vertices) * 20 + len(mesh.edges) * 12 + len(mesh.loops) * 8 + len(mesh.polygons) * 12
+    size += len(mesh.uv_layers) * len(mesh.loops) * 12
+    if mesh.vertices and len(mesh.vertices[0].groups) > 0:
+        size += sum([len(v.groups) for v in mesh.vertices]) * 8 + len(mesh.vertices) * 16
+    return size
+
+def build_mesh_hash_index(context, exclude):
+    mesh_hash_index.clear()
+    indexed = set()
+    for obj in context.scene.objects:
+        if obj.type == "MESH" and not obj in exclude and not obj.data.name in indexed:
+            indexed.add(obj.data.name)
+            mesh_hash_index.setdefault(get_mesh_geometry_hash(obj), obj.data.name)
+
+def dedup_meshes(operator, context, objects):
+    """Share one mesh between objects with identical geometry, freeing the duplicates. Returns (meshes freed, bytes saved)."""
+    if len(mesh_hash_index) == 0:
+        build_mesh_hash_index(context, objects)
+
+    freed = 0
+    saved = 0
+    for obj in objects:
+        mesh = obj.data
+        mesh_hash = get_mesh_geometry_hash(obj)
+        shared = bpy.data.meshes.get(mesh_hash_index.get(mesh_hash, ""))
+        if shared is None or shared == mesh:
+            mesh_hash_index[mesh_hash] = mesh.name
+            continue
+        owner = next(iter([x for x in bpy.data.objects if x.data == shared]), None)
+        if owner is None or get_mesh_geometry_hash(owner) != mesh_hash or not mesh_weights_equal(mesh, shared):
+            mesh_hash_index[mesh_hash] = mesh.name
+            continue
+
+        print("[DOS2DE-Importer] Sharing mesh '{}' with '{}'.".format(shared.name, obj.name))
+        size = estimate_mesh_size(mesh)
+        materials = [mat for mat in mesh.materials if mat is not None]
+        obj.data = shared
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+            freed += 1
+            saved += size
+            # The material built for this object is replaced by the shared mesh's one, with the same textures
+            for mat in materials:
+                if mat.users == 0 and not mat.use_fake_user:
+                    bpy.data.materials.remove(mat)
+    return (freed, saved)
@@ -0,0 +1,65 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import bytes_to_mb
+from .materials import get_texture_search_name, get_textures
+
+class DOS2_Texture_Prefetcher():
+    """Reads the textures create_material will load for a batch in background threads.
+
+    Blender can only load images from a path, so the bytes are read into the OS page cache rather than
+    kept here. get_image's loads then read from memory instead of disk. Reading stops once limit bytes
+    have been read, so a huge batch doesn't push its own earlier textures back out of the cache.
+    """
+    def __init__(self, assets_dir, limit, workers=2, block_size=1048576):
+        self.assets_dir = assets_dir
+        self.limit = limit
+        self.block_size = block_size
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.queued = set()
+        self.total = 0
+        self.files = 0
+        self.stopped = False
+
+    def queue_file(self, load_filepath):
+        """Resolve and read the textures for a file that will be imported. Returns immediately."""
+        self.executor.submit(self.prefetch_file, get_texture_search_name(load_filepath))
+
+    def prefetch_file(self, name):
+        if self.stopped:
+            return
+        textures = get_textures(None, name, None, self.assets_dir)
+        if textures is None:
+            return
+        for path in textures.textures:
+            if path is None:
+                continue
+            with self.lock:
+                if path in self.queued:
+                    continue
+                self.queued.add(path)
+            self.read(path)
+
+    def read(self, path):
+        buffer = bytearray(self.block_size)
+        try:
+            with open(path, "rb", buffering=0) as f:
+                while not self.stopped:
+                    read = f.readinto(buffer)
+                    if not read:
+                        break
+                    with self.lock:
+                        self.total += read
+                        if self.limit > 0 and self.total >= self.limit:
+                            self.stopped = True
+            with self.lock:
+                self.files += 1
+        except OSError as e:
+            print("[DOS2DE-Importer] Failed to prefetch '{}': {}".format(path, e))
+
+    def stop(self):
+        """Stop reading. Reads that haven't started yet return right away."""
+        self.stopped = True
+        self.executor.shutdown(wait=False)
+        print("[DOS2DE-Importer] Prefetched '{}' textures ({:.2f} MB).".format(self.files, bytes_to_mb(self.total)))
@@ -0,0 +1,33 @@
+import cProfile
+import pstats
+
+class DOS2_Import_Profiler():
+    """Records every Python call made during an import batch with cProfile.
+
+    Stage timings show which pass is slow. The profile shows which calls inside it take the time.
+    Only created when profiling is enabled, so imports without it pay nothing.
+    """
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write_stats(self, path):
+        """Save the profile as a pstats file, for snakeviz or python -m pstats."""
+        self.profile.dump_stats(path)
+        return path
+
+    def get_hotspots(self, count):
+        """Returns (function, calls, own seconds, cumulative seconds) for the count calls with the most cumulative time."""
+        stats = pstats.Stats(self.profile)
+        # func -> (primitive calls, total calls, own time, cumulative time, callers)
+        entries = sorted(stats.stats.items(), key=lambda x: x[1][3], reverse=True)
+        return [(pstats.func_std_string(func), calls, tottime, cumtime) for func,(_,calls,tottime,cumtime,_) in entries[:count]]
+
+    def report_hotspots(self, operator, count):
+        for func,calls,tottime,cumtime in self.get_hotspots(count):
+            operator.report({'INFO'}, "[DOS2DE-Importer] {:.3f}s cumulative, {:.3f}s own, '{}' calls: {}".format(cumtime, tottime, calls, func))
@@ -0,0 +1,144 @@
+import bpy
+
+import os
+import re
+
+rename_race_patterns = [
+    ("Dwarves_Female", "DF"),
+    ("Dwarves_Male", "DM"),
+    ("Elves_Female", "EF"),
+    ("Elves_Male", "EM"),
+    ("Humans_Female", "HF"),
+    ("Humans_Male", "HM"),
+    ("Lizards_Female", "LF"),
+    ("Lizards_Male", "LM")
+]
+
+rename_patterns = [
+    ("_MeshShape", "")
+]
+
+lastNum = re.compile(r'(?:[^\d]*(\d+)[^\d]*)+')
+
+def increment_string(s):
+    m = lastNum.search(s)
+    if m:
+        next = str(int(m.group(1))+1)
+        start, end = m.span(1)
+        s = s[:max(end-len(next), start)] + next + s[end:]
+    else:
+        s = s + "_1"
+    return s
+
+def get_rename_stem(load_filepath):
+    filename = os.path.basename(load_filepath).replace("-temp", "")
+    index_of_dot = filename.find('.')
+    if index_of_dot >= 0:
+        filename = filename[:index_of_dot]
+    return filename
+
+class DOS2_Rename_Table():
+    """A set of find/replace patterns compiled into one regex, with the replacements in a lookup table.
+
+    Every pattern is replaced in a single pass over the name. Longer patterns are tried first, so a pattern
+    that contains another one wins over it.
+    """
+    def __init__(self, patterns):
+        self.lookup = {}
+        for find,replace in patterns:
+            if find != "" and not find in self.lookup:
+                self.lookup[find] = replace
+        self.regex = None
+        if len(self.lookup) > 0:
+            keys = sorted(self.lookup.keys(), key=len, reverse=True)
+            self.regex = re.compile("|".join(re.escape(x) for x in keys))
+
+    def apply(self, name):
+        if self.regex is None:
+            return name
+        return self.regex.sub(lambda m: self.lookup[m.group(0)], name)
+
+rename_tables = {}
+
+def get_rename_table(use_race, use_junk, user_patterns=()):
+    """Returns the compiled table for this combination of pattern sets, compiling it on first use."""
+    key = (use_race, use_junk, tuple(user_patterns))
+    table = rename_tables.get(key)
+    if table is None:
+        patterns = list(user_patterns)
+        if use_race:
+            patterns.extend(rename_race_patterns)
+        if use_junk:
+            patterns.extend(rename_patterns)
+        table = DOS2_Rename_Table(patterns)
+        rename_tables[key] = table
+    return table
+
+def get_user_rename_patterns(context):
+    """The enabled find/replace patterns from the addon preferences."""
+    if "dos2de_collada_importer" in context.user_preferences.addons:
+        preferences = context.user_preferences.addons["dos2de_collada_importer"].preferences
+        if preferences is not None and "rename_user_patterns" in preferences:
+            return tuple((x.find, x.replace) for x in preferences.rename_user_patterns if x.enabled and x.find != "")
+    return ()
+
+def plan_renames(objects, load_filepath, config):
+    """Compute the target name of every object in one pass, with the config's rename tables. Returns a list of (object, next_name).
+
+    Collisions are resolved against a set of the names already taken, by both objects and the object's
+    data type, so the names Blender ends up with match the planned ones.
+    """
+    stem = get_rename_stem(load_filepath)
+    renaming = set()
+    targets = []
+    for obj in objects:
+        rename_option = "DISABLED"
+        name_prefix = ""
+        if obj.type == "ARMATURE":
+            rename_option = config.rename_armatures
+            name_prefix = "Arm_"
+        elif obj.type == "MESH":
+            rename_option = config.rename_meshes
+
+        if rename_option == "DISABLED":
+            continue
+        if rename_option == "FILE" or rename_option == "FILE_SHORTHAND":
+            next_name = "{}{}".format(name_prefix, stem)
+        else:
+            next_name = "{}{}".format(name_prefix, obj.name)
+        table = config.rename_table_file if rename_option == "FILE" else config.rename_table_shorthand
+        next_name = table.apply(next_name)
+        if next_name != "":
+            targets.append((obj, next_name))
+            renaming.add(obj.as_pointer())
+            renaming.add(obj.data.as_pointer())
+
+    if len(targets) == 0:
+        return targets
+
+    # Names held by the objects being renamed are free, since they're all renamed together
+    taken_objects = set(x.name for x in bpy.data.objects if not x.as_pointer() in renaming)
+    taken_data = {
+        "ARMATURE": set(x.name for x in bpy.data.armatures if not x.as_pointer() in renaming),
+        "MESH": set(x.name for x in bpy.data.meshes if not x.as_pointer() in renaming)
+    }
+    planned = []
+    for obj,next_name in targets:
+        taken = taken_data[obj.type]
+        while next_name in taken or next_name in taken_objects:
+            next_name = increment_string(next_name)
+        taken.add(next_name)
+        taken_objects.add(next_name)
+        planned.append((obj, next_name))
+    return planned
+
+def apply_renames(planned):
+    """Rename the planned objects and their data in bulk."""
+    # Move everything out of the way first, so a name another renamed object still holds doesn't get a suffix
+    for index,(obj,next_name) in enumerate(planned):
+        temp_name = "__dos2de_rename_{}".format(index)
+        obj.name = temp_name
+        obj.data.name = temp_name
+    for obj,next_name in planned:
+        obj.name = next_name
+        obj.data.name = next_name
@@ -0,0 +1,115 @@
+import bpy
+
+import os
+import sys
+import gc
+import hashlib
+
+def get_manifest_key(filepath):
+    return os.path.normcase(os.path.abspath(filepath))
+
+def get_stat_key(filepath):
+    stat = os.stat(filepath)
+    return "{}:{}".format(stat.st_size, stat.st_mtime_ns)
+
+def get_file_hash(filepath, block_size=1048576):
+    sha = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+file_hash_cache = {}
+
+def get_cached_file_hash(filepath):
+    """get_file_hash, memoized by the file's size and modification time."""
+    stat_key = get_stat_key(filepath)
+    cached = file_hash_cache.get(filepath)
+    if cached is None or cached[0] != stat_key:
+        cached = (stat_key, get_file_hash(filepath))
+        file_hash_cache[filepath] = cached
+    return cached[1]
+
+def get_cache_dir(name):
+    return bpy.utils.user_resource("DATAFILES", path=os.path.join("dos2de_collada_importer", name), create=True)
+
+def touch_cache_file(path):
+    """Mark a cached file as just used. Its modification time tracks the last use, for evict_cache."""
+    os.utime(path, None)
+
+def evict_cache(cache_dir, limit, suffix="", remove=os.remove):
+    """Delete the least recently used files ending with suffix in a cache directory, until they fit in limit bytes.
+    remove deletes one file, along with anything kept beside it. Returns the paths deleted."""
+    entries = []
+    total = 0
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and entry.name.endswith(suffix):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+    entries.sort()
+    evicted = []
+    for mtime,size,path in entries:
+        if total <= limit:
+            break
+        try:
+            remove(path)
+            total -= size
+            evicted.append(path)
+        except OSError:
+            pass
+    return evicted
+
+def get_process_memory():
+    """Returns the (current, peak) resident memory of the Blender process in bytes."""
+    if os.name == "nt":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return (counters.WorkingSetSize, counters.PeakWorkingSetSize)
+        return (0, 0)
+    else:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux, bytes on macOS
+        if not sys.platform.startswith("darwin"):
+            peak = peak * 1024
+        current = peak
+        try:
+            with open("/proc/self/statm") as f:
+                current = int(f.read().split()[1]) * resource.getpagesize()
+        except (OSError, IndexError, ValueError):
+            pass
+        return (current, peak)
+
+def purge_orphan_data():
+    """Remove datablocks with no users, like Blender does when saving and reloading. Returns the amount removed."""
+    removed = 0
+    for attr in ["meshes", "armatures", "materials", "textures", "images", "actions"]:
+        collection = getattr(bpy.data, attr)
+        for block in [x for x in collection if x.users == 0 and not x.use_fake_user]:
+            collection.remove(block)
+            removed += 1
+    gc.collect()
+    return removed
+
+def bytes_to_mb(size):
+    return size / 1048576.0
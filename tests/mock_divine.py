@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""A stand-in for divine, for testing how the importer handles conversions that hang or crash.
+
+Takes the same -s, -d and -a arguments the importer passes. Sources with "hang" in their name
+make it write part of the dae and sleep, and sources with "crash" make it write part of the dae
+and exit with an error. Anything else is written as a complete dae.
+"""
+import os
+import sys
+import time
+
+hang_seconds = 60
+
+def convert(source, dest):
+    name = os.path.basename(source)
+    with open(dest, "w") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<COLLADA>\n')
+        f.flush()
+        if "hang" in name:
+            time.sleep(hang_seconds)
+        if "crash" in name:
+            print("Crashed converting '{}'.".format(source))
+            sys.exit(3)
+        f.write("</COLLADA>\n")
+    print("Converted '{}'.".format(source))
+
+def main(argv):
+    source = argv[argv.index("-s") + 1]
+    dest = argv[argv.index("-d") + 1]
+    if argv[argv.index("-a") + 1] == "convert-models":
+        for name in sorted(os.listdir(source)):
+            convert(os.path.join(source, name), os.path.join(dest, os.path.splitext(name)[0] + ".dae"))
+    else:
+        convert(source, dest)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,98 @@
+"""Tests for divine conversions that hang or crash, run against mock_divine.py instead of divine.
+
+These run outside Blender: bpy is replaced by the little the conversion code uses, and the addon's
+modules are loaded without its __init__, which registers the Blender UI.
+"""
+import os
+import sys
+import time
+import types
+import shutil
+import tempfile
+import unittest
+import importlib
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+addon_dir = os.path.join(os.path.dirname(tests_dir), "dos2de_collada_importer")
+mock_divine_path = os.path.join(tests_dir, "mock_divine.py")
+
+def load_divine(cache_dir):
+    bpy = types.ModuleType("bpy")
+    bpy.utils = types.SimpleNamespace(user_resource=lambda resource_type, path="", create=False:
+        os.makedirs(os.path.join(cache_dir, path), exist_ok=True) or os.path.join(cache_dir, path))
+    sys.modules["bpy"] = bpy
+    addon = types.ModuleType("dos2de_collada_importer")
+    addon.__path__ = [addon_dir]
+    sys.modules["dos2de_collada_importer"] = addon
+    for name in ("divine", "divine_service", "utils"):
+        sys.modules.pop("dos2de_collada_importer." + name, None)
+    return importlib.import_module("dos2de_collada_importer.divine")
+
+class Operator():
+    def __init__(self):
+        self.reports = []
+
+    def report(self, report_type, message):
+        self.reports.append((report_type, message))
+
+@unittest.skipIf(os.name == "nt", "mock_divine.py is run through its shebang")
+class DivineConversionTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="dos2de_test_")
+        self.divine = load_divine(os.path.join(self.temp_dir, "cache"))
+        self.config = types.SimpleNamespace(divine_path=mock_divine_path, divine_timeout=2, divine_timeout_per_mb=0.0,
+            divine_retries=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def make_gr2(self, name):
+        path = os.path.join(self.temp_dir, name + ".gr2")
+        with open(path, "wb") as f:
+            f.write(b"gr2")
+        return path
+
+    def test_supervised_converts(self):
+        dae_path = self.divine.convert_granny_supervised(Operator(), self.make_gr2("good"), self.config)
+        self.assertIsNotNone(dae_path)
+        self.assertTrue(self.divine.is_collada_complete(dae_path))
+
+    def test_supervised_quarantines_crash(self):
+        path = self.make_gr2("crash")
+        self.assertIsNone(self.divine.convert_granny_supervised(Operator(), path, self.config))
+        self.assertIsNotNone(self.divine.get_quarantine_reason(path, mock_divine_path))
+        self.assertTrue(self.divine.skip_quarantined(Operator(), path, mock_divine_path))
+
+    def test_supervised_stops_hang(self):
+        path = self.make_gr2("hang")
+        start = time.time()
+        self.assertIsNone(self.divine.convert_granny_supervised(Operator(), path, self.config))
+        # mock_divine sleeps for a minute when it isn't stopped
+        self.assertLess(time.time() - start, 30)
+        self.assertFalse(os.path.isfile(self.divine.get_granny_temp_path(path)))
+        self.assertIsNotNone(self.divine.get_quarantine_reason(path, mock_divine_path))
+
+    def test_quarantine_ignores_other_settings(self):
+        path = self.make_gr2("crash")
+        self.divine.convert_granny_supervised(Operator(), path, self.config)
+        self.assertIsNone(self.divine.get_quarantine_reason(path, mock_divine_path, self.make_gr2("skeleton")))
+        self.assertIsNone(self.divine.get_quarantine_reason(path, mock_divine_path + ".old"))
+
+    def test_batch_drops_crashed_output(self):
+        good = self.make_gr2("A_good")
+        crash = self.make_gr2("C_crash")
+        results = self.divine.convert_granny_batch(None, [good, crash], mock_divine_path, timeout=10)
+        self.assertEqual(list(results.keys()), [good])
+
+    def test_batch_drops_hung_output(self):
+        good = self.make_gr2("A_good")
+        hang = self.make_gr2("H_hang")
+        results = self.divine.convert_granny_batch(None, [good, hang], mock_divine_path, timeout=2)
+        self.assertEqual(list(results.keys()), [good])
+
+    def test_scratch_stops_hang(self):
+        reader = lambda dae_path: dae_path
+        self.assertIsNone(self.divine.read_granny_scratch(self.make_gr2("hang"), mock_divine_path, reader, timeout=1))
+
+if __name__ == "__main__":
+    unittest.main()